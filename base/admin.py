@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Room, Topic, Message, User, Property, PropertyImage
+from .models import Room, Topic, Message, User, Property, PropertyImage, Amenity, Place, SimilarProperty, Job, MediaBlob
 
 
 @admin.register(Property)
@@ -11,12 +11,46 @@ class PropertyAdmin(admin.ModelAdmin):
     readonly_fields = ['created', 'updated']
 
 
+@admin.register(Amenity)
+class AmenityAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug']
+    search_fields = ['name']
+
+
+@admin.register(Place)
+class PlaceAdmin(admin.ModelAdmin):
+    list_display = ['name', 'latitude', 'longitude']
+    search_fields = ['name']
+    prepopulated_fields = {'slug': ['name']}
+
+
+@admin.register(SimilarProperty)
+class SimilarPropertyAdmin(admin.ModelAdmin):
+    list_display = ['property', 'rank', 'similar', 'score']
+    raw_id_fields = ['property', 'similar']
+
+
 @admin.register(PropertyImage)
 class PropertyImageAdmin(admin.ModelAdmin):
     list_display = ['property', 'caption', 'created']
     list_filter = ['created']
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'attempts', 'run_at', 'locked_by', 'updated']
+    list_filter = ['status', 'task']
+    search_fields = ['task', 'key']
+    readonly_fields = ['created', 'updated', 'last_error']
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'refs', 'created', 'updated']
+    search_fields = ['name']
+    readonly_fields = ['name', 'refs', 'created', 'updated']
+
+
 admin.site.register(User)
 admin.site.register(Room)
 admin.site.register(Topic)
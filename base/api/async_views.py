@@ -0,0 +1,84 @@
+"""Async versions of the read-only API endpoints, under /api/async/
+
+Each returns the same bytes as its sync counterpart in views.py. All but
+properties() read through the async ORM (aget, and async for in
+FastSerializer.aserialize), so under ASGI the event loop serves other
+requests while a query runs; see keja/asgi.py. Django 4.1's database
+backends are synchronous, so the async ORM still runs each query in a
+worker thread, but only for the query, and serialization stays on the
+event loop. properties() is the exception: the search form and
+KeysetPaginator are sync code, so the whole page is built in a thread with
+sync_to_async.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.renderers import JSONRenderer
+
+from base.conditional import async_condition, properties_etag, property_etag, room_etag, room_last_modified, rooms_etag
+from base.models import Message, Property, Room
+
+from .serializers import PropertySerializer, RoomSerializer, message_list, room_list
+from .views import ACTIVITY_LIMIT, property_page
+
+NOT_FOUND = {'detail': 'Not found.'}
+
+
+def _json(data, status=200):
+    # What Response renders for a JSON client, without DRF's sync-only view machinery
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def require_safe(view):
+    # django.views.decorators.http.require_safe only wraps sync views in 4.1
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+@require_safe
+@async_condition(etag_func=rooms_etag)
+async def rooms(request):
+    return _json(await room_list.aserialize(Room.objects.all()))
+
+
+@require_safe
+@async_condition(etag_func=room_etag, last_modified_func=room_last_modified)
+async def room(request, pk):
+    try:
+        room = await Room.objects.prefetch_related('participants').aget(id=pk)
+    except Room.DoesNotExist:
+        return _json(NOT_FOUND, status=404)
+    return _json(RoomSerializer(room).data)
+
+
+@require_safe
+@async_condition(etag_func=properties_etag)
+async def properties(request):
+    # The search form and KeysetPaginator are sync code
+    status, payload = await sync_to_async(property_page)(request.GET)
+    return _json(payload, status=status)
+
+
+@require_safe
+@async_condition(etag_func=property_etag)
+async def property_detail(request, pk):
+    try:
+        fields = PropertySerializer.parse_fields(request.GET.get('fields')) or PropertySerializer.Meta.fields
+    except ValueError as e:
+        return _json({'fields': [str(e)]}, status=400)
+    properties = PropertySerializer.with_fields(Property.objects.filter(is_available=True), fields)
+    try:
+        property = await properties.aget(pk=pk)
+    except Property.DoesNotExist:
+        return _json(NOT_FOUND, status=404)
+    return _json(PropertySerializer(property, fields=fields).data)
+
+
+@require_safe
+async def activity(request):
+    return _json(await message_list.aserialize(Message.objects.all()[:ACTIVITY_LIMIT]))
@@ -0,0 +1,219 @@
+"""Read-only list serialization straight from .values_list() rows
+
+FastSerializer(RoomSerializer) compiles the fields of a ModelSerializer once
+into (column, converter) steps, then turns each row tuple into the dict the
+serializer would build from a model instance: the same keys in the same
+order and the same values, so JSON responses come out byte for byte the
+same. No model instances are built and DRF's per-field attribute lookup is
+skipped; many-to-many fields are read with one query per batch of rows.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+# Fields whose to_representation() of a database value is the value itself
+PASSTHROUGH = (
+    serializers.BooleanField, serializers.CharField, serializers.FloatField, serializers.IntegerField,
+)
+
+
+def _lookup(field, prefix):
+    return prefix + field.source.replace('.', '__')
+
+
+class PerBatch:
+    """A converter made afresh for each batch of rows, by make()"""
+
+    def __init__(self, make):
+        self.make = make
+
+
+def _file_url(model_field):
+    storage = model_field.storage
+
+    def make():
+        urls = {}
+
+        def convert(name):
+            # FileField.to_representation without a request in the context;
+            # most rows share a few names, such as a default image
+            if name not in urls:
+                urls[name] = storage.url(name) if name else None
+            return urls[name]
+        return convert
+    return PerBatch(make)
+
+
+def _datetime(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+
+    def make():
+        # The current time zone is looked up once per batch, not per value
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            if isinstance(value, str) or timezone.is_naive(value):
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+    return PerBatch(make)
+
+
+def _bind(steps):
+    """steps with each PerBatch converter made"""
+    return [
+        (name, column, _bind(convert) if isinstance(convert, list) else
+         convert.make() if isinstance(convert, PerBatch) else convert)
+        for name, column, convert in steps
+    ]
+
+
+class FastSerializer:
+    """The many=True output of a ModelSerializer, without model instances
+
+    Supports plain model fields, files, primary-key relations, nested
+    serializers of foreign keys and, at the top level, many-to-many fields
+    rendered as primary keys or slugs. Anything else raises TypeError when
+    the serializer is first used. Serializers are compiled without a request
+    in their context, as the list endpoints use them.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self._steps = None
+
+    @property
+    def steps(self):
+        # Compiled on first use: building a ModelSerializer's fields needs the app registry
+        if self._steps is None:
+            self.lookups = []
+            self.many = []
+            self._steps = self._compile(self.serializer_class(), '')
+        return self._steps
+
+    def _column(self, lookup):
+        if lookup not in self.lookups:
+            self.lookups.append(lookup)
+        return self.lookups.index(lookup)
+
+    def _compile(self, serializer, prefix):
+        """[(name, column index or many-to-many key, convert or nested steps)] of a serializer"""
+        model = serializer.Meta.model
+        steps = []
+        for field in serializer._readable_fields:
+            lookup = _lookup(field, prefix)
+            if isinstance(field, serializers.ManyRelatedField):
+                if prefix:
+                    raise TypeError(f'{field.field_name}: many-to-many fields are only supported at the top level')
+                child = field.child_relation
+                if isinstance(child, serializers.SlugRelatedField):
+                    target = child.slug_field
+                elif isinstance(child, serializers.PrimaryKeyRelatedField) and child.pk_field is None:
+                    target = 'pk'
+                else:
+                    raise TypeError(f'{field.field_name}: unsupported related field {type(child).__name__}')
+                self.many.append((field.source, target))
+                steps.append((field.field_name, None, len(self.many) - 1))
+            elif isinstance(field, serializers.ModelSerializer):
+                # A nested foreign key is None when the key is, like DRF's
+                steps.append((field.field_name, self._column(lookup), self._compile(field, lookup + '__')))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                steps.append((field.field_name, self._column(lookup), None))
+            elif isinstance(field, serializers.FileField):
+                model_field = model._meta.get_field(field.source)
+                steps.append((field.field_name, self._column(lookup), _file_url(model_field)))
+            elif isinstance(field, serializers.RelatedField):
+                raise TypeError(f'{field.field_name}: unsupported related field {type(field).__name__}')
+            elif type(field) in PASSTHROUGH:
+                steps.append((field.field_name, self._column(lookup), None))
+            elif type(field) is serializers.DateTimeField:
+                steps.append((field.field_name, self._column(lookup), _datetime(field)))
+            elif isinstance(field, serializers.SerializerMethodField):
+                raise TypeError(f'{field.field_name}: unsupported field {type(field).__name__}')
+            else:
+                steps.append((field.field_name, self._column(lookup), field.to_representation))
+        return steps
+
+    def _many_rows(self, pks):
+        """(pk, value) querysets of each many-to-many field, in prefetch_related() order"""
+        querysets = []
+        for source, target in self.many:
+            related = self.model._meta.get_field(source)
+            query_name = related.related_query_name()
+            rows = related.related_model._default_manager.filter(**{f'{query_name}__in': pks})
+            if not related.related_model._meta.ordering:
+                # What SQLite returns a prefetch in without an ordering: the
+                # through table's (from, to) unique index order
+                rows = rows.order_by(query_name, 'pk')
+            querysets.append(rows.values_list(query_name, target))
+        return querysets
+
+    def _many_values(self, pks):
+        """[{pk: [value, ...]}] of each many-to-many field"""
+        found = []
+        for rows in self._many_rows(pks):
+            values = defaultdict(list)
+            for pk, value in rows:
+                values[pk].append(value)
+            found.append(values)
+        return found
+
+    def _build(self, steps, row, many, pk):
+        data = {}
+        for name, column, convert in steps:
+            if column is None:
+                data[name] = many[convert].get(pk, [])
+                continue
+            value = row[column]
+            if value is None:
+                data[name] = None
+            elif convert is None:
+                data[name] = value
+            elif isinstance(convert, list):
+                data[name] = self._build(convert, row, many, pk)
+            else:
+                data[name] = convert(value)
+        return data
+
+    def _rows(self, queryset):
+        self.steps  # compiles, filling in self.lookups
+        return queryset.values_list('pk', *self.lookups)
+
+    def _batch(self, rows, many=None):
+        if many is None:
+            many = self._many_values([row[0] for row in rows]) if self.many else ()
+        steps = _bind(self.steps)
+        # Lookups are numbered from 0, row tuples start with the pk
+        return [self._build(steps, row[1:], many, row[0]) for row in rows]
+
+    def serialize(self, queryset):
+        """serializer_class(queryset, many=True).data, as a list of dicts"""
+        return self._batch(list(self._rows(queryset)))
+
+    async def aserialize(self, queryset):
+        """serialize() through the async ORM, for async views"""
+        rows = [row async for row in self._rows(queryset)]
+        many = []
+        for related in self._many_rows([row[0] for row in rows]) if self.many else ():
+            values = defaultdict(list)
+            async for pk, value in related:
+                values[pk].append(value)
+            many.append(values)
+        return self._batch(rows, many)
+
+    def iterate(self, queryset, batch_size=2000):
+        """The same dicts one at a time, reading batch_size rows per query"""
+        rows = self._rows(queryset).iterator(chunk_size=batch_size)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield from self._batch(batch)
+                batch = []
+        yield from self._batch(batch)
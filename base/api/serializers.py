@@ -1,8 +1,102 @@
-from rest_framework.serializers import ModelSerializer
-from base.models import Room
+from rest_framework.serializers import CharField, FloatField, ModelSerializer, SerializerMethodField, SlugRelatedField
+from base import images
+from base.models import Message, Room, Property, User
+from .fast import FastSerializer
 
 
 class RoomSerializer(ModelSerializer):
     class Meta:
         model = Room
         fields = '__all__'
+
+
+class LandlordSerializer(ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'name', 'avatar']
+
+
+class PropertySerializer(ModelSerializer):
+    """Property with sparse fieldsets: PropertySerializer(..., fields=[...])
+
+    Use with_fields() on the queryset so that only the columns of the
+    requested fields are loaded, with the landlord joined in the same query.
+    """
+    landlord = LandlordSerializer(read_only=True)
+    amenities = SlugRelatedField(source='amenity_tags', slug_field='name', many=True, read_only=True)
+    # Kilometres from the search point, on searches sorted by distance
+    distance = FloatField(read_only=True, allow_null=True, default=None)
+    # {'webp': 'url 320w, ...', 'jpeg': ...} of main_image's variants, null until they're built
+    image_srcset = SerializerMethodField()
+
+    # Served when a list call doesn't ask for fields=
+    DEFAULT_FIELDS = [
+        'id', 'title', 'property_type', 'rent_amount', 'location', 'bedrooms', 'bathrooms',
+        'area_sqft', 'excerpt', 'is_available', 'image_srcset', 'latitude', 'longitude', 'distance', 'landlord',
+        'created',
+    ]
+    # Model columns behind the fields that aren't plain columns
+    COLUMNS = {
+        'landlord': ['landlord__id', 'landlord__username', 'landlord__name', 'landlord__avatar'],
+        'amenities': [],
+        'distance': [],
+        'image_srcset': ['main_image', 'main_image_variants'],
+    }
+
+    class Meta:
+        model = Property
+        fields = [
+            'id', 'title', 'property_type', 'rent_amount', 'location', 'address', 'bedrooms', 'bathrooms',
+            'area_sqft', 'excerpt', 'description', 'amenities', 'is_available', 'date_available',
+            'main_image', 'image_srcset', 'latitude', 'longitude', 'distance', 'landlord', 'created', 'updated',
+        ]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_image_srcset(self, property):
+        return images.srcset(property.main_image.name, property.main_image_variants)
+
+    @classmethod
+    def parse_fields(cls, value):
+        """Field names of a fields= parameter, or None for the defaults
+
+        Raises ValueError naming any unknown field.
+        """
+        if not value:
+            return None
+        fields = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in fields if name not in cls.Meta.fields]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+        return fields
+
+    @classmethod
+    def with_fields(cls, queryset, fields):
+        """Load only what fields need: a fixed number of queries per page"""
+        columns = {'id', 'created'}
+        for name in fields:
+            columns.update(cls.COLUMNS.get(name, [name]))
+        if 'landlord' in fields:
+            queryset = queryset.select_related('landlord')
+        if 'amenities' in fields:
+            queryset = queryset.prefetch_related('amenity_tags')
+        return queryset.only(*columns)
+
+
+class MessageSerializer(ModelSerializer):
+    user = LandlordSerializer(read_only=True)
+    room_name = CharField(source='room.name', read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'user', 'room', 'room_name', 'body', 'created']
+
+
+# Read-only lists of many rows, built from .values_list() rows: the same
+# output as RoomSerializer(rooms, many=True).data, several times faster
+room_list = FastSerializer(RoomSerializer)
+message_list = FastSerializer(MessageSerializer)
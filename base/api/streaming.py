@@ -0,0 +1,40 @@
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+NDJSON = 'application/x-ndjson'
+CHUNK_SIZE = 500
+
+
+def _batches(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def json_chunks(items, serialize, ndjson=False, batch_size=CHUNK_SIZE):
+    """Encode items as a JSON array, or as NDJSON, one batch per chunk
+
+    Each item is rendered on its own by the same renderer as Response, so the
+    array is byte-for-byte what a non-streaming Response would send.
+    """
+    render = JSONRenderer().render
+    if ndjson:
+        for batch in _batches(items, batch_size):
+            yield b''.join(render(serialize(item)) + b'\n' for item in batch)
+        return
+    yield b'['
+    separator = b''
+    for batch in _batches(items, batch_size):
+        yield separator + b','.join(render(serialize(item)) for item in batch)
+        separator = b','
+    yield b']'
+
+
+def streaming_json_response(items, serialize, ndjson=False, batch_size=CHUNK_SIZE):
+    """StreamingHttpResponse of json_chunks(): memory stays flat whatever the row count"""
+    return StreamingHttpResponse(
+        json_chunks(items, serialize, ndjson, batch_size),
+        content_type=NDJSON if ndjson else 'application/json',
+    )
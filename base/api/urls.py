@@ -1,8 +1,23 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('',  views.getRoutes),
     path('rooms/', views.getRooms),
-    path('rooms/<str:pk>/', views.getRoom),
+    path('rooms/batch/', views.getRoomBatch),
+    path('rooms/<int:pk>/', views.getRoom),
+    path('properties/', views.getProperties),
+    path('properties/facets/', views.getPropertyFacets),
+    path('properties/batch/', views.getPropertyBatch),
+    path('properties/<int:pk>/', views.getProperty),
+    path('search-cache/', views.getSearchCacheStats),
+    path('activity/', views.getActivity),
+    path('export/<str:kind>/', views.getExport),
+
+    # The same read endpoints as async views, for ASGI deployments
+    path('async/rooms/', async_views.rooms),
+    path('async/rooms/<int:pk>/', async_views.room),
+    path('async/properties/', async_views.properties),
+    path('async/properties/<int:pk>/', async_views.property_detail),
+    path('async/activity/', async_views.activity),
 ]
@@ -1,7 +1,20 @@
-from rest_framework.decorators import api_view
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from base.models import Room
-from .serializers import RoomSerializer
+from base import export, search_cache
+from base.conditional import properties_etag, property_etag, room_etag, room_last_modified, rooms_etag
+from base.facets import search_facets
+from base.forms import PropertySearchForm
+from base.models import Message, Room, Property
+from base.pagination import KeysetPaginator, cursor_filters
+from base.search import search_properties
+from .serializers import RoomSerializer, PropertySerializer, message_list, room_list
+from .streaming import CHUNK_SIZE, streaming_json_response
 from base.api import serializers
 
 
@@ -10,20 +23,208 @@ def getRoutes(request):
     routes = [
         'GET /api',
         'GET /api/rooms',
-        'GET /api/rooms/:id'
+        'GET /api/rooms?stream=json|ndjson',
+        'GET /api/rooms/batch?ids=1,2,3',
+        'GET /api/rooms/:id',
+        'GET /api/properties',
+        'GET /api/properties/:id',
+        'GET /api/properties/facets',
+        'GET /api/properties/batch?ids=1,2,3',
+        'GET /api/activity',
+        'GET /api/search-cache',
+        'GET /api/export/:kind',
+        'GET /api/async/rooms',
+        'GET /api/async/rooms/:id',
+        'GET /api/async/properties',
+        'GET /api/async/properties/:id',
+        'GET /api/async/activity'
     ]
     return Response(routes)
 
 
+@condition(etag_func=rooms_etag)
 @api_view(['GET'])
 def getRooms(request):
     rooms = Room.objects.all()
-    serializer = RoomSerializer(rooms, many=True)
-    return Response(serializer.data)
+    # ?stream=json or ?stream=ndjson: written out in chunks as rows are read
+    stream = request.query_params.get('stream')
+    if stream in ('json', 'ndjson'):
+        return streaming_json_response(
+            room_list.iterate(rooms, batch_size=CHUNK_SIZE),
+            lambda data: data,
+            ndjson=stream == 'ndjson',
+        )
+    return Response(room_list.serialize(rooms))
 
 
+@api_view(['GET'])
+def getRoomBatch(request):
+    # ?ids=3,1,2: the rooms in that order in one id__in query, plus one for
+    # participants, instead of a getRoom call each
+    try:
+        ids = parse_ids(request.query_params.get('ids', ''))
+    except ValueError as e:
+        return Response({'ids': [str(e)]}, status=400)
+    rooms = room_list.serialize(Room.objects.filter(id__in=ids))
+    return Response(batch_payload(ids, {room['id']: room for room in rooms}))
+
+
+@condition(etag_func=room_etag, last_modified_func=room_last_modified)
 @api_view(['GET'])
 def getRoom(request, pk):
-    room = Room.objects.get(id=pk)
+    room = get_object_or_404(Room, id=pk)
     serializer = RoomSerializer(room, many=False)
     return Response(serializer.data)
+
+
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 100
+
+
+def parse_ids(value):
+    """Distinct ids of an ids=1,2,3 parameter, in the order given
+
+    Raises ValueError on a non-integer id or more than MAX_BATCH_SIZE ids.
+    """
+    try:
+        ids = list(dict.fromkeys(int(id) for id in value.split(',') if id.strip()))
+    except ValueError:
+        raise ValueError('Enter a comma-separated list of ids.')
+    if not ids:
+        raise ValueError('Enter at least one id.')
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'Ask for at most {MAX_BATCH_SIZE} ids.')
+    return ids
+
+
+def batch_payload(ids, found, serialize=list):
+    """{'results': [...], 'missing': [...]} of ids, given {id: object} of those found
+
+    serialize turns the objects found, in the order of ids, into the results.
+    """
+    return {
+        'results': serialize([found[id] for id in ids if id in found]),
+        'missing': [id for id in ids if id not in found],
+    }
+
+
+def property_page(params):
+    """(status, payload) of a page of getProperties, shared with the async view"""
+    try:
+        fields = PropertySerializer.parse_fields(params.get('fields')) or PropertySerializer.DEFAULT_FIELDS
+    except ValueError as e:
+        return 400, {'fields': [str(e)]}
+    try:
+        limit = min(max(int(params.get('limit', search_cache.PER_PAGE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return 400, {'limit': ['Enter a whole number.']}
+
+    cursor = params.get('cursor')
+    filters = cursor_filters(cursor)
+    if filters is None:
+        filters = PropertySearchForm.filters_from(params)
+    form = PropertySearchForm(filters)
+    if not form.is_valid():
+        return 400, form.errors
+    properties = PropertySerializer.with_fields(search_properties(form.cleaned_data), fields)
+    page = KeysetPaginator(properties, limit).get_page(cursor, filters)
+    return 200, {
+        'results': PropertySerializer(page, many=True, fields=fields).data,
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+@condition(etag_func=properties_etag)
+@api_view(['GET'])
+def getProperties(request):
+    # Same filters as the home page search, including near/lat/lng/radius
+    # and bbox; a cursor carries the filters of the search it was issued for.
+    # fields=id,title,... picks the columns, limit= the page size. One query
+    # per page, two with amenities; no COUNT.
+    status, payload = property_page(request.query_params)
+    return Response(payload, status=status)
+
+
+@condition(etag_func=property_etag)
+@api_view(['GET'])
+def getProperty(request, pk):
+    try:
+        fields = PropertySerializer.parse_fields(request.query_params.get('fields')) or PropertySerializer.Meta.fields
+    except ValueError as e:
+        return Response({'fields': [str(e)]}, status=400)
+    properties = PropertySerializer.with_fields(Property.objects.filter(is_available=True), fields)
+    property = get_object_or_404(properties, pk=pk)
+    return Response(PropertySerializer(property, fields=fields).data)
+
+
+@api_view(['GET'])
+def getPropertyBatch(request):
+    # ?ids=3,1,2 with the fields= of getProperty: available listings in
+    # that order, ids that are gone or unavailable under missing
+    try:
+        ids = parse_ids(request.query_params.get('ids', ''))
+    except ValueError as e:
+        return Response({'ids': [str(e)]}, status=400)
+    try:
+        fields = PropertySerializer.parse_fields(request.query_params.get('fields')) or PropertySerializer.Meta.fields
+    except ValueError as e:
+        return Response({'fields': [str(e)]}, status=400)
+    properties = PropertySerializer.with_fields(Property.objects.filter(is_available=True, id__in=ids), fields)
+    return Response(batch_payload(
+        ids, {property.id: property for property in properties},
+        lambda found: PropertySerializer(found, many=True, fields=fields).data,
+    ))
+
+
+ACTIVITY_LIMIT = 50
+
+
+@api_view(['GET'])
+def getActivity(request):
+    # The latest messages across all rooms, newest first
+    return Response(message_list.serialize(Message.objects.all()[:ACTIVITY_LIMIT]))
+
+
+@api_view(['GET'])
+def getPropertyFacets(request):
+    # Type, bedroom and rent histogram counts for the same filters as getProperties
+    form = PropertySearchForm(PropertySearchForm.filters_from(request.query_params))
+    if not form.is_valid():
+        return Response(form.errors, status=400)
+    return Response(search_facets(form.cleaned_data))
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getSearchCacheStats(request):
+    return Response(search_cache.stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getExport(request, kind):
+    # Streams every row updated after since; the X-Export-Watermark header is
+    # the since of the next incremental export
+    if kind not in export.EXPORTS:
+        return Response({'detail': 'Not found.'}, status=404)
+    # Not format=, which DRF takes for renderer negotiation
+    format = request.query_params.get('output', 'ndjson')
+    if format not in export.FORMATS:
+        return Response({'output': [f"Choose one of {', '.join(export.FORMATS)}."]}, status=400)
+    since = None
+    if request.query_params.get('since'):
+        since = parse_datetime(request.query_params['since'])
+        if since is None:
+            return Response({'since': ['Enter an ISO timestamp.']}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    compress = request.query_params.get('compress') == 'gzip'
+    until, chunks = export.export(kind, since=since, format=format, compress=compress)
+    filename = f"{kind}.{format}" + ('.gz' if compress else '')
+    response = StreamingHttpResponse(chunks, content_type='application/gzip' if compress else export.FORMATS[format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    watermark = until or since
+    if watermark:
+        response['X-Export-Watermark'] = watermark.isoformat()
+    return response
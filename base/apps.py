@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .geo import install_spatial_index
+        from .search import install_fulltext_index
+        post_migrate.connect(install_fulltext_index, sender=self)
+        post_migrate.connect(install_spatial_index, sender=self)
@@ -0,0 +1,124 @@
+"""Hashed, precompressed static files
+
+collectstatic with CompressedManifestStaticFilesStorage copies each file to
+STATIC_ROOT under a content-hashed name as well (style.css becomes
+style.3f2a1b9c8d7e.css, recorded in staticfiles.json, which {% static %}
+reads) and writes gzip and, with the brotli package installed, brotli
+siblings of the text files: style.3f2a1b9c8d7e.css.gz and .br.
+
+serve() sends the smallest sibling the browser accepts. A hashed name
+changes whenever the file does, so hashed files are cached for a year
+without revalidating: repeat page views send no requests for them at all.
+"""
+import gzip
+import os
+import re
+from functools import cached_property
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import Http404
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
+
+from .media import file_etag, find_file, guess_type, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# (suffix, Content-Encoding) of the siblings, smallest first
+ENCODINGS = [('.br', 'br'), ('.gz', 'gzip')]
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.map', '.svg', '.html', '.txt', '.json', '.xml', '.ico'}
+# Siblings that don't save at least this fraction of the file aren't kept
+MIN_SAVING = 0.05
+REFUSED = re.compile(r'q=0(\.0{0,3})?')
+
+
+def compressors():
+    """suffix: compress function of each sibling this install can write"""
+    available = {}
+    if brotli is not None:
+        available['.br'] = lambda data: brotli.compress(data, quality=11)
+    # mtime=0 keeps the output, and so its ETag, the same across deploys
+    available['.gz'] = lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    return available
+
+
+def compress_file(path):
+    """Write the compressed siblings of the file at path; returns their paths"""
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE:
+        return []
+    with open(path, 'rb') as file:
+        data = file.read()
+    written = []
+    for suffix, compress in compressors().items():
+        compressed = compress(data)
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            with open(path + suffix, 'wb') as file:
+                file.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes .gz and .br siblings of text files"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed = set()
+        for name, hashed_name, result in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, result
+            if not isinstance(result, Exception):
+                processed.update(filter(None, (name, hashed_name)))
+        if dry_run:
+            return
+        for name in sorted(processed):
+            if self.exists(name):
+                compress_file(self.path(name))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not collected yet (runserver, tests): the unhashed file
+            return name
+
+    @cached_property
+    def hashed_names(self):
+        return frozenset(self.hashed_files.values())
+
+
+def accepted_encodings(request):
+    """Content codings the request accepts; q-values other than 0 are ignored"""
+    accepted = set()
+    for coding in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = coding.partition(';')
+        if not REFUSED.fullmatch(params.replace(' ', '')):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+@require_safe
+def serve(request, path):
+    """The collected static file path, precompressed if the browser accepts it"""
+    if not settings.STATIC_ROOT:
+        raise Http404('collectstatic has not been run')
+    name, full_path, stat = find_file(settings.STATIC_ROOT, path)
+    if name.endswith(('.gz', '.br')) and os.path.exists(full_path[:-3]):
+        # Siblings are only sent in place of their file
+        raise Http404('No such file')
+    content_type = guess_type(name)
+    immutable = name in getattr(staticfiles_storage, 'hashed_names', ())
+    encoding = None
+    accepted = accepted_encodings(request)
+    for suffix, coding in ENCODINGS:
+        if coding in accepted and os.path.isfile(full_path + suffix):
+            encoding, name, full_path = coding, name + suffix, full_path + suffix
+            stat = os.stat(full_path)
+            break
+    response = send_file(request, full_path, stat, file_etag(name, stat), content_type, immutable=immutable)
+    if encoding and response.status_code in (200, 206):
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,147 @@
+"""Validators for conditional GET (django.views.decorators.http.condition)
+
+A matching If-None-Match or If-Modified-Since costs the lookups below and
+nothing else: the view never runs. An etag/last_modified pair shares one
+lookup, memoized on the request.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+
+from . import search_cache
+from .forms import PropertySearchForm
+from .models import Property, PropertyImage, Room, SimilarProperty
+from .pagination import cursor_filters
+from .search import filter_properties
+
+
+def _memoized(request, key, compute):
+    cache = request.__dict__.setdefault('_validators', {})
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """condition() for async views, with the validators run through sync_to_async"""
+    def decorator(view):
+        # condition() around a stand-in view: it answers 304 or 412 itself,
+        # or hands back the stand-in's response with the validator headers
+        check = sync_to_async(condition(etag_func, last_modified_func)(lambda request, *args, **kwargs: HttpResponse()))
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            checked = await check(request, *args, **kwargs)
+            if checked.status_code in (304, 412):
+                return checked
+            response = await view(request, *args, **kwargs)
+            for header in ('ETag', 'Last-Modified'):
+                if checked.has_header(header) and not response.has_header(header):
+                    response.headers[header] = checked.headers[header]
+            return response
+        return inner
+    return decorator
+
+
+def _etag(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+# What a listing shows besides its own columns: saving the landlord's
+# profile, a gallery photo or an amenity doesn't touch Property.updated
+LANDLORD_COLUMNS = ['landlord_id', 'landlord__name', 'landlord__username', 'landlord__email', 'landlord__avatar']
+
+
+def _property(pk):
+    """[Property.updated, landlord columns..., amenities] of an available listing, or None"""
+    row = Property.objects.filter(pk=pk, is_available=True).values_list('updated', *LANDLORD_COLUMNS).first()
+    if row is None:
+        return None
+    amenities = list(
+        Property.amenity_tags.through.objects.filter(property_id=pk)
+        .order_by('amenity_id').values_list('amenity_id', 'amenity__name')
+    )
+    return [*row, amenities]
+
+
+def _property_detail(request, pk):
+    # The page shows the gallery and the similar listings and is rendered per
+    # user, with any pending flash messages, which must not be swallowed by a
+    # 304. There's no Last-Modified: a landlord or amenity edit has no
+    # timestamp, so If-Modified-Since alone can't tell that the page changed
+    if len(get_messages(request)):
+        return None
+    parts = _property(pk)
+    if parts is None:
+        return None
+    gallery = list(
+        PropertyImage.objects.filter(property_id=pk)
+        .values_list('id', 'position', 'image', 'caption', 'image_variants')
+    )
+    similar = list(
+        SimilarProperty.objects.filter(property_id=pk, similar__is_available=True)
+        .values_list('similar_id', 'similar__updated')
+    )
+    return _etag('property', pk, *parts, gallery, similar, request.user.pk)
+
+
+def property_detail_etag(request, pk):
+    return _memoized(request, 'property_detail', lambda: _property_detail(request, pk))
+
+
+def property_etag(request, pk):
+    # /api/properties/:id, per fields= like the lists
+    parts = _property(pk)
+    if parts is None:
+        return None
+    return _etag('property-api', pk, *parts, request.GET.urlencode())
+
+
+def _room(pk):
+    updated = Room.objects.filter(pk=pk).values_list('updated', flat=True).first()
+    if updated is None:
+        return None, None
+    # Participants are serialized but joining a room doesn't touch updated
+    participants = list(Room.participants.through.objects.filter(room_id=pk).values_list('user_id', flat=True))
+    return _etag('room', pk, updated.isoformat(), sorted(participants)), updated
+
+
+def room_etag(request, pk):
+    return _memoized(request, 'room', lambda: _room(pk))[0]
+
+
+def room_last_modified(request, pk):
+    return _memoized(request, 'room', lambda: _room(pk))[1]
+
+
+# Lists only get an ETag: a deletion can leave max(updated) where it was,
+# so If-Modified-Since alone can't tell that the list changed
+
+def rooms_etag(request):
+    rooms = Room.objects.aggregate(count=Count('id'), updated=Max('updated'))
+    # Through rows have AUTOINCREMENT ids, so (count, max id) moves on every add or remove
+    participants = Room.participants.through.objects.aggregate(count=Count('id'), last=Max('id'))
+    return _etag('rooms', rooms['count'], rooms['updated'], participants['count'], participants['last'],
+                 request.GET.urlencode())
+
+
+def properties_etag(request):
+    cursor = request.GET.get('cursor')
+    filters = cursor_filters(cursor)
+    if filters is None:
+        filters = PropertySearchForm.filters_from(request.GET)
+    form = PropertySearchForm(filters)
+    if not form.is_valid():
+        return None
+    # Cached with the search results until a matching property changes
+    aggregate = search_cache.search_value(
+        form.cleaned_data, 'validators',
+        lambda: filter_properties(Property.objects.filter(is_available=True), form.cleaned_data)
+        .aggregate(count=Count('id'), updated=Max('updated')),
+    )
+    return _etag('properties', aggregate['count'], aggregate['updated'], request.GET.urlencode())
@@ -0,0 +1,117 @@
+"""Incremental bulk export of listings and messages, as NDJSON or CSV
+
+Rows are read in keyset batches on (updated, id), each a short indexed
+query, so memory stays flat and no read transaction is held open for the
+whole export. An export covers since < updated <= until, where until is
+the newest updated when it starts, but no later than SETTLE ago: pass it
+as since to the next export to get exactly the rows written in between.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Message, Property
+
+BATCH_SIZE = 2000
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORTS = {'properties': Property, 'messages': Message}
+# Rows are exported once their updated is at least this old. updated is
+# stamped before the writing transaction commits (ingest, image variants),
+# so a younger row may still be joined by rows stamped before it that would
+# fall below the watermark; it must outlast the longest such transaction.
+SETTLE = timedelta(minutes=5)
+
+
+def columns(model):
+    """Exported columns: every concrete field, foreign keys as ids"""
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def watermark(model, settle=SETTLE):
+    """The until of an export started now: the newest updated, but no later than settle ago"""
+    newest = model.objects.aggregate(until=Max('updated'))['until']
+    return newest and min(newest, timezone.now() - settle)
+
+
+def batches(model, since=None, until=None, batch_size=BATCH_SIZE):
+    """Lists of value tuples of the rows with since < updated <= until, oldest first"""
+    rows = model.objects.order_by('updated', 'id')
+    if since is not None:
+        rows = rows.filter(updated__gt=since)
+    if until is not None:
+        rows = rows.filter(updated__lte=until)
+    names = columns(model)
+    rows = rows.values_list(*names)
+    updated_at, id_at = names.index('updated'), names.index('id')
+    batch = list(rows[:batch_size])
+    while batch:
+        yield batch
+        if len(batch) < batch_size:
+            return
+        updated, pk = batch[-1][updated_at], batch[-1][id_at]
+        # The leading bound alone is what lets SQLite seek on the index
+        after = Q(updated__gte=updated) & (Q(updated__gt=updated) | Q(updated=updated, id__gt=pk))
+        batch = list(rows.filter(after)[:batch_size])
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        # JSON columns, as a JSON text cell
+        return json.dumps(value, ensure_ascii=False)
+    return _value(value)
+
+
+def encode(batches, names, format='ndjson'):
+    """One chunk of bytes per batch; CSV starts with a header row"""
+    if format == 'ndjson':
+        for batch in batches:
+            yield ''.join(
+                json.dumps(dict(zip(names, map(_value, row))), ensure_ascii=False) + '\n' for row in batch
+            ).encode()
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in batches:
+        writer.writerows([_csv_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzipped(chunks, level=6):
+    """A gzip stream of chunks, compressed as they come"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(kind, since=None, format='ndjson', compress=False, batch_size=BATCH_SIZE):
+    """(until, chunks) of an export of kind; until is None while the table is empty"""
+    model = EXPORTS[kind]
+    until = watermark(model)
+    if since is not None and until is not None and until <= since:
+        until = since
+    chunks = encode(batches(model, since, until, batch_size), columns(model), format)
+    return until, gzipped(chunks) if compress else chunks
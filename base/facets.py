@@ -0,0 +1,178 @@
+import math
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Q, Value
+from django.db.models.functions import Cast, Least
+
+from . import search_cache
+from .models import FacetCount, Property
+from .search import filter_properties
+
+# Bedroom facet: 0 (studio), 1, 2, 3 and BEDROOM_BUCKETS - 1 or more
+BEDROOM_BUCKETS = 5
+# Rent histogram: RENT_BUCKETS bars RENT_BUCKET_WIDTH wide, the last open-ended
+RENT_BUCKET_WIDTH = 500
+RENT_BUCKETS = 10
+# Fields of a property that decide its facet bucket
+FACET_FIELDS = {'is_available', 'property_type', 'bedrooms', 'rent_amount'}
+
+
+def bucket(state):
+    """(property_type, bedroom bucket, rent bucket) of an available property state, or None"""
+    if not state or not state['is_available']:
+        return None
+    return (
+        state['property_type'],
+        min(state['bedrooms'], BEDROOM_BUCKETS - 1),
+        min(int(state['rent_amount'] / RENT_BUCKET_WIDTH), RENT_BUCKETS - 1),
+    )
+
+
+def _grouped(properties):
+    """[(property_type, bedroom bucket, rent bucket, count)] in one GROUP BY query"""
+    return (
+        properties.order_by()
+        .values_list(
+            'property_type',
+            Least(F('bedrooms'), Value(BEDROOM_BUCKETS - 1)),
+            Least(Cast(F('rent_amount') / RENT_BUCKET_WIDTH, IntegerField()), Value(RENT_BUCKETS - 1)),
+        )
+        .annotate(n=Count('id'))
+    )
+
+
+def adjust(old_state, new_state):
+    """Move a property between FacetCount buckets after a save or delete"""
+    old, new = bucket(old_state), bucket(new_state)
+    if old == new:
+        return
+    for key, delta in ((old, -1), (new, 1)):
+        if key is None:
+            continue
+        property_type, bedrooms, rent_bucket = key
+        rows = FacetCount.objects.filter(property_type=property_type, bedrooms=bedrooms, rent_bucket=rent_bucket)
+        if not rows.update(count=F('count') + delta):
+            FacetCount.objects.get_or_create(property_type=property_type, bedrooms=bedrooms, rent_bucket=rent_bucket)
+            rows.update(count=F('count') + delta)
+
+
+def rebuild():
+    """Recount FacetCount from the Property table"""
+    rows = _grouped(Property.objects.filter(is_available=True))
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([
+            FacetCount(property_type=property_type, bedrooms=bedrooms, rent_bucket=rent_bucket, count=n)
+            for property_type, bedrooms, rent_bucket, n in rows
+        ])
+
+
+def _from_table(cleaned_data):
+    """Whether FacetCount can answer a search: type, price and low bedroom filters only"""
+    filters = search_cache.normalize_filters(cleaned_data)
+    if not set(filters) <= {'property_type', 'bedrooms', 'min_price', 'max_price'}:
+        return False
+    return filters.get('bedrooms', 0) <= BEDROOM_BUCKETS - 1
+
+
+def _price_split(min_price, max_price):
+    """(first, last) rent buckets wholly inside a price range, and [Q] of the rents it leaves out
+
+    first is None when no bucket is. The rents left out lie in the partial
+    buckets at either end, one bucket wide at most, or in the open-ended top
+    bucket.
+    """
+    first = max(math.ceil(min_price / RENT_BUCKET_WIDTH), 0) if min_price else 0
+    # The top bucket has no upper bound, so a maximum never covers it whole
+    last = min(math.floor(max_price / RENT_BUCKET_WIDTH) - 1, RENT_BUCKETS - 2) if max_price else RENT_BUCKETS - 1
+    if first > last:
+        rents = Q()
+        if min_price:
+            rents &= Q(rent_amount__gte=min_price)
+        if max_price:
+            rents &= Q(rent_amount__lte=max_price)
+        return (None, None), [rents]
+    rents = []
+    if min_price and min_price < first * RENT_BUCKET_WIDTH:
+        rents.append(Q(rent_amount__gte=min_price, rent_amount__lt=first * RENT_BUCKET_WIDTH))
+    if max_price:
+        rents.append(Q(rent_amount__gte=(last + 1) * RENT_BUCKET_WIDTH, rent_amount__lte=max_price))
+    return (first, last), rents
+
+
+def facet_counts(cleaned_data=None):
+    """Type, bedroom and rent histogram counts of a search
+
+    Searches with no filters beyond type, price and a low bedroom minimum
+    read the maintained FacetCount rows. A price range that splits a rent
+    bucket adds one grouped aggregate over the listings in its partial
+    buckets, a narrow range of property_avail_rent_idx. Any other search
+    runs one grouped aggregate, covered by the property_facets_idx index.
+    Either way there are at most a few hundred (type, bedrooms, rent) groups
+    to sum up per facet.
+    """
+    cleaned_data = cleaned_data or {}
+    if _from_table(cleaned_data):
+        min_price, max_price = cleaned_data.get('min_price'), cleaned_data.get('max_price')
+        (first, last), rents = _price_split(min_price, max_price)
+        rows = []
+        if first is not None:
+            table = FacetCount.objects.filter(count__gt=0)
+            if cleaned_data.get('property_type'):
+                table = table.filter(property_type=cleaned_data['property_type'])
+            if cleaned_data.get('bedrooms'):
+                table = table.filter(bedrooms__gte=cleaned_data['bedrooms'])
+            if min_price:
+                table = table.filter(rent_bucket__gte=first)
+            if max_price:
+                table = table.filter(rent_bucket__lte=last)
+            rows += table.values_list('property_type', 'bedrooms', 'rent_bucket', 'count')
+        if rents:
+            others = {name: value for name, value in cleaned_data.items() if name not in ('min_price', 'max_price')}
+            matching = filter_properties(Property.objects.filter(is_available=True), others)
+            # UNION ALL rather than OR: SQLite only seeks the index range of each alone
+            grouped = [_grouped(matching.filter(range)) for range in rents]
+            rows += grouped[0].union(*grouped[1:], all=True) if len(grouped) > 1 else grouped[0]
+    else:
+        rows = _grouped(filter_properties(Property.objects.filter(is_available=True), cleaned_data))
+
+    types = Counter({value: 0 for value, label in Property.PROPERTY_TYPES})
+    bedrooms = [0] * BEDROOM_BUCKETS
+    rent = [0] * RENT_BUCKETS
+    for property_type, beds, rent_bucket, n in rows:
+        types[property_type] += n
+        bedrooms[max(beds, 0)] += n
+        rent[max(rent_bucket, 0)] += n
+
+    labels = dict(Property.PROPERTY_TYPES)
+    return {
+        'total': sum(rent),
+        'property_type': [
+            {'value': value, 'label': labels.get(value, value), 'count': count} for value, count in types.items()
+        ],
+        # count is listings with exactly that many bedrooms (the last bucket:
+        # at least), at_least what the min-bedrooms filter would return
+        'bedrooms': [
+            {
+                'min': beds,
+                'label': f'{beds}+' if beds == BEDROOM_BUCKETS - 1 else str(beds),
+                'count': count,
+                'at_least': sum(bedrooms[beds:]),
+            }
+            for beds, count in enumerate(bedrooms)
+        ],
+        'rent': [
+            {
+                'min': i * RENT_BUCKET_WIDTH,
+                'max': (i + 1) * RENT_BUCKET_WIDTH if i < RENT_BUCKETS - 1 else None,
+                'count': count,
+            }
+            for i, count in enumerate(rent)
+        ],
+    }
+
+
+def search_facets(cleaned_data=None):
+    """facet_counts() cached per normalized filter set, see search_cache"""
+    return search_cache.search_value(cleaned_data, 'facets', lambda: facet_counts(cleaned_data))
@@ -1,7 +1,9 @@
 from django.forms import ModelForm
 from django.contrib.auth.forms import UserCreationForm
 from django import forms
-from .models import Room, User, Property
+from .gallery import MAX_UPLOAD
+from .geo import geocode
+from .models import Room, User, Property, Amenity
 
 
 class MyUserCreationForm(UserCreationForm):
@@ -42,13 +44,44 @@ class UserForm(ModelForm):
         fields = ['avatar', 'name', 'username', 'email', 'bio']
 
 
+class MultipleFileInput(forms.FileInput):
+    """File input that takes any number of files"""
+
+    def __init__(self, attrs=None):
+        super().__init__({'multiple': True, **(attrs or {})})
+
+    def value_from_datadict(self, data, files, name):
+        return files.getlist(name)
+
+
+class MultipleImageField(forms.ImageField):
+    """ImageField cleaning a list of uploads; [] when none were sent"""
+    widget = MultipleFileInput
+
+    def __init__(self, *args, max_files=None, **kwargs):
+        self.max_files = max_files
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        files = [file for file in data or [] if file]
+        clean = super().clean
+        if not files:
+            return clean(None, initial) or []
+        if self.max_files and len(files) > self.max_files:
+            raise forms.ValidationError(f'Upload at most {self.max_files} photos at a time.')
+        return [clean(file, initial) for file in files]
+
+
 class PropertyForm(ModelForm):
+    # Photos added to the listing's gallery, see base/gallery.py
+    gallery = MultipleImageField(required=False, max_files=MAX_UPLOAD)
+
     class Meta:
         model = Property
         fields = [
             'title', 'property_type', 'rent_amount', 'location', 'address',
             'bedrooms', 'bathrooms', 'area_sqft', 'description', 'amenities',
-            'date_available', 'main_image'
+            'date_available', 'main_image', 'latitude', 'longitude'
         ]
         widgets = {
             'date_available': forms.DateInput(attrs={'type': 'date'}),
@@ -58,9 +91,69 @@ class PropertyForm(ModelForm):
         }
 
 
+class PropertyImportForm(PropertyForm):
+    """One row of an import_properties feed: PropertyForm rules, keyed by the landlord's ref"""
+    ref = forms.CharField(max_length=100)
+    gallery = None
+
+    class Meta(PropertyForm.Meta):
+        fields = [name for name in PropertyForm.Meta.fields if name != 'main_image']
+
+
 class PropertySearchForm(forms.Form):
     location = forms.CharField(max_length=200, required=False, widget=forms.TextInput(attrs={'placeholder': 'Enter location'}))
     min_price = forms.DecimalField(max_digits=10, decimal_places=2, required=False, widget=forms.NumberInput(attrs={'placeholder': 'Min price'}))
     max_price = forms.DecimalField(max_digits=10, decimal_places=2, required=False, widget=forms.NumberInput(attrs={'placeholder': 'Max price'}))
     property_type = forms.ChoiceField(choices=[('', 'Any Type')] + Property.PROPERTY_TYPES, required=False)
     bedrooms = forms.IntegerField(required=False, widget=forms.NumberInput(attrs={'placeholder': 'Min bedrooms'}))
+    amenities = forms.ModelMultipleChoiceField(
+        queryset=Amenity.objects.all(), to_field_name='slug', required=False, widget=forms.CheckboxSelectMultiple
+    )
+    # Geographic search: around a named place or a point, or inside a box
+    near = forms.CharField(max_length=200, required=False, widget=forms.TextInput(attrs={'placeholder': 'Near (place)'}))
+    lat = forms.FloatField(min_value=-90, max_value=90, required=False, widget=forms.HiddenInput)
+    lng = forms.FloatField(min_value=-180, max_value=180, required=False, widget=forms.HiddenInput)
+    radius = forms.FloatField(min_value=0.1, max_value=500, required=False,
+                              widget=forms.NumberInput(attrs={'placeholder': 'Within km', 'step': 'any'}))
+    bbox = forms.CharField(required=False, widget=forms.HiddenInput,
+                           help_text='west,south,east,north in degrees')
+
+    def clean_bbox(self):
+        """(min_lat, min_lng, max_lat, max_lng) from a west,south,east,north string"""
+        bbox = self.cleaned_data.get('bbox')
+        if not bbox:
+            return None
+        try:
+            west, south, east, north = (float(value) for value in bbox.split(','))
+        except ValueError:
+            raise forms.ValidationError('Enter the box as west,south,east,north in degrees.')
+        if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+            raise forms.ValidationError('The box is out of range or its corners are swapped.')
+        return (south, west, north, east)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('lat') is None) != (cleaned_data.get('lng') is None):
+            raise forms.ValidationError('Give both lat and lng.')
+        near = cleaned_data.get('near')
+        if near and cleaned_data.get('lat') is None:
+            point = geocode(near)
+            if point is None:
+                self.add_error('near', 'Unknown place.')
+            else:
+                cleaned_data['lat'], cleaned_data['lng'] = point
+        if cleaned_data.get('radius') and cleaned_data.get('lat') is None and 'near' not in self.errors:
+            self.add_error('radius', 'A radius needs a place or a point to search around.')
+        return cleaned_data
+
+    @classmethod
+    def filters_from(cls, query):
+        """The non-empty search parameters of a QueryDict, as form data"""
+        filters = {}
+        for name, field in cls.base_fields.items():
+            values = [value for value in query.getlist(name) if value]
+            if not values:
+                continue
+            multiple = isinstance(field, (forms.MultipleChoiceField, forms.ModelMultipleChoiceField))
+            filters[name] = values if multiple else values[-1]
+        return filters
@@ -0,0 +1,22 @@
+"""Listing photo galleries: PropertyImage rows added in bulk, in order"""
+from django.db.models import Max
+
+from . import images, storage
+from .models import PropertyImage
+
+# Photos one upload may add to a gallery
+MAX_UPLOAD = 20
+
+
+def add_images(property, files):
+    """Append uploaded files to a property's gallery with one INSERT; returns the new rows"""
+    last = property.images.aggregate(last=Max('position'))['last']
+    start = 0 if last is None else last + 1
+    added = PropertyImage.objects.bulk_create([
+        PropertyImage(property=property, image=file, position=start + i) for i, file in enumerate(files)
+    ])
+    # bulk_create skips the save signals that count stored files and queue their variants
+    for image in added:
+        storage.adjust_refs(image.image.name, 1)
+        images.schedule('base.PropertyImage', image.pk, 'image', 'image_variants', image.image.name)
+    return added
@@ -0,0 +1,143 @@
+import math
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+from django.utils.module_loading import import_string
+from django.utils.text import slugify
+
+from .models import Place
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# SQLite R*Tree over the Property coordinates. Points are stored as
+# zero-size boxes and kept in sync by triggers, like the FTS5 index in
+# base/search.py.
+RTREE_TABLE = 'base_property_rtree'
+RTREE_SQL = {
+    RTREE_TABLE: f'CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_lat, max_lat, min_lng, max_lng)',
+    f'{RTREE_TABLE}_ai': (
+        f'CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_ai AFTER INSERT ON base_property '
+        f'WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN '
+        f'INSERT INTO {RTREE_TABLE} VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude); END'
+    ),
+    f'{RTREE_TABLE}_ad': (
+        f'CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_ad AFTER DELETE ON base_property BEGIN '
+        f'DELETE FROM {RTREE_TABLE} WHERE id = old.id; END'
+    ),
+    f'{RTREE_TABLE}_au': (
+        f'CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_au AFTER UPDATE OF latitude, longitude ON base_property BEGIN '
+        f'DELETE FROM {RTREE_TABLE} WHERE id = old.id; '
+        f'INSERT INTO {RTREE_TABLE} SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude '
+        f'WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL; END'
+    ),
+}
+RTREE_REBUILD = [
+    f'DELETE FROM {RTREE_TABLE}',
+    f'INSERT INTO {RTREE_TABLE} SELECT id, latitude, latitude, longitude, longitude FROM base_property '
+    f'WHERE latitude IS NOT NULL AND longitude IS NOT NULL',
+]
+
+
+def install_spatial_index(sender=None, using='default', **kwargs):
+    """Create the R*Tree table and its sync triggers if any are missing
+
+    Connected to post_migrate for the same reason as install_fulltext_index.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)" % ', '.join(['%s'] * len(RTREE_SQL)),
+            list(RTREE_SQL),
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in RTREE_SQL if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            cursor.execute(RTREE_SQL[name])
+        for statement in RTREE_REBUILD:
+            cursor.execute(statement)
+
+
+def place_geocoder(query):
+    """(latitude, longitude) of a place name from the Place table, or None
+
+    Tries the whole text first, then each comma-separated part, so
+    "Kilimani, Nairobi" finds Kilimani before falling back to Nairobi.
+    """
+    parts = [query] + (query or '').split(',')
+    slugs = [slug for slug in dict.fromkeys(slugify(part) for part in parts) if slug]
+    if not slugs:
+        return None
+    places = {
+        slug: (lat, lng)
+        for slug, lat, lng in Place.objects.filter(slug__in=slugs).values_list('slug', 'latitude', 'longitude')
+    }
+    for slug in slugs:
+        if slug in places:
+            return places[slug]
+    return None
+
+
+def geocode(query):
+    """Coordinates of free text through settings.GEOCODER, or None"""
+    geocoder = import_string(getattr(settings, 'GEOCODER', 'base.geo.place_geocoder'))
+    return geocoder(query)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance between two points"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def distance_expression(lat, lng):
+    """distance_km from (lat, lng) to each row, as a query expression"""
+    lat = Value(float(lat), output_field=FloatField())
+    lng = Value(float(lng), output_field=FloatField())
+    half_dlat = Sin((Radians(F('latitude')) - Radians(lat)) / 2)
+    half_dlng = Sin((Radians(F('longitude')) - Radians(lng)) / 2)
+    a = Power(half_dlat, 2) + Cos(Radians(lat)) * Cos(Radians(F('latitude'))) * Power(half_dlng, 2)
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def radius_bbox(lat, lng, radius):
+    """(min_lat, min_lng, max_lat, max_lng) enclosing a circle of radius km"""
+    dlat = radius / KM_PER_DEGREE
+    # Longitude degrees shrink towards the poles; clamp to avoid dividing by ~0
+    dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+    return (max(lat - dlat, -90.0), max(lng - dlng, -180.0), min(lat + dlat, 90.0), min(lng + dlng, 180.0))
+
+
+def in_bbox(bbox, lat, lng):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    return lat is not None and lng is not None and min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+
+def filter_bbox(properties, bbox):
+    """Properties whose coordinates fall inside bbox
+
+    The R*Tree answers the box query; it stores 32-bit floats rounded
+    outwards, so the exact bounds are checked on the candidates too.
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox
+    properties = properties.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lng, max_lng))
+    if connections[properties.db].vendor != 'sqlite':
+        return properties
+    return properties.filter(id__in=RawSQL(
+        f'SELECT id FROM {RTREE_TABLE} WHERE max_lat >= %s AND min_lat <= %s AND max_lng >= %s AND min_lng <= %s',
+        (min_lat, max_lat, min_lng, max_lng),
+    ))
+
+
+def filter_radius(properties, lat, lng, radius):
+    """Properties within radius km of (lat, lng), with a distance annotation"""
+    properties = filter_bbox(properties, radius_bbox(lat, lng, radius))
+    return properties.annotate(distance=distance_expression(lat, lng)).filter(distance__lte=radius)
@@ -0,0 +1,143 @@
+"""Resized, recompressed variants of uploaded listing photos
+
+Every main_image and gallery image gets a thumb, card and full variant,
+each as WebP and as a JPEG fallback, stored next to the upload under
+variants/. They're built by a job (see base/jobs.py) once the upload is
+committed, so no request waits on Pillow; until then pages and the API
+fall back to the original file. The variants field of a row records the
+upload its variants were built from and their widths, so a new upload
+falls back again until its own variants are in.
+"""
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import jobs
+from .models import Property
+
+# Largest width of each variant; smaller uploads are never scaled up
+SIZES = {'thumb': 320, 'card': 640, 'full': 1600}
+# Extension, Pillow format and save options of each output format
+FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_ROOT = 'variants'
+# (model label, image field, variants field) of every image that gets variants
+IMAGE_FIELDS = [
+    ('base.Property', 'main_image', 'main_image_variants'),
+    ('base.PropertyImage', 'image', 'image_variants'),
+]
+# The listing each of them is shown on
+LISTING = {'base.Property': 'pk', 'base.PropertyImage': 'property_id'}
+
+
+def variant_name(name, size, format):
+    """Storage name of one variant of the upload stored as name"""
+    return f'{VARIANTS_ROOT}/{name}/{size}.{FORMATS[format][0]}'
+
+
+def render(name, source_storage=default_storage):
+    """Store the variants of an upload; {size: width} of those stored, smallest first
+
+    Sizes that would come out no wider than the next smaller one are skipped.
+    Raises OSError (including PIL.UnidentifiedImageError) on unreadable files.
+    """
+    from PIL import Image, ImageOps
+
+    with source_storage.open(name) as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha; flatten onto white for both formats alike
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        widths = {}
+        for size, width in sorted(SIZES.items(), key=lambda item: item[1]):
+            width = min(width, image.width)
+            if widths and width <= max(widths.values()):
+                continue
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            for format, (_, pillow_format, options) in FORMATS.items():
+                data = io.BytesIO()
+                resized.save(data, pillow_format, **options)
+                target = variant_name(name, size, format)
+                default_storage.delete(target)
+                default_storage.save(target, ContentFile(data.getvalue()))
+            widths[size] = width
+        return widths
+
+
+def delete_variants(name):
+    """Remove every variant of the upload stored as name"""
+    for size in SIZES:
+        for format in FORMATS:
+            default_storage.delete(variant_name(name, size, format))
+
+
+@jobs.task(max_attempts=3, concurrency=2)
+def build(label, pk, field, variants_field):
+    """Build the variants of one row's image, unless they're up to date
+
+    Returns the new variants value, or None when there was nothing to do or
+    the file isn't a readable image; the row then keeps the original.
+    """
+    model = apps.get_model(label)
+    row = model.objects.filter(pk=pk).values(field, variants_field).first()
+    if row is None or not row[field] or row[variants_field].get('source') == row[field]:
+        return None
+    # The same stored file on another row (see base/storage.py) already has them
+    variants = model.objects.filter(**{field: row[field], f'{variants_field}__source': row[field]}).values_list(
+        variants_field, flat=True,
+    ).first()
+    if variants is None:
+        try:
+            widths = render(row[field], model._meta.get_field(field).storage)
+        except OSError:
+            return None
+        variants = {'source': row[field], 'widths': widths}
+    # Unless another upload replaced the image in the meantime. Variants
+    # that end up unused are deleted along with their file by gc_media.
+    if not model.objects.filter(pk=pk, **{field: row[field]}).update(**{variants_field: variants}):
+        return None
+    # Listing pages that now render the variants get a new ETag
+    listing = model.objects.filter(pk=pk).values_list(LISTING[label], flat=True)
+    Property.objects.filter(pk__in=listing).update(updated=timezone.now())
+    return variants
+
+
+def _setup_worker():
+    # Spawned workers start from a fresh interpreter
+    django.setup()
+
+
+def worker_pool(workers):
+    """Processes for build_image_variants to build a backlog in"""
+    # Spawned rather than forked: a forked child would share the parent's
+    # open database connections
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=_setup_worker)
+
+
+def schedule(label, pk, field, variants_field, name):
+    """Queue the build of a row's variants for the upload stored as name"""
+    jobs.enqueue(build, label, pk, field, variants_field, key=f'image-variants:{label}:{pk}:{name}')
+
+
+def variant_url(name, size, format):
+    return default_storage.url(variant_name(name, size, format))
+
+
+def srcset(name, variants):
+    """{format: 'url 320w, url 640w, ...'} for <source>/<img srcset>, or None until they're built"""
+    if not name or not variants or variants.get('source') != name:
+        return None
+    return {
+        format: ', '.join(f'{variant_url(name, size, format)} {width}w' for size, width in variants['widths'].items())
+        for format in FORMATS
+    }
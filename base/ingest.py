@@ -0,0 +1,287 @@
+"""Bulk property import from landlord feeds, see the import_properties command
+
+Rows are validated a batch at a time in a process pool while the main
+process writes the previous batches. Each column of a batch is checked in
+one pass with PropertyImportForm's fields and the model's validators. Only
+rows holding a value that pass can't vouch for (a typo, or a date in
+another accepted format) go through the form itself, whose values and
+error messages are the ones that count. Writes take one transaction per
+batch, bulk_create for new refs and bulk_update for changed ones. Rows
+identical to what is stored are left alone, so re-sending a feed doesn't
+touch updated. The derived tables are brought up to date once, at the end.
+"""
+import csv
+import json
+import math
+import re
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+from functools import cache
+from itertools import islice
+
+import django
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import geo, similar
+from .forms import PropertyImportForm
+from .models import Property, held_bulk_changes
+
+BATCH_SIZE = 1000
+# Past this many changed listings one rebuild beats per-listing updates
+SIMILAR_INCREMENTAL_LIMIT = 200
+FIELDS = PropertyImportForm.Meta.fields
+
+ImportResult = namedtuple('ImportResult', ['created', 'updated', 'unchanged', 'errors'])
+
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+# A value the column pass leaves to the form
+UNSURE = object()
+
+
+def read_rows(stream, format):
+    """(line number, row dict) of a CSV file with a header row, or of NDJSON
+
+    NDJSON lines that aren't JSON objects come out as (line number, None).
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def _to_python(field):
+    """field.to_python() for the non-empty values it surely accepts, or None
+
+    It raises for any other value: the form then decides what it is.
+    """
+    kind = type(field)
+    if kind is forms.CharField:
+        def convert(value):
+            if not isinstance(value, str):
+                raise TypeError(value)
+            return value.strip() if field.strip else value
+    elif kind is forms.TypedChoiceField:
+        choices = {str(value) for value, label in field.choices if value != ''}
+
+        def convert(value):
+            if value not in choices:
+                raise ValueError(value)
+            return field.coerce(value)
+    elif kind is forms.DecimalField:
+        def convert(value):
+            value = Decimal(str(value).strip())
+            if not value.is_finite():
+                raise ValueError(value)
+            return value
+    elif kind is forms.IntegerField:
+        def convert(value):
+            # Ints and plain digit strings; '2.0' and the like go to the form
+            if isinstance(value, str):
+                value = int(value.strip())
+            elif type(value) is not int:
+                raise TypeError(value)
+            if not -2 ** 31 <= value < 2 ** 31:
+                raise ValueError(value)
+            return value
+    elif kind is forms.FloatField:
+        def convert(value):
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise TypeError(value)
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError(value)
+            return value
+    elif kind is forms.DateField:
+        def convert(value):
+            # ISO dates, which every locale's DATE_INPUT_FORMATS accepts
+            if not isinstance(value, str) or not ISO_DATE.fullmatch(value.strip()):
+                raise ValueError(value)
+            return date.fromisoformat(value.strip())
+    else:
+        return None
+    return convert
+
+
+@cache
+def _columns():
+    """[(name, clean)] of PropertyImportForm's fields, clean raising for anything left to the form"""
+    columns = []
+    for name, field in PropertyImportForm().fields.items():
+        convert = _to_python(field)
+        model_field = Property._meta.get_field(name) if name in FIELDS else None
+        # The form runs its fields' validators, then the model field's in full_clean()
+        validators = list(field.validators) + (list(model_field.validators) if model_field else [])
+        empty = getattr(field, 'empty_value', None)
+
+        def clean(value, field=field, convert=convert, validators=validators, empty=empty):
+            if convert is None:
+                raise TypeError(value)
+            if value not in field.empty_values:
+                value = convert(value)
+            if value in field.empty_values:
+                if field.required:
+                    raise ValueError(value)
+                return empty
+            for validator in validators:
+                validator(value)
+            return value
+        columns.append((name, clean))
+    return columns
+
+
+def _clean_column(clean, values):
+    cleaned = []
+    for value in values:
+        try:
+            cleaned.append(clean(value))
+        except (ArithmeticError, TypeError, ValueError, ValidationError):
+            cleaned.append(UNSURE)
+    return cleaned
+
+
+def validate_rows(rows):
+    """[(line, ref, values, errors)] of [(line, row)]; values is None when errors isn't"""
+    objects = [row for line, row in rows if row is not None]
+    columns = _columns()
+    names = [name for name, clean in columns]
+    cleaned = iter(zip(*(_clean_column(clean, [row.get(name) for row in objects]) for name, clean in columns)))
+    results = []
+    # Rebinding one form skips the deep copy of every field that building a
+    # form costs
+    form = PropertyImportForm({})
+    for line, row in rows:
+        if row is None:
+            results.append((line, None, None, {'__all__': ['Not a JSON object.']}))
+            continue
+        values = next(cleaned)
+        if UNSURE not in values:
+            values = dict(zip(names, values))
+            results.append((line, values.pop('ref'), values, None))
+            continue
+        form.data, form.instance, form._errors = row, Property(), None
+        if form.is_valid():
+            values = dict(form.cleaned_data)
+            results.append((line, values.pop('ref'), values, None))
+        else:
+            errors = {field: list(messages) for field, messages in form.errors.items()}
+            results.append((line, row.get('ref'), None, errors))
+    return results
+
+
+def _setup_worker():
+    # Forked workers inherit a set-up Django, spawned ones don't. Either way
+    # validation never queries, so no database connection is opened.
+    django.setup()
+
+
+def _validated(rows, batch_size, workers):
+    """validate_rows() of each batch, in order, with up to 2 * workers batches in flight"""
+    rows = iter(rows)
+    batches = iter(lambda: list(islice(rows, batch_size)), [])
+    if workers < 1:
+        for batch in batches:
+            yield validate_rows(batch)
+        return
+    with ProcessPoolExecutor(workers, initializer=_setup_worker) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(validate_rows, batch))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _fill_coordinates(values, points):
+    """What the geocode_property signal does on save, one lookup per location"""
+    if values['latitude'] is not None and values['longitude'] is not None:
+        return
+    location = values['location']
+    if location not in points:
+        points[location] = geo.geocode(location)
+    values['latitude'], values['longitude'] = points[location] or (None, None)
+
+
+def upsert(landlord, rows):
+    """Write {ref: values} of one landlord in one transaction
+
+    Returns the (created, updated, unchanged) property ids.
+    """
+    stored = {
+        ref: (pk, values)
+        for ref, pk, *values in Property.objects.filter(
+            # external_ref > '' lets SQLite use the partial unique index
+            landlord=landlord, external_ref__gt='', external_ref__in=list(rows),
+        ).values_list('external_ref', 'id', *FIELDS)
+    }
+    now = timezone.now()
+    new, changed, unchanged = [], [], []
+    changed_fields = set()
+    for ref, values in rows.items():
+        prop = Property(landlord=landlord, external_ref=ref, **values)
+        if ref not in stored:
+            new.append(prop)
+            continue
+        prop.pk, current = stored[ref]
+        differences = {name for name, value in zip(FIELDS, current) if value != values[name]}
+        if not differences:
+            unchanged.append(prop.pk)
+            continue
+        changed_fields |= differences
+        # bulk_update doesn't run auto_now
+        prop.updated = now
+        changed.append(prop)
+    with transaction.atomic():
+        Property.objects.bulk_create(new)
+        # Feeds mostly change a field or two: only write the fields some row changed
+        Property.objects.bulk_update(changed, [name for name in FIELDS if name in changed_fields] + ['updated'])
+    return [prop.pk for prop in new], [prop.pk for prop in changed], unchanged
+
+
+def import_properties(rows, landlord, batch_size=BATCH_SIZE, workers=0, update_similar=True):
+    """Validate and upsert (line, row) pairs as listings of landlord
+
+    Returns an ImportResult of id lists, errors being [(line, ref, {field: [messages]})].
+    With update_similar=False the similar-properties table is left for
+    rebuild_similar_properties to bring up to date.
+    """
+    created, updated, unchanged, errors = [], [], [], []
+    points = {}
+    with held_bulk_changes():
+        for results in _validated(rows, batch_size, workers):
+            batch = {}
+            for line, ref, values, row_errors in results:
+                if row_errors:
+                    errors.append((line, ref, row_errors))
+                    continue
+                _fill_coordinates(values, points)
+                # A ref repeated within a batch: the last row wins, as it would across batches
+                batch[ref] = values
+            if not batch:
+                continue
+            new, changed, same = upsert(landlord, batch)
+            created += new
+            updated += changed
+            unchanged += same
+    if update_similar:
+        changed = created + updated
+        if len(changed) > SIMILAR_INCREMENTAL_LIMIT:
+            similar.rebuild()
+        else:
+            for pk in changed:
+                similar.property_changed(pk)
+    return ImportResult(created, updated, unchanged, errors)
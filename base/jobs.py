@@ -0,0 +1,172 @@
+"""Background jobs stored in the app's own database
+
+Slow side effects of a request (image variants, refreshing similar lists
+after a delete) are enqueued as Job rows instead of run inline, and the
+run_jobs worker command runs them. There is no broker: a job is written in
+the same transaction as the change that caused it, so it only becomes
+visible to workers once that change is committed, and rolls back with it.
+
+    @jobs.task(max_attempts=3, concurrency=2)
+    def build(label, pk): ...
+
+    jobs.enqueue(build, 'base.Property', 7, key='variants:7:photo.jpg')
+
+Arguments must be JSON-serializable. Workers claim a job with a conditional
+UPDATE, so any number of worker processes can share the table; the same
+UPDATE checks the task's concurrency limit. A job that raises is retried
+after an exponential backoff until max_attempts, then left as failed with
+its traceback. A key makes enqueueing idempotent: while a job with that key
+is queued or running, enqueueing it again returns that job. Once it has
+finished, the key queues a new one.
+"""
+import os
+import socket
+import threading
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# Seconds before the first retry, doubling with every attempt
+BACKOFF = 30
+BACKOFF_MAX = 3600
+# A running job whose worker hasn't finished it by then is presumed dead
+LOCK_TIMEOUT = timedelta(minutes=15)
+# Conditional updates lost to other workers before claim() gives up
+CLAIM_TRIES = 5
+
+Task = namedtuple('Task', 'func max_attempts concurrency')
+TASKS = {}
+
+
+def task(max_attempts=5, concurrency=None):
+    """Register a function as a task; concurrency caps its running jobs across workers"""
+    def register(func):
+        TASKS[f'{func.__module__}.{func.__qualname__}'] = Task(func, max_attempts, concurrency)
+        return func
+    return register
+
+
+def get_task(name):
+    if name not in TASKS:
+        # Importing the task's module registers it
+        import_string(name)
+    return TASKS[name]
+
+
+def enqueue(func, *args, key='', delay=None):
+    """Queue func(*args) to run in a worker, after delay (a timedelta) if given"""
+    name = f'{func.__module__}.{func.__qualname__}'
+    job = Job(
+        task=name, args=list(args), key=key, max_attempts=get_task(name).max_attempts,
+        run_at=timezone.now() + delay if delay else timezone.now(),
+    )
+    if not key:
+        job.save()
+        return job
+    while True:
+        try:
+            with transaction.atomic():
+                job.save()
+            return job
+        except IntegrityError:
+            pass
+        # The job holding the key may finish in between: then insert again
+        active = Job.objects.filter(key=key, status__in=Job.ACTIVE).first()
+        if active is not None:
+            return active
+
+
+def backoff(attempts):
+    """Delay before retrying a job that has failed attempts times"""
+    return timedelta(seconds=min(BACKOFF * 2 ** (attempts - 1), BACKOFF_MAX))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _full_tasks():
+    """Names of the tasks running at their concurrency limit"""
+    limits = {name: task.concurrency for name, task in TASKS.items() if task.concurrency}
+    if not limits:
+        return []
+    running = Job.objects.filter(status=Job.RUNNING, task__in=limits).order_by().values_list('task')
+    return [name for name, count in running.annotate(Count('id')) if count >= limits[name]]
+
+
+def claim(worker):
+    """The next due job, now marked running by worker, or None"""
+    for _ in range(CLAIM_TRIES):
+        now = timezone.now()
+        due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).exclude(task__in=_full_tasks())
+        row = due.values_list('id', 'task').first()
+        if row is None:
+            return None
+        pk, name = row
+        claimable = Job.objects.filter(id=pk, status=Job.QUEUED)
+        limit = TASKS[name].concurrency if name in TASKS else None
+        if limit:
+            # Checked again by the UPDATE: another worker may have claimed one
+            # since _full_tasks(). It has no limit-th running job of the task
+            claimable = claimable.filter(~Exists(
+                Job.objects.filter(status=Job.RUNNING, task=OuterRef('task')).values('id')[limit - 1:limit]
+            ))
+        claimed = claimable.update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1, updated=now,
+        )
+        if claimed:
+            return Job.objects.get(id=pk)
+    return None
+
+
+def run(job, worker):
+    """Run a claimed job and record how it went; True if it succeeded"""
+    try:
+        get_task(job.task).func(*job.args)
+    except Exception:
+        now = timezone.now()
+        retry = job.attempts < job.max_attempts
+        Job.objects.filter(id=job.id, locked_by=worker).update(
+            status=Job.QUEUED if retry else Job.FAILED, run_at=now + backoff(job.attempts) if retry else job.run_at,
+            locked_by='', locked_at=None, last_error=traceback.format_exc(), updated=now,
+        )
+        return False
+    Job.objects.filter(id=job.id, locked_by=worker).update(
+        status=Job.DONE, locked_by='', locked_at=None, last_error='', updated=timezone.now(),
+    )
+    return True
+
+
+def requeue_abandoned():
+    """Queue again the running jobs of workers that died; returns how many"""
+    now = timezone.now()
+    abandoned = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - LOCK_TIMEOUT)
+    failed = abandoned.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, locked_by='', locked_at=None, last_error='Abandoned by its worker', updated=now,
+    )
+    return failed + abandoned.update(status=Job.QUEUED, run_at=now, locked_by='', locked_at=None, updated=now)
+
+
+def run_pending(worker=None):
+    """Run every due job in this thread until none are left; (succeeded, failed)"""
+    worker = worker or worker_name()
+    succeeded = failed = 0
+    while (job := claim(worker)) is not None:
+        if run(job, worker):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def purge(older_than):
+    """Delete jobs that finished more than older_than (a timedelta) ago; returns how many"""
+    finished = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], updated__lt=timezone.now() - older_than)
+    return finished.delete()[0]
@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import RequestFactory
+from base.models import Property, Room
+from concurrent.futures import ThreadPoolExecutor
+from keja.asgi import ASGIHandler
+import asyncio
+import statistics
+import time
+
+# Read endpoints under /api/, each also served as an async view under /api/async/
+ENDPOINTS = ['rooms/', 'rooms/{room}/', 'properties/', 'properties/{property}/', 'activity/']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent API reads: sync views under WSGI and ASGI against the async views under ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per run, spread over the endpoints')
+        parser.add_argument('--concurrency', default='1,10,50',
+                            help='Comma-separated numbers of requests in flight (default: 1,10,50)')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of integers')
+        room = Room.objects.values_list('id', flat=True).first()
+        property = Property.objects.filter(is_available=True).values_list('id', flat=True).first()
+        endpoints = [
+            endpoint.format(room=room, property=property) for endpoint in ENDPOINTS
+            if (room or '{room}' not in endpoint) and (property or '{property}' not in endpoint)
+        ]
+        paths = [endpoints[i % len(endpoints)] for i in range(options['requests'])]
+
+        runs = [
+            ('WSGI, sync views', lambda level: self.run_wsgi(['/api/' + path for path in paths], level)),
+            ('ASGI, sync views', lambda level: self.run_asgi(['/api/' + path for path in paths], level)),
+            ('ASGI, async views', lambda level: self.run_asgi(['/api/async/' + path for path in paths], level)),
+        ]
+        self.stdout.write(f"{len(paths)} requests over {', '.join(endpoints)}")
+        self.stdout.write(f"{'deployment':<20} {'in flight':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for level in levels:
+            for name, run in runs:
+                start = time.perf_counter()
+                results = run(level)
+                elapsed = time.perf_counter() - start
+                failed = [status for status, latency in results if status != 200]
+                if failed:
+                    raise CommandError(f'{name}: {len(failed)} requests failed, e.g. with status {failed[0]}')
+                latencies = sorted(latency * 1000 for status, latency in results)
+                self.stdout.write(
+                    f'{name:<20} {level:>9} {len(results) / elapsed:>8.0f} '
+                    f'{statistics.median(latencies):>8.1f} {latencies[int(len(latencies) * 0.95)]:>8.1f}'
+                )
+
+    def run_wsgi(self, paths, level):
+        """(status, seconds) of each request, through a WSGI handler on a pool of threads"""
+        handler = WSGIHandler()
+        factory = RequestFactory()
+
+        def call(path):
+            start = time.perf_counter()
+            statuses = []
+            b''.join(handler(factory.get(path).environ, lambda status, headers, exc_info=None: statuses.append(status)))
+            return int(statuses[0].split()[0]), time.perf_counter() - start
+
+        with ThreadPoolExecutor(level) as pool:
+            return list(pool.map(call, paths))
+
+    def run_asgi(self, paths, level):
+        """(status, seconds) of each request, through an ASGI handler on one event loop"""
+        handler = ASGIHandler()
+
+        async def call(path, slots):
+            async with slots:
+                start = time.perf_counter()
+                statuses = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        statuses.append(message['status'])
+
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                    'root_path': '', 'headers': [(b'host', b'localhost')],
+                    'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+                }
+                await handler(scope, receive, send)
+                return statuses[0], time.perf_counter() - start
+
+        async def run():
+            slots = asyncio.Semaphore(level)
+            return await asyncio.gather(*(call(path, slots) for path in paths))
+
+        return asyncio.run(run())
@@ -0,0 +1,123 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from base.models import Property, held_bulk_changes
+from base.search import search_properties
+from datetime import date
+from decimal import Decimal
+from itertools import combinations
+import random
+import time
+
+User = get_user_model()
+
+# One representative value per PropertySearchForm field
+SEARCH_VALUES = {
+    'location': 'Downtown',
+    'min_price': Decimal('800'),
+    'max_price': Decimal('2000'),
+    'property_type': 'apartment',
+    'bedrooms': 2,
+}
+
+LOCATIONS = ['Downtown', 'Midtown', 'Suburbs', 'University District', 'Historic District', 'East Side', 'West End']
+PROPERTY_TYPES = [value for value, label in Property.PROPERTY_TYPES]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the home() property search: EXPLAIN QUERY PLAN and timings for every filter combination'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma-separated table sizes to benchmark (default: 10000,100000,1000000)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query, best one is reported')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_create batch size for synthetic rows')
+        parser.add_argument('--no-explain', action='store_true', help='Only report timings')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+
+        # Everything runs inside one transaction that is rolled back at the
+        # end, so the synthetic listings never reach the real table.
+        try:
+            with transaction.atomic():
+                landlord = User.objects.create(username='benchmark-landlord', email='benchmark@keja.invalid')
+                for size in sizes:
+                    self.fill(landlord, size, options['batch_size'])
+                    self.benchmark(size, options['repeat'], not options['no_explain'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def fill(self, landlord, size, batch_size):
+        existing = Property.objects.count()
+        missing = size - existing
+        if missing <= 0:
+            return
+
+        self.stdout.write(f'Generating {missing} synthetic properties...')
+        rng = random.Random(size)
+        today = date.today()
+        # Stats, facets and the search cache are rebuilt once, not after every batch
+        with held_bulk_changes():
+            while missing > 0:
+                batch = min(batch_size, missing)
+                Property.objects.bulk_create([
+                    Property(
+                        landlord=landlord,
+                        title=f'Synthetic listing {existing + i}',
+                        property_type=rng.choice(PROPERTY_TYPES),
+                        rent_amount=Decimal(rng.randrange(300, 5000)),
+                        location=rng.choice(LOCATIONS),
+                        address=f'{rng.randrange(1, 9999)} {rng.choice(LOCATIONS)} Road',
+                        bedrooms=rng.randrange(0, 7),
+                        bathrooms=rng.randrange(1, 4),
+                        area_sqft=rng.randrange(300, 4000),
+                        description='Synthetic benchmark listing.',
+                        is_available=rng.random() < 0.8,
+                        date_available=today,
+                    )
+                    for i in range(batch)
+                ], batch_size=batch)
+                existing += batch
+                missing -= batch
+
+        if connection.vendor == 'sqlite':
+            # bulk_create stamps every row with the same auto_now_add value;
+            # spread them out so the -created sort has real work to do.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE base_property SET created = datetime(created, '-' || (id %% 525600) || ' minutes') "
+                    "WHERE landlord_id = %s",
+                    [landlord.id],
+                )
+                cursor.execute('ANALYZE')
+
+    def benchmark(self, size, repeat, explain):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n=== {size} rows ==='))
+        fields = list(SEARCH_VALUES)
+        for n in range(len(fields) + 1):
+            for combo in combinations(fields, n):
+                cleaned_data = {field: SEARCH_VALUES[field] for field in combo}
+                properties = search_properties(cleaned_data)
+                page = properties[:12]
+
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    list(page)
+                    properties.count()
+                    timings.append(time.perf_counter() - start)
+
+                label = ', '.join(combo) or '(no filters)'
+                self.stdout.write(f'{label:<60} {min(timings) * 1000:9.2f} ms')
+                if explain:
+                    for line in page.explain().splitlines():
+                        self.stdout.write(f'    {line}')
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from base.api.serializers import MessageSerializer, RoomSerializer, message_list, room_list
+from base.models import Message, Room, Topic
+from rest_framework.renderers import JSONRenderer
+import time
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the fast list serializers against the DRF serializers they replace, on synthetic rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=10000, help='Rooms and messages to serialize')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per serializer, best one is reported')
+
+    def handle(self, *args, **options):
+        if options['objects'] < 1:
+            raise CommandError('--objects must be at least 1')
+        # The synthetic rows are rolled back at the end, as in benchmark_search
+        try:
+            with transaction.atomic():
+                rooms, messages = self.fill(options['objects'])
+                self.stdout.write(f"{'serializer':<20} {'objects':>8} {'DRF ms':>8} {'fast ms':>8} {'speedup':>8}")
+                self.benchmark(
+                    'RoomSerializer', options['repeat'],
+                    lambda: RoomSerializer(rooms.prefetch_related('participants'), many=True).data,
+                    lambda: room_list.serialize(rooms),
+                )
+                self.benchmark(
+                    'MessageSerializer', options['repeat'],
+                    lambda: MessageSerializer(messages.select_related('user', 'room'), many=True).data,
+                    lambda: message_list.serialize(messages),
+                )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def fill(self, count):
+        users = User.objects.bulk_create(
+            User(username=f'benchmark-{i}', email=f'benchmark-{i}@keja.invalid') for i in range(10)
+        )
+        topic = Topic.objects.create(name='benchmark')
+        start = Room.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        Room.objects.bulk_create(
+            Room(host=users[i % len(users)], topic=topic, name=f'Room {i}', amount=i, description='A benchmark room')
+            for i in range(count)
+        )
+        rooms = Room.objects.filter(id__gt=start)
+        room_ids = list(rooms.values_list('id', flat=True))
+        Room.participants.through.objects.bulk_create(
+            Room.participants.through(room_id=room_id, user_id=users[(i + j) % len(users)].id)
+            for i, room_id in enumerate(room_ids) for j in range(3)
+        )
+        start = Message.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        Message.objects.bulk_create(
+            Message(user=users[i % len(users)], room_id=room_ids[i], body=f'Message {i}') for i in range(count)
+        )
+        return rooms, Message.objects.filter(id__gt=start)
+
+    def benchmark(self, name, repeat, drf, fast):
+        timings = {}
+        for label, serialize in (('drf', drf), ('fast', fast)):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data = serialize()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = (best, JSONRenderer().render(data))
+        if timings['drf'][1] != timings['fast'][1]:
+            raise CommandError(f'{name}: the fast serializer output differs')
+        self.stdout.write(
+            f"{name:<20} {len(data):>8} {timings['drf'][0] * 1000:>8.0f} {timings['fast'][0] * 1000:>8.0f} "
+            f"{timings['drf'][0] / timings['fast'][0]:>7.1f}x"
+        )
@@ -0,0 +1,32 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from base import images
+import time
+
+
+class Command(BaseCommand):
+    help = 'Build the resized WebP/JPEG variants of every uploaded image that lacks up-to-date ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes; 0 builds in this process')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        jobs = []
+        for label, field, variants_field in images.IMAGE_FIELDS:
+            rows = apps.get_model(label).objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            jobs.extend(
+                (label, pk, field, variants_field)
+                for pk, name, variants in rows.values_list('pk', field, variants_field).iterator()
+                if variants.get('source') != name
+            )
+        if options['workers']:
+            with images.worker_pool(options['workers']) as pool:
+                built = list(pool.map(images.build, *zip(*jobs))) if jobs else []
+        else:
+            built = [images.build(*job) for job in jobs]
+        done = sum(variants is not None for variants in built)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Built variants of {done} images in {elapsed:.1f}s ({len(jobs) - done} unreadable or changed meanwhile)'
+        ))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from base import export
+import time
+
+
+class Command(BaseCommand):
+    help = 'Export listings or messages updated since a watermark as NDJSON or CSV, streamed in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.EXPORTS))
+        parser.add_argument('output', help='File to write, - for standard output; a .gz name is gzip-compressed')
+        parser.add_argument('--since', help='Only rows updated after this ISO timestamp, the watermark of the last export')
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='gzip-compress the output')
+        parser.add_argument('--batch-size', type=int, default=export.BATCH_SIZE, help='Rows per query and write')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"--since {options['since']!r} is not an ISO timestamp")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        output = options['output']
+        compress = options['gzip'] or output.endswith('.gz')
+        if output == '-' and compress:
+            raise CommandError('Write gzip output to a file')
+
+        start = time.perf_counter()
+        until, chunks = export.export(
+            options['kind'], since=since, format=options['format'], compress=compress,
+            batch_size=options['batch_size'],
+        )
+        size = 0
+        if output == '-':
+            for chunk in chunks:
+                size += len(chunk)
+                self.stdout.write(chunk.decode(), ending='')
+        else:
+            # Compressed chunks are already gzip, so write them as they are
+            with open(output, 'wb') as file:
+                for chunk in chunks:
+                    size += len(chunk)
+                    file.write(chunk)
+        elapsed = time.perf_counter() - start
+
+        # The data may be on stdout, so the summary goes to stderr
+        watermark = until or since
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {options['kind']} in {elapsed:.1f}s ({size:,} bytes). "
+            + (f'Next export: --since {watermark.isoformat()}' if watermark else 'Nothing to export yet')
+        ))
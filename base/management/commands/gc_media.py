@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from base import storage
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    help = 'Recount references to the content-addressed media store and delete files nothing uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=float, default=24,
+                            help='Hours a file must have gone unreferenced before it is deleted (default: 24)')
+        parser.add_argument('--dry-run', action='store_true', help='List what would be deleted without deleting it')
+
+    def handle(self, *args, **options):
+        recounted = storage.recount()
+        deleted = storage.collect(timedelta(hours=options['grace']), dry_run=options['dry_run'])
+        for name in deleted:
+            self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{recounted} reference counts corrected, {len(deleted)} files "
+            f"{'to delete' if options['dry_run'] else 'deleted'}"
+        ))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from base import ingest
+import os
+import sys
+import time
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import (create or update) listings of one landlord from a CSV or NDJSON feed keyed by a ref column'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file, - for standard input')
+        parser.add_argument('--landlord', required=True, help='Username of the landlord the listings belong to')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Input format (default: from the file extension, csv for standard input)')
+        parser.add_argument('--batch-size', type=int, default=ingest.BATCH_SIZE, help='Rows per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Validation processes, 0 to validate in this process (default: one per CPU)')
+        parser.add_argument('--skip-similar', action='store_true',
+                            help='Leave the similar-properties table to a later rebuild_similar_properties')
+
+    def handle(self, *args, **options):
+        try:
+            landlord = User.objects.get(username=options['landlord'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['landlord']!r}")
+        path = options['path']
+        format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        start = time.perf_counter()
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = ingest.import_properties(
+                ingest.read_rows(stream, format), landlord,
+                batch_size=options['batch_size'], workers=options['workers'],
+                update_similar=not options['skip_similar'],
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - start
+
+        for line, ref, errors in result.errors:
+            for field, messages in errors.items():
+                label = '' if field == '__all__' else f'{field}: '
+                self.stderr.write(f"line {line} (ref {ref or '-'}): {label}{' '.join(messages)}")
+        rows = len(result.created) + len(result.updated) + len(result.unchanged) + len(result.errors)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s): '
+            f'{len(result.created)} created, {len(result.updated)} updated, '
+            f'{len(result.unchanged)} unchanged, {len(result.errors)} errors'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from base import facets
+from base.models import PropertyTypeStats
+
+
+class Command(BaseCommand):
+    help = 'Recount the available listings per property type and per facet bucket from scratch'
+
+    def handle(self, *args, **options):
+        PropertyTypeStats.rebuild()
+        facets.rebuild()
+        for property_type, count in PropertyTypeStats.counts().items():
+            self.stdout.write(f'{property_type}: {count}')
+        self.stdout.write(self.style.SUCCESS('Listing stats rebuilt'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from base import similar
+import time
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar-properties table of every available listing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = similar.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'Similar properties rebuilt for {count} listings in {elapsed:.1f}s'))
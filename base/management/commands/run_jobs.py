@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from base import jobs
+from datetime import timedelta
+import signal
+import threading
+import time
+
+# Seconds between requeueing abandoned jobs and purging finished ones
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (see base/jobs.py) until stopped with Ctrl-C or SIGTERM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Jobs run at once, each in its own thread')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between polls of an empty queue')
+        parser.add_argument('--purge-after', type=int, default=7,
+                            help='Delete finished jobs after this many days (default: 7)')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            # Finish the jobs in hand, then exit
+            signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        self.lock = threading.Lock()
+        self.counts = {'succeeded': 0, 'failed': 0}
+        self.maintain(options['purge_after'])
+
+        workers = [
+            threading.Thread(target=self.work, args=(stop, options['poll'], options['once']))
+            for _ in range(options['concurrency'])
+        ]
+        for worker in workers:
+            worker.start()
+        maintained = time.monotonic()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(1)
+                    if time.monotonic() - maintained >= MAINTENANCE_INTERVAL:
+                        self.maintain(options['purge_after'])
+                        maintained = time.monotonic()
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {self.counts['succeeded'] + self.counts['failed']} jobs ({self.counts['failed']} failed)"
+        ))
+
+    def maintain(self, purge_after):
+        requeued = jobs.requeue_abandoned()
+        if requeued:
+            self.stderr.write(f'{requeued} abandoned jobs requeued')
+        jobs.purge(timedelta(days=purge_after))
+
+    def work(self, stop, poll, once):
+        worker = jobs.worker_name()
+        try:
+            while not stop.is_set():
+                job = jobs.claim(worker)
+                if job is None:
+                    if once:
+                        break
+                    stop.wait(poll)
+                    continue
+                succeeded = jobs.run(job, worker)
+                with self.lock:
+                    self.counts['succeeded' if succeeded else 'failed'] += 1
+                if not succeeded:
+                    self.stderr.write(f'{job} failed on attempt {job.attempts} of {job.max_attempts}')
+        finally:
+            connection.close()
@@ -0,0 +1,184 @@
+"""Serving uploaded files from MEDIA_ROOT
+
+serve() replaces django.views.static.serve, which reads every file through
+Python and only runs with DEBUG. It answers conditional requests from the
+file's ETag and mtime, single byte ranges (video seeking, resumed
+downloads) and HEAD without opening the file. Content-addressed blobs (see
+base/storage.py) and their variants never change under their name, so
+browsers may cache them for a year without revalidating.
+
+With settings.MEDIA_SENDFILE the web server sends the file instead:
+
+    MEDIA_SENDFILE = 'X-Accel-Redirect'         # nginx
+    MEDIA_SENDFILE_URL = '/protected-media/'    # internal location aliasing MEDIA_ROOT
+    MEDIA_SENDFILE = 'X-Sendfile'               # Apache mod_xsendfile, lighttpd
+
+and handles ranges itself. Otherwise a FileResponse streams it, which WSGI
+servers with wsgi.file_wrapper (gunicorn, uWSGI) pass to sendfile().
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .images import VARIANTS_ROOT
+from .storage import BLOB_ROOT, is_blob
+
+# Seconds browsers may reuse a file before revalidating it
+MAX_AGE = 60 * 60
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+ENCODED_TYPES = {'gzip': 'application/gzip', 'bzip2': 'application/x-bzip', 'xz': 'application/x-xz'}
+
+
+def is_immutable(name):
+    """Whether the file stored as name never changes: a blob or one of its variants"""
+    return is_blob(name) or name.startswith(f'{VARIANTS_ROOT}/{BLOB_ROOT}/')
+
+
+def file_etag(name, stat):
+    if is_blob(name):
+        # Named by the digest of its bytes
+        return '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def byte_range(request, size, etag, last_modified):
+    """(first, last) byte of the one range requested, None for the whole file
+
+    Raises ValueError for a range that starts past the end of the file.
+    Several ranges at once, or a stale If-Range, get the whole file.
+    """
+    match = RANGE_RE.match(request.headers.get('Range', '').replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last n bytes
+        if int(last) == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - int(last), 0), size - 1
+    first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError('Range starts past the end of the file')
+    if last < first:
+        return None
+    return first, last
+
+
+class FileRange:
+    """Read-only view of length bytes of a file, from where it's positioned"""
+
+    def __init__(self, file, length):
+        self.file, self.remaining = file, length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def sendfile_header(name, path):
+    """(header, value) handing the file to the web server per MEDIA_SENDFILE, or None"""
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if not mode:
+        return None
+    if mode == 'X-Accel-Redirect':
+        return mode, getattr(settings, 'MEDIA_SENDFILE_URL', '/protected-media/').rstrip('/') + '/' + quote(name)
+    if mode == 'X-Sendfile':
+        return mode, path
+    raise ValueError(f'Unknown MEDIA_SENDFILE: {mode!r}')
+
+
+def guess_type(name):
+    content_type, encoding = mimetypes.guess_type(name)
+    # Served as stored: a .gz upload mustn't be decompressed by the browser
+    return ENCODED_TYPES.get(encoding, content_type or 'application/octet-stream')
+
+
+def send_file(request, path, stat, etag, content_type, immutable=False, sendfile=None):
+    """Conditional, ranged response of the file at path, or a sendfile header for the web server"""
+    last_modified = int(stat.st_mtime)
+    validators = HttpResponse()
+    validators['ETag'] = etag
+    validators['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        patch_cache_control(validators, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(validators, public=True, max_age=MAX_AGE)
+    checked = get_conditional_response(request, etag, last_modified, validators)
+    if checked is not validators:
+        return checked
+
+    if sendfile:
+        response = HttpResponse()
+        response[sendfile[0]] = sendfile[1]
+    else:
+        try:
+            ranged = byte_range(request, stat.st_size, etag, last_modified)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if request.method == 'HEAD':
+            response = HttpResponse()
+            response['Content-Length'] = stat.st_size
+        elif ranged is None:
+            response = FileResponse(open(path, 'rb'))
+            response['Content-Length'] = stat.st_size
+        else:
+            first, last = ranged
+            file = open(path, 'rb')
+            file.seek(first)
+            response = FileResponse(FileRange(file, last - first + 1), status=206)
+            response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+            response['Content-Length'] = last - first + 1
+        response['Accept-Ranges'] = 'bytes'
+    response['Content-Type'] = content_type
+    for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+        response[header] = validators[header]
+    return response
+
+
+def find_file(root, path):
+    """(name, full path, stat) of the regular file path names under root; raises Http404"""
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(root, name)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('No such file')
+    if not os.path.isfile(full_path):
+        raise Http404('No such file')
+    return name, full_path, stat
+
+
+@require_safe
+def serve(request, path):
+    """The file stored under MEDIA_ROOT as path"""
+    name, full_path, stat = find_file(settings.MEDIA_ROOT, path)
+    if name.endswith('.tmp'):
+        # Uploads still being written by ContentAddressedStorage
+        raise Http404('No such file')
+    return send_file(
+        request, full_path, stat, file_etag(name, stat), guess_type(name),
+        immutable=is_immutable(name), sendfile=sendfile_header(name, full_path),
+    )
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_alter_user_avatar_alter_user_bio_alter_user_email_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-created'], name='property_avail_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['property_type', '-created'], name='property_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['rent_amount'], name='property_avail_rent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['property_type', 'rent_amount'], name='property_type_rent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['bedrooms'], name='property_avail_beds_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_property_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_avail_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_type_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-created', '-id'], name='property_avail_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['property_type', '-created', '-id'], name='property_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['landlord', '-created', '-id'], name='property_landlord_created_idx'),
+        ),
+    ]
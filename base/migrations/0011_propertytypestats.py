@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:17
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_listings(apps, schema_editor):
+    Property = apps.get_model('base', 'Property')
+    PropertyTypeStats = apps.get_model('base', 'PropertyTypeStats')
+    counts = (
+        Property.objects.filter(is_available=True).order_by()
+        .values_list('property_type').annotate(n=Count('id'))
+    )
+    PropertyTypeStats.objects.bulk_create([
+        PropertyTypeStats(property_type=property_type, available_count=n) for property_type, n in counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_property_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyTypeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('property_type', models.CharField(choices=[('apartment', 'Apartment'), ('house', 'House'), ('studio', 'Studio'), ('condo', 'Condo'), ('townhouse', 'Townhouse')], max_length=20, unique=True)),
+                ('available_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Property type stats',
+                'ordering': ['property_type'],
+            },
+        ),
+        migrations.RunPython(count_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:18
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def fill_excerpts(apps, schema_editor):
+    Property = apps.get_model('base', 'Property')
+    batch = []
+    for prop in Property.objects.only('id', 'description').iterator(chunk_size=2000):
+        prop.excerpt = Truncator(prop.description or '').words(15, truncate=' …')[:300]
+        batch.append(prop)
+        if len(batch) == 2000:
+            Property.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    Property.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_propertytypestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
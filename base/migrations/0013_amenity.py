@@ -0,0 +1,54 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:19
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def parse_existing_amenities(apps, schema_editor):
+    Property = apps.get_model('base', 'Property')
+    Amenity = apps.get_model('base', 'Amenity')
+    Through = Property.amenity_tags.through
+    amenities = {}
+    links = []
+    for pk, text in Property.objects.values_list('id', 'amenities').iterator(chunk_size=2000):
+        slugs = set()
+        for name in (text or '').split(','):
+            name = name.strip()
+            slug = slugify(name)
+            if slug and slug not in slugs:
+                slugs.add(slug)
+                amenities.setdefault(slug, name)
+                links.append((pk, slug))
+    Amenity.objects.bulk_create([Amenity(slug=slug, name=name) for slug, name in amenities.items()])
+    ids = dict(Amenity.objects.values_list('slug', 'id'))
+    Through.objects.bulk_create(
+        [Through(property_id=pk, amenity_id=ids[slug]) for pk, slug in links], batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_property_excerpt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Amenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Amenities',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='amenity_tags',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='properties', to='base.amenity'),
+        ),
+        migrations.RunPython(parse_existing_amenities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_property_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarProperty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'Similar properties',
+                'ordering': ['property', 'rank'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(django.db.models.functions.text.Lower('location'), models.F('rent_amount'), condition=models.Q(('is_available', True)), name='property_location_rent_idx'),
+        ),
+        migrations.AddField(
+            model_name='similarproperty',
+            name='property',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='base.property'),
+        ),
+        migrations.AddField(
+            model_name='similarproperty',
+            name='similar',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='base.property'),
+        ),
+        migrations.AddConstraint(
+            model_name='similarproperty',
+            constraint=models.UniqueConstraint(fields=('property', 'rank'), name='similar_property_rank_uniq'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:35
+
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, Value
+from django.db.models.functions import Cast, Least
+
+
+def count_facets(apps, schema_editor):
+    Property = apps.get_model('base', 'Property')
+    FacetCount = apps.get_model('base', 'FacetCount')
+    # Same buckets as base.facets: 4+ bedrooms and 4500+ rent are open-ended
+    rows = (
+        Property.objects.filter(is_available=True).order_by()
+        .values_list(
+            'property_type',
+            Least(F('bedrooms'), Value(4)),
+            Least(Cast(F('rent_amount') / 500, IntegerField()), Value(9)),
+        )
+        .annotate(n=Count('id'))
+    )
+    FacetCount.objects.bulk_create([
+        FacetCount(property_type=property_type, bedrooms=bedrooms, rent_bucket=rent_bucket, count=n)
+        for property_type, bedrooms, rent_bucket, n in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_similarproperty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('property_type', models.CharField(choices=[('apartment', 'Apartment'), ('house', 'House'), ('studio', 'Studio'), ('condo', 'Condo'), ('townhouse', 'Townhouse')], max_length=20)),
+                ('bedrooms', models.SmallIntegerField()),
+                ('rent_bucket', models.SmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['property_type', 'bedrooms', 'rent_amount'], name='property_facets_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('property_type', 'bedrooms', 'rent_bucket'), name='facet_count_bucket_uniq'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
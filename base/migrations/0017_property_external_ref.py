@@ -0,0 +1,22 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0016_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='external_ref',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='property',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_ref__gt', '')), fields=('landlord', 'external_ref'), name='property_landlord_ref_unique'),
+        ),
+    ]
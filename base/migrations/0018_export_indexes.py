@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0017_property_external_ref'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['updated', 'id'], name='message_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['updated', 'id'], name='property_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:31
+
+import base.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0020_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('refs', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='property',
+            name='main_image',
+            field=models.ImageField(blank=True, null=True, storage=base.storage.ContentAddressedStorage(), upload_to='properties/'),
+        ),
+        migrations.AlterField(
+            model_name='propertyimage',
+            name='image',
+            field=models.ImageField(storage=base.storage.ContentAddressedStorage(), upload_to='properties/'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, default='avatar.svg', null=True, storage=base.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['main_image'], name='property_main_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='propertyimage',
+            index=models.Index(fields=['image'], name='propertyimage_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediablob',
+            index=models.Index(condition=models.Q(('refs', 0)), fields=['updated'], name='mediablob_orphan_idx'),
+        ),
+    ]
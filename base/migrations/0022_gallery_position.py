@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0021_media_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='propertyimage',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='propertyimage',
+            index=models.Index(fields=['property', 'position', 'id'], name='propertyimage_position_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0022_gallery_position'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-created', '-id'], name='message_created_idx'),
+        ),
+    ]
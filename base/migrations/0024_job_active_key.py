@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0023_activity_feed_index'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='job',
+            name='job_key_unique',
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('key__gt', ''), ('status__in', ['queued', 'running'])), fields=('key',), name='job_active_key_unique'),
+        ),
+    ]
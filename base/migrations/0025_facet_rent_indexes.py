@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0024_job_active_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_avail_rent_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_type_rent_idx',
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['rent_amount', 'property_type', 'bedrooms'], name='property_avail_rent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['property_type', 'rent_amount', 'bedrooms'], name='property_type_rent_idx'),
+        ),
+    ]
@@ -1,13 +1,56 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Lower
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.text import Truncator, slugify
 from django.contrib.auth.models import AbstractUser
 
+from .storage import media_storage
+
+# Sent after queryset writes that bypass save()/delete() and their signals,
+# with the names of the fields written (None when every field may have been).
+properties_bulk_changed = Signal()
+_held_changes = threading.local()
+
+
+@contextmanager
+def held_bulk_changes():
+    """Send properties_bulk_changed once, when the block exits, for all its bulk writes
+
+    Its handlers rebuild whole tables, which a batched import would
+    otherwise pay for after every batch.
+    """
+    if getattr(_held_changes, 'fields', None) is not None:
+        yield
+        return
+    _held_changes.fields = []
+    try:
+        yield
+    finally:
+        held, _held_changes.fields = _held_changes.fields, None
+        if held:
+            fields = None if None in held else set().union(*held)
+            properties_bulk_changed.send(sender=Property, fields=fields)
+
+
+def _bulk_changed(fields):
+    held = getattr(_held_changes, 'fields', None)
+    if held is None:
+        properties_bulk_changed.send(sender=Property, fields=fields)
+    else:
+        held.append(fields)
+
 
 class User(AbstractUser):
     name = models.CharField(max_length=200, null=True, blank=True)
     email = models.EmailField(unique=True, null=False, blank=False)
     bio = models.TextField(null=True, blank=True)
 
-    avatar = models.ImageField(null=True, blank=True, default="avatar.svg")
+    avatar = models.ImageField(null=True, blank=True, default="avatar.svg", storage=media_storage)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
@@ -20,6 +63,104 @@ class Topic(models.Model):
         return self.name
 
 
+EXCERPT_WORDS = 15
+# Everything a listing card renders; the text columns stay in the database
+CARD_FIELDS = [
+    'id', 'title', 'property_type', 'rent_amount', 'location', 'bedrooms', 'bathrooms',
+    'area_sqft', 'excerpt', 'is_available', 'main_image', 'main_image_variants', 'latitude', 'longitude',
+    'created', 'landlord__username',
+]
+
+
+def parse_amenities(text):
+    """{slug: name} of a comma-separated amenities string, in order"""
+    amenities = {}
+    for name in (text or '').split(','):
+        name = name.strip()
+        slug = slugify(name)
+        if slug and slug not in amenities:
+            amenities[slug] = name
+    return amenities
+
+
+def sync_amenities(properties):
+    """Point the amenity_tags of saved properties at their amenities text"""
+    properties = [prop for prop in properties if prop.pk]
+    if not properties:
+        return
+    parsed = {prop.pk: parse_amenities(prop.amenities) for prop in properties}
+    names = {}
+    for amenities in parsed.values():
+        for slug, name in amenities.items():
+            names.setdefault(slug, name)
+    Amenity.objects.bulk_create(
+        [Amenity(slug=slug, name=name) for slug, name in names.items()], ignore_conflicts=True
+    )
+    ids = dict(Amenity.objects.filter(slug__in=names).values_list('slug', 'id'))
+    Through = Property.amenity_tags.through
+    with transaction.atomic():
+        Through.objects.filter(property_id__in=parsed).delete()
+        Through.objects.bulk_create([
+            Through(property_id=pk, amenity_id=ids[slug]) for pk, amenities in parsed.items() for slug in amenities
+        ])
+
+
+def make_excerpt(text):
+    """Same text as the truncatewords template filter gives"""
+    return Truncator(text or '').words(EXCERPT_WORDS, truncate=' …')[:300]
+
+
+class PropertyQuerySet(models.QuerySet):
+    def cards(self):
+        """Listing card projection: landlord joined, heavy text columns deferred
+
+        Each card also gets first_image and first_image_variants, the first
+        photo of its gallery, read by an index seek per row in the same query.
+        """
+        gallery = PropertyImage.objects.filter(property=models.OuterRef('pk')).order_by('position', 'id')
+        return self.select_related('landlord').only(*CARD_FIELDS).annotate(
+            first_image=models.Subquery(gallery.values('image')[:1]),
+            first_image_variants=models.Subquery(gallery.values('image_variants')[:1]),
+        )
+
+    def update(self, **kwargs):
+        if 'description' in kwargs and 'excerpt' not in kwargs:
+            # The excerpt of an expression can't be computed here
+            description = kwargs['description']
+            if isinstance(description, str):
+                kwargs['excerpt'] = make_excerpt(description)
+        ids = list(self.values_list('id', flat=True)) if 'amenities' in kwargs else None
+        rows = super().update(**kwargs)
+        if ids:
+            sync_amenities(Property.objects.filter(id__in=ids).only('id', 'amenities'))
+        if rows:
+            _bulk_changed(set(kwargs))
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.excerpt = make_excerpt(obj.description)
+        objs = super().bulk_create(objs, *args, **kwargs)
+        sync_amenities(objs)
+        if objs:
+            _bulk_changed(None)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'description' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.excerpt = make_excerpt(obj.description)
+            fields = list(fields) + ['excerpt']
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if 'amenities' in fields:
+            sync_amenities(objs)
+        if rows:
+            _bulk_changed(set(fields))
+        return rows
+
+
 class Property(models.Model):
     PROPERTY_TYPES = [
         ('apartment', 'Apartment'),
@@ -39,22 +180,74 @@ class Property(models.Model):
     bathrooms = models.IntegerField()
     area_sqft = models.IntegerField(help_text="Area in square feet")
     description = models.TextField()
+    # First words of description, so listing cards never load the full text
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
     amenities = models.TextField(help_text="Comma-separated amenities", blank=True)
+    # Parsed from amenities on every save, for indexed amenity filtering
+    amenity_tags = models.ManyToManyField('Amenity', related_name='properties', blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     date_available = models.DateField()
+    # WGS84 degrees; geocoded from location when left empty (see base/geo.py)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # The landlord's own id for a listing imported from a feed, see import_properties
+    external_ref = models.CharField(max_length=100, blank=True, default='', editable=False)
     
     # Images
-    main_image = models.ImageField(upload_to='properties/', null=True, blank=True)
+    main_image = models.ImageField(upload_to='properties/', null=True, blank=True, storage=media_storage)
+    # Source name and widths of main_image's resized variants, see base/images.py
+    main_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+
+    objects = PropertyQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created']
         verbose_name_plural = "Properties"
-    
+        # Built around the PropertySearchForm filters. Every search runs on
+        # is_available=True (rendered as a bare boolean term, which a plain
+        # leading column can't seek on), so the indexes are partial on it.
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='property_avail_created_idx', condition=models.Q(is_available=True)),
+            models.Index(fields=['property_type', '-created', '-id'], name='property_type_created_idx',
+                         condition=models.Q(is_available=True)),
+            # Price ranges; the trailing columns cover the facet counts of a
+            # partial rent bucket, see facets.facet_counts()
+            models.Index(fields=['rent_amount', 'property_type', 'bedrooms'], name='property_avail_rent_idx',
+                         condition=models.Q(is_available=True)),
+            models.Index(fields=['property_type', 'rent_amount', 'bedrooms'], name='property_type_rent_idx',
+                         condition=models.Q(is_available=True)),
+            models.Index(fields=['bedrooms'], name='property_avail_beds_idx', condition=models.Q(is_available=True)),
+            # my_properties: one landlord's listings, newest first
+            models.Index(fields=['landlord', '-created', '-id'], name='property_landlord_created_idx'),
+            # Covers the facet_counts() grouped aggregate
+            models.Index(fields=['property_type', 'bedrooms', 'rent_amount'], name='property_facets_idx',
+                         condition=models.Q(is_available=True)),
+            # Similar-property candidates: same location, nearest rent
+            models.Index(Lower('location'), F('rent_amount'), name='property_location_rent_idx',
+                         condition=models.Q(is_available=True)),
+            # Incremental exports, see base/export.py
+            models.Index(fields=['updated', 'id'], name='property_updated_idx'),
+            # Other listings sharing a stored photo, see base/images.py
+            models.Index(fields=['main_image'], name='property_main_image_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['landlord', 'external_ref'], name='property_landlord_ref_unique',
+                                    condition=models.Q(external_ref__gt='')),
+        ]
+
     def __str__(self):
         return f"{self.title} - ${self.rent_amount}/month"
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'description' in update_fields:
+            self.excerpt = make_excerpt(self.description)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'excerpt'}
+        super().save(*args, **kwargs)
     
     @property
     def imageURL(self):
@@ -65,12 +258,135 @@ class Property(models.Model):
         return url
 
 
+class Amenity(models.Model):
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = "Amenities"
+
+    def __str__(self):
+        return self.name
+
+
+class Place(models.Model):
+    """Local geocoder lookup table: known place names and their coordinates"""
+    name = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=200, unique=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify(self.name)
+        super().save(*args, **kwargs)
+
+
+class PropertyTypeStats(models.Model):
+    """Number of available listings per property type
+
+    Kept up to date by the Property signals (see base/signals.py) so pages
+    can show totals and per-type counts without counting the table.
+    """
+    property_type = models.CharField(max_length=20, choices=Property.PROPERTY_TYPES, unique=True)
+    available_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['property_type']
+        verbose_name_plural = "Property type stats"
+
+    def __str__(self):
+        return f"{self.property_type}: {self.available_count}"
+
+    @classmethod
+    def adjust(cls, property_type, delta):
+        if not cls.objects.filter(property_type=property_type).update(available_count=F('available_count') + delta):
+            cls.objects.get_or_create(property_type=property_type)
+            cls.objects.filter(property_type=property_type).update(available_count=F('available_count') + delta)
+
+    @classmethod
+    def rebuild(cls):
+        """Recount every type from the Property table"""
+        counts = dict(
+            Property.objects.filter(is_available=True).order_by()
+            .values_list('property_type').annotate(n=Count('id'))
+        )
+        with transaction.atomic():
+            for property_type in set(counts) | set(cls.objects.values_list('property_type', flat=True)):
+                cls.objects.update_or_create(
+                    property_type=property_type, defaults={'available_count': counts.get(property_type, 0)}
+                )
+
+    @classmethod
+    def counts(cls):
+        """{property_type: available count} for every type, in one query"""
+        counts = {value: 0 for value, label in Property.PROPERTY_TYPES}
+        counts.update(cls.objects.values_list('property_type', 'available_count'))
+        return counts
+
+
+class SimilarProperty(models.Model):
+    """Precomputed top listings similar to a property, see base/similar.py"""
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='similar_links')
+    similar = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='similar_to')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['property', 'rank']
+        verbose_name_plural = "Similar properties"
+        constraints = [
+            models.UniqueConstraint(fields=['property', 'rank'], name='similar_property_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.property_id} ~ {self.similar_id} ({self.score:.2f})"
+
+
+class FacetCount(models.Model):
+    """Available listings per (type, bedroom bucket, rent bucket)
+
+    The facet counts of an unfiltered search, kept up to date by the
+    Property signals; see base/facets.py for the buckets.
+    """
+    property_type = models.CharField(max_length=20, choices=Property.PROPERTY_TYPES)
+    bedrooms = models.SmallIntegerField()
+    rent_bucket = models.SmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['property_type', 'bedrooms', 'rent_bucket'], name='facet_count_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.property_type}/{self.bedrooms}/{self.rent_bucket}: {self.count}"
+
+
 class PropertyImage(models.Model):
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='properties/')
+    image = models.ImageField(upload_to='properties/', storage=media_storage)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     caption = models.CharField(max_length=200, blank=True)
+    # Place in the listing's gallery, from 0
+    position = models.PositiveSmallIntegerField(default=0)
     created = models.DateTimeField(auto_now_add=True)
-    
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['image'], name='propertyimage_image_idx'),
+            # A listing's gallery in order, and its first image for cards
+            models.Index(fields=['property', 'position', 'id'], name='propertyimage_position_idx'),
+        ]
+
     def __str__(self):
         return f"Image for {self.property.title}"
 
@@ -113,8 +429,72 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-updated', '-created']
+        indexes = [
+            # Incremental exports, see base/export.py
+            models.Index(fields=['updated', 'id'], name='message_updated_idx'),
+            # The activity feed's keyset pages, newest first
+            models.Index(fields=['-created', '-id'], name='message_created_idx'),
+        ]
 
     def __str__(self):
         return self.body[0:50]
 
 
+class Job(models.Model):
+    """A queued call of a base.jobs task, run by the run_jobs worker"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    # Not finished yet: a key is unique among these
+    ACTIVE = [QUEUED, RUNNING]
+
+    # Dotted path of the task function
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    # Idempotency key: enqueueing a key that's queued or running returns that job
+    key = models.CharField(max_length=200, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            # The next job to claim
+            models.Index(fields=['run_at', 'id'], name='job_queued_idx', condition=models.Q(status='queued')),
+            # Running jobs, to count them per task and find abandoned ones
+            models.Index(fields=['task', 'locked_at'], name='job_running_idx', condition=models.Q(status='running')),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'], name='job_active_key_unique', condition=models.Q(key__gt='', status__in=['queued', 'running']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task}{tuple(self.args)} [{self.status}]"
+
+
+class MediaBlob(models.Model):
+    """References to one file of the content-addressed media store, see base/storage.py"""
+    name = models.CharField(max_length=100, unique=True)
+    refs = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    # When refs last changed: an unreferenced blob is collected a grace period after
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated'], name='mediablob_orphan_idx', condition=models.Q(refs=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refs} refs)"
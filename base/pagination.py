@@ -0,0 +1,183 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+CURSOR_SALT = 'base.pagination.cursor'
+
+
+def encode_cursor(payload):
+    """Opaque, tamper-proof token for a cursor payload"""
+    return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token):
+    """Payload of a cursor token, or None if it is missing or invalid"""
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def cursor_filters(token):
+    """Search filters carried by a cursor token, or None"""
+    payload = decode_cursor(token)
+    if payload is None:
+        return None
+    return payload.get('f', {})
+
+
+def _dump_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, last_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.last_cursor = last_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self)} objects>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Cursor pagination over the queryset's ordering
+
+    Pages are found with a WHERE on the ordering keys of the row at the
+    page boundary instead of an OFFSET, so every page costs the same as the
+    first, and there is no COUNT(*) unless an estimate is asked for. The
+    primary key is appended to the ordering as a tiebreaker.
+    """
+
+    def __init__(self, queryset, per_page, count_limit=None):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(key.lstrip('-') in ('pk', 'id') for key in ordering):
+            ordering.append('-id' if ordering and ordering[-1].startswith('-') else 'id')
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+        self.count_limit = count_limit
+        self._estimate = None
+
+    def get_page(self, cursor=None, filters=None):
+        payload = decode_cursor(cursor)
+        if payload is not None:
+            filters = payload.get('f', filters)
+            if payload.get('d') != 'last' and len(payload.get('k', [])) != len(self.ordering):
+                payload = None
+        filters = filters or {}
+
+        if payload is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            return self._page(rows[:self.per_page], len(rows) > self.per_page, False, filters)
+
+        if payload['d'] == 'last':
+            # The last page is the first page of the reversed ordering
+            ordering = [self._flip(key) for key in self.ordering]
+            rows = list(self.queryset.order_by(*ordering)[:self.per_page + 1])
+            return self._page(rows[:self.per_page][::-1], False, len(rows) > self.per_page, filters)
+
+        values = self._load_values(payload['k'])
+        if payload['d'] == 'prev':
+            ordering = [self._flip(key) for key in self.ordering]
+            queryset = self.queryset.filter(self._after(ordering, values)).order_by(*ordering)
+            rows = list(queryset[:self.per_page + 1])
+            return self._page(rows[:self.per_page][::-1], True, len(rows) > self.per_page, filters)
+
+        queryset = self.queryset.filter(self._after(self.ordering, values))
+        rows = list(queryset[:self.per_page + 1])
+        return self._page(rows[:self.per_page], len(rows) > self.per_page, True, filters)
+
+    def _page(self, rows, has_next, has_previous, filters):
+        page = KeysetPage(rows)
+        if rows and has_next:
+            page.next_cursor = self.cursor_for(rows[-1], 'next', filters)
+            page.last_cursor = encode_cursor({'k': [], 'd': 'last', 'f': filters})
+        if rows and has_previous:
+            page.previous_cursor = self.cursor_for(rows[0], 'prev', filters)
+        return page
+
+    def cursor_for(self, obj, direction, filters):
+        values = [_dump_value(getattr(obj, key.lstrip('-'))) for key in self.ordering]
+        return encode_cursor({'k': values, 'd': direction, 'f': filters})
+
+    @property
+    def estimated_total(self):
+        """Number of matching rows, counted no further than count_limit"""
+        if self.count_limit is None:
+            return None
+        if self._estimate is None:
+            self._estimate = self.queryset.order_by()[:self.count_limit + 1].count()
+        return min(self._estimate, self.count_limit)
+
+    @property
+    def total_is_estimate(self):
+        return self.estimated_total is not None and self._estimate > self.count_limit
+
+    def _load_values(self, raw_values):
+        values = []
+        for key, value in zip(self.ordering, raw_values):
+            name = key.lstrip('-')
+            try:
+                field = self.queryset.model._meta.get_field('id' if name == 'pk' else name)
+            except FieldDoesNotExist:
+                # Annotations such as search_rank round-trip as plain JSON
+                values.append(value)
+                continue
+            try:
+                values.append(field.to_python(value))
+            except ValidationError:
+                values.append(value)
+        return values
+
+    @staticmethod
+    def _flip(key):
+        return key[1:] if key.startswith('-') else f'-{key}'
+
+    @staticmethod
+    def _after(ordering, values):
+        """Rows strictly after values in ordering, as a lexicographic Q
+
+        The expansion is ANDed with a non-strict bound on the leading key,
+        which is what lets the database seek into an index on it instead of
+        scanning from the top.
+        """
+        condition = Q()
+        for i, key in enumerate(ordering):
+            name = key.lstrip('-')
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            term = Q(**{f'{name}__{lookup}': values[i]})
+            for previous_key, previous_value in zip(ordering[:i], values[:i]):
+                term &= Q(**{previous_key.lstrip('-'): previous_value})
+            condition |= term
+        leading = ordering[0]
+        bound = 'lte' if leading.startswith('-') else 'gte'
+        return Q(**{f'{leading.lstrip("-")}__{bound}': values[0]}) & condition
@@ -0,0 +1,166 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from . import geo
+from .models import Property
+
+# SQLite FTS5 index over the searchable Property text. It is an external
+# content table (the text lives only in base_property) kept in sync by
+# triggers, so every save, delete, update() and raw write is covered.
+FTS_TABLE = 'base_property_fts'
+FTS_COLUMNS = ['title', 'location', 'address', 'description']
+# bm25 column weights, in FTS_COLUMNS order: a hit in location counts most
+FTS_WEIGHTS = [3.0, 5.0, 2.0, 1.0]
+
+
+def _fts_sql():
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+    delete_old = (
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+    )
+    insert_new = f'INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});'
+    return {
+        FTS_TABLE: (
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, "
+            f"content='base_property', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ),
+        f'{FTS_TABLE}_ai': (
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON base_property BEGIN {insert_new} END'
+        ),
+        f'{FTS_TABLE}_ad': (
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON base_property BEGIN {delete_old} END'
+        ),
+        f'{FTS_TABLE}_au': (
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON base_property '
+            f'BEGIN {delete_old} {insert_new} END'
+        ),
+    }
+
+
+def install_fulltext_index(sender=None, using='default', **kwargs):
+    """Create the FTS5 table and its sync triggers if any are missing
+
+    Connected to post_migrate: SQLite migrations that rebuild base_property
+    drop its triggers, so they are re-created (and the index rebuilt) here
+    rather than in a one-off migration.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    statements = _fts_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)" % ', '.join(['%s'] * len(statements)),
+            list(statements),
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in statements if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            cursor.execute(statements[name])
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def fulltext_query(text):
+    """Turn free text into an FTS5 query: every word, prefix-matched"""
+    return ' '.join(f'"{term}"*' for term in re.findall(r'\w+', text))
+
+
+def filter_text(properties, text):
+    query = fulltext_query(text)
+    if not query:
+        return properties
+    if connections[properties.db].vendor != 'sqlite':
+        return properties.filter(
+            Q(location__icontains=text) | Q(address__icontains=text) | Q(title__icontains=text)
+        )
+    return properties.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (query,))
+    )
+
+
+def rank_text(properties, text):
+    """Order properties by bm25 relevance to text, best match first"""
+    query = fulltext_query(text)
+    if not query or connections[properties.db].vendor != 'sqlite':
+        return properties
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    rank = RawSQL(
+        f'SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = base_property.id',
+        (query,),
+    )
+    return properties.annotate(search_rank=rank).order_by('search_rank', '-created')
+
+
+def filter_properties(properties, cleaned_data):
+    """Apply the PropertySearchForm filters to a Property queryset"""
+    location = cleaned_data.get('location')
+    min_price = cleaned_data.get('min_price')
+    max_price = cleaned_data.get('max_price')
+    property_type = cleaned_data.get('property_type')
+    bedrooms = cleaned_data.get('bedrooms')
+    amenities = cleaned_data.get('amenities')
+    lat = cleaned_data.get('lat')
+    lng = cleaned_data.get('lng')
+    radius = cleaned_data.get('radius')
+    bbox = cleaned_data.get('bbox')
+
+    if location:
+        properties = filter_text(properties, location)
+    if min_price:
+        properties = properties.filter(rent_amount__gte=min_price)
+    if max_price:
+        properties = properties.filter(rent_amount__lte=max_price)
+    if property_type:
+        properties = properties.filter(property_type=property_type)
+    if bedrooms:
+        properties = properties.filter(bedrooms__gte=bedrooms)
+    # One join per amenity: listings must have all of them
+    for amenity in amenities or []:
+        properties = properties.filter(amenity_tags__slug=getattr(amenity, 'slug', amenity))
+    if bbox:
+        properties = geo.filter_bbox(properties, bbox)
+    if lat is not None and lng is not None:
+        if radius:
+            properties = geo.filter_radius(properties, lat, lng, radius)
+        else:
+            properties = properties.filter(latitude__isnull=False, longitude__isnull=False)
+    return properties
+
+
+def search_origin(cleaned_data):
+    """Point to sort a search by distance from: the given one, else the bbox centre"""
+    if cleaned_data.get('lat') is not None and cleaned_data.get('lng') is not None:
+        return cleaned_data['lat'], cleaned_data['lng']
+    bbox = cleaned_data.get('bbox')
+    if bbox:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    return None
+
+
+def search_properties(cleaned_data=None):
+    """Available properties matching the search
+
+    Nearest first when searching around a point or in a box, else by
+    relevance when there is a location query, else newest first.
+    """
+    properties = Property.objects.filter(is_available=True).order_by('-created')
+    if cleaned_data:
+        properties = filter_properties(properties, cleaned_data)
+        origin = search_origin(cleaned_data)
+        if origin:
+            if 'distance' not in properties.query.annotations:
+                properties = properties.annotate(distance=geo.distance_expression(*origin))
+            properties = properties.order_by('distance', 'id')
+        elif cleaned_data.get('location'):
+            properties = rank_text(properties, cleaned_data['location'])
+    return properties
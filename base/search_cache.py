@@ -0,0 +1,475 @@
+"""Cache of home() search result pages
+
+Each entry holds the ids and cursors of one page of one search, keyed on
+the normalized PropertySearchForm data plus the cursor. Entries live in the
+'search' cache (LRU with a TTL, see settings.CACHES) and are invalidated
+precisely by the Property signals: a change only drops the pages whose
+filters match the old or new state of the property and whose (created, id)
+range contains it. The live searches and their cached entries are listed in
+the same cache, so it must be one backend shared by every worker process.
+Until one is configured the alias is a DummyCache and every search runs.
+Every listed item is a key of its own, appended with an atomic incr, so
+processes registering at once never overwrite each other's registrations.
+"""
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+
+from . import geo
+from .models import Property, parse_amenities
+from .pagination import KeysetPage, KeysetPaginator, decode_cursor
+from .search import search_properties
+
+CACHE_ALIAS = 'search'
+PER_PAGE = 12
+COUNT_LIMIT = 1000
+GENERATION_KEY = 'search:generation'
+STATS = ('hits', 'misses', 'invalidations')
+# Fields of a property that decide which searches it shows up in
+STATE_FIELDS = [
+    'id', 'is_available', 'title', 'location', 'address', 'description',
+    'rent_amount', 'property_type', 'bedrooms', 'amenities', 'latitude', 'longitude', 'created',
+]
+# Only pages in the default (created, id) order have a known key range
+KEYED_ORDERING = ['-created', '-id']
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+SearchResults = namedtuple('SearchResults', ['page', 'estimated_total', 'total_is_estimate'])
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def enabled():
+    """Whether a search cache is configured, rather than settings' DummyCache"""
+    return not isinstance(get_cache(), DummyCache)
+
+
+def normalize_filters(cleaned_data):
+    """Canonical form of PropertySearchForm data, used as the cache key"""
+    normalized = {}
+    for name, value in (cleaned_data or {}).items():
+        if value in (None, ''):
+            continue
+        if name == 'location':
+            value = ' '.join(value.lower().split())
+        elif name == 'amenities':
+            value = sorted(getattr(amenity, 'slug', amenity) for amenity in value)
+            if not value:
+                continue
+        elif name == 'bbox':
+            value = list(value)
+        elif isinstance(value, Decimal):
+            value = format(value.normalize(), 'f')
+        normalized[name] = value
+    return normalized
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def _key(created, pk):
+    """Sortable key of a row in the default ordering"""
+    return ((created - EPOCH) // timedelta(microseconds=1), pk)
+
+
+def _words(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r'\w+', text.lower())
+
+
+def matches(filters, state):
+    """Whether a property state would be in the results of a search
+
+    Mirrors search.filter_properties, including the prefix matching of the
+    full-text index.
+    """
+    if not state or not state['is_available']:
+        return False
+    if 'min_price' in filters and state['rent_amount'] < Decimal(filters['min_price']):
+        return False
+    if 'max_price' in filters and state['rent_amount'] > Decimal(filters['max_price']):
+        return False
+    if 'property_type' in filters and state['property_type'] != filters['property_type']:
+        return False
+    if 'bedrooms' in filters and state['bedrooms'] < filters['bedrooms']:
+        return False
+    if 'amenities' in filters and not set(filters['amenities']) <= set(parse_amenities(state['amenities'])):
+        return False
+    if 'bbox' in filters and not geo.in_bbox(filters['bbox'], state['latitude'], state['longitude']):
+        return False
+    if 'lat' in filters and 'lng' in filters:
+        if state['latitude'] is None or state['longitude'] is None:
+            return False
+        distance = geo.distance_km(filters['lat'], filters['lng'], state['latitude'], state['longitude'])
+        if 'radius' in filters and distance > filters['radius']:
+            return False
+    if 'location' in filters:
+        words = set()
+        for field in ('title', 'location', 'address', 'description'):
+            words.update(_words(state[field]))
+        for term in _words(filters['location']):
+            if not any(word.startswith(term) for word in words):
+                return False
+    return True
+
+
+def property_state(instance):
+    return {field: getattr(instance, field) for field in STATE_FIELDS}
+
+
+def stored_state(pk):
+    """State of a property as currently saved, or None"""
+    return Property.objects.filter(pk=pk).values(*STATE_FIELDS).first()
+
+
+def _bump(name, cache=None):
+    cache = cache or get_cache()
+    key = f'search:stats:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+class _Log:
+    """Append-only list in the cache, one key per item
+
+    incr allocates each item's index, so processes appending at once keep
+    all their items, unlike a list read, changed and written back. Items
+    expire on their own; items() skips them and moves a floor past them so
+    reading doesn't grow with history.
+    """
+    # An index allocated this long ago has had its item written
+    SETTLE = 60
+
+    def __init__(self, cache, key):
+        self.cache, self.key = cache, key
+
+    def create(self):
+        self.cache.add(self.key, 0, None)
+
+    def append(self, value, timeout):
+        """Index of the new item, or None if the list was lost (evicted)"""
+        try:
+            index = self.cache.incr(self.key)
+        except ValueError:
+            return None
+        self.cache.set(f'{self.key}:{index}', value, timeout)
+        return index
+
+    def items(self):
+        """{index: value} of the live items, or None if the list was lost"""
+        count = self.cache.get(self.key)
+        if count is None:
+            return None
+        floor_key, mark_key = f'{self.key}:floor', f'{self.key}:mark'
+        state = self.cache.get_many([floor_key, mark_key])
+        floor, mark = state.get(floor_key, 1), state.get(mark_key)
+        keys = {f'{self.key}:{index}': index for index in range(floor, count + 1)}
+        items = {keys[key]: value for key, value in self.cache.get_many(keys).items()}
+        now = time.time()
+        if mark is None or now - mark[1] >= self.SETTLE:
+            # Missing items up to the count seen at the last mark expired or
+            # were removed; later ones may still be being written
+            settled = mark[0] if mark else floor - 1
+            first = min([index for index in items if index <= settled] + [settled + 1])
+            if first > floor:
+                self.cache.set(floor_key, first, None)
+            self.cache.set(mark_key, (count, now), None)
+        return items
+
+    def remove(self, indexes):
+        self.cache.delete_many([f'{self.key}:{index}' for index in indexes])
+
+
+def _generation(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = _new_generation(cache)
+    return generation
+
+
+def _new_generation(cache):
+    generation = time.time_ns()
+    _searches(cache, generation).create()
+    cache.set(GENERATION_KEY, generation, None)
+    return generation
+
+
+def _searches(cache, generation):
+    """Log of (search key, filters) of the generation's live searches"""
+    return _Log(cache, f'search:{generation}:searches')
+
+
+def _entries(cache, generation, search_key, version):
+    """Log of (cache key, page range) of the entries cached for a search version"""
+    return _Log(cache, f'search:{generation}:entries:{search_key}:{version}')
+
+
+def _record_key(generation, search_key):
+    return f'search:{generation}:search:{search_key}'
+
+
+def _listed(cache, generation, search_key, normalized):
+    """Record of a search, listed in the searches log for another TTL
+
+    The record's version is part of every key cached for the search. A
+    search whose listing expired or was evicted may have missed
+    invalidations, so it starts a new version, hiding what it cached.
+    Returns None if the searches log itself was lost, which starts a new
+    generation.
+    """
+    timeout = _timeout(cache)
+    key = _record_key(generation, search_key)
+    searches = _searches(cache, generation)
+    record = cache.get(key)
+    if record is not None and cache.touch(f'{searches.key}:{record["slot"]}', timeout):
+        cache.touch(key, timeout)
+        return record
+    version = time.time_ns()
+    _entries(cache, generation, search_key, version).create()
+    slot = searches.append((search_key, normalized), timeout)
+    if slot is None:
+        _new_generation(cache)
+        return None
+    record = {'slot': slot, 'version': version}
+    cache.set(key, record, timeout)
+    return record
+
+
+def _register(cache, generation, search_key, record, key, page_range=None):
+    """Record a cached entry of a search so invalidate() can find it; False if it can't"""
+    entries = _entries(cache, generation, search_key, record['version'])
+    if entries.append((key, page_range), _timeout(cache)) is None:
+        # The entries cached before can't be found either: a new version hides them
+        cache.delete(_record_key(generation, search_key))
+        return False
+    return True
+
+
+def _page_range(paginator, page, cursor):
+    """(low, high) keys bounding the rows a cached page depends on
+
+    None means any change to a matching property can affect the page.
+    """
+    if paginator.ordering != KEYED_ORDERING:
+        return None
+    rows = page.object_list
+    payload = decode_cursor(cursor)
+    direction = payload['d'] if payload else None
+    boundary = None
+    if direction in ('next', 'prev'):
+        created, pk = paginator._load_values(payload['k'])
+        boundary = _key(created, pk)
+    low = _key(rows[-1].created, rows[-1].id) if rows and page.has_next() else None
+    high = _key(rows[0].created, rows[0].id) if rows and page.has_previous() else None
+    if direction == 'next':
+        high = boundary
+    elif direction == 'prev':
+        low = boundary
+    return (low, high)
+
+
+def _in_range(page_range, state):
+    low, high = page_range
+    key = _key(state['created'], state['id'])
+    return (low is None or key >= low) and (high is None or key <= high)
+
+
+def search_page(cleaned_data, cursor=None, filters=None):
+    """One page of search_properties(cleaned_data), served from the cache when possible"""
+    paginator = KeysetPaginator(search_properties(cleaned_data).cards(), PER_PAGE, count_limit=COUNT_LIMIT)
+    if not enabled():
+        page = paginator.get_page(cursor, filters)
+        return SearchResults(page, paginator.estimated_total, paginator.total_is_estimate)
+    cache = get_cache()
+    normalized = normalize_filters(cleaned_data)
+    search_key = _digest(normalized)
+    generation = _generation(cache)
+
+    def keys(record):
+        prefix = f'search:{generation}:%s:{search_key}:{record["version"]}'
+        return prefix % 'page' + ':' + _digest(cursor or ''), prefix % 'count'
+
+    page = estimate = None
+    record = cache.get(_record_key(generation, search_key))
+    if record is not None:
+        page_key, count_key = keys(record)
+        cached = cache.get_many([page_key, count_key])
+        entry, estimate = cached.get(page_key), cached.get(count_key)
+        if entry is not None:
+            objects = Property.objects.cards().in_bulk(entry['ids'])
+            # Rows that vanished without a signal (e.g. raw SQL) make it a miss
+            if len(objects) == len(entry['ids']):
+                rows = [objects[pk] for pk in entry['ids']]
+                for obj, distance in zip(rows, entry['distances']):
+                    if distance is not None:
+                        obj.distance = distance
+                page = KeysetPage(rows, *entry['cursors'])
+                _bump('hits', cache)
+    if page is not None and estimate is not None:
+        return SearchResults(page, *estimate)
+
+    missing = set()
+    if page is None:
+        _bump('misses', cache)
+        page = paginator.get_page(cursor, filters)
+        missing.add('page')
+    if estimate is None:
+        estimate = (paginator.estimated_total, paginator.total_is_estimate)
+        missing.add('count')
+    listed = _listed(cache, generation, search_key, normalized)
+    if listed is None:
+        return SearchResults(page, *estimate)
+    if listed != record:
+        # A new version: nothing is cached under it yet
+        missing = {'page', 'count'}
+    page_key, count_key = keys(listed)
+    # Each entry is listed before it's stored, so an invalidation in between finds it
+    if 'count' in missing and _register(cache, generation, search_key, listed, count_key):
+        cache.set(count_key, estimate)
+    if 'page' in missing and _register(
+        cache, generation, search_key, listed, page_key, _page_range(paginator, page, cursor),
+    ):
+        cache.set(page_key, {
+            'ids': [obj.id for obj in page],
+            'distances': [getattr(obj, 'distance', None) for obj in page],
+            'cursors': (page.next_cursor, page.previous_cursor, page.last_cursor),
+        })
+    return SearchResults(page, *estimate)
+
+
+def search_value(cleaned_data, name, compute):
+    """compute() for a search, cached until a matching property changes
+
+    For whole-result values such as facet counts: like the count estimate,
+    any change to a property matching the filters drops it.
+    """
+    if not enabled():
+        return compute()
+    cache = get_cache()
+    normalized = normalize_filters(cleaned_data)
+    search_key = _digest(normalized)
+    generation = _generation(cache)
+    record = cache.get(_record_key(generation, search_key))
+    if record is not None:
+        value = cache.get(f'search:{generation}:{name}:{search_key}:{record["version"]}')
+        if value is not None:
+            return value
+    value = compute()
+    listed = _listed(cache, generation, search_key, normalized)
+    if listed is not None:
+        key = f'search:{generation}:{name}:{search_key}:{listed["version"]}'
+        if _register(cache, generation, search_key, listed, key):
+            cache.set(key, value)
+    return value
+
+
+def _timeout(cache):
+    return cache.default_timeout if cache.default_timeout is not None else 10 ** 9
+
+
+def invalidate(old_state, new_state):
+    """Drop the cached pages a property change can affect"""
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        return
+    searches = _searches(cache, generation).items()
+    if searches is None:
+        # Lost with the list of what's cached: nothing of it can be found
+        invalidate_all()
+        return
+    stale = []
+    for search_key, filters in dict(searches.values()).items():
+        states = [state for state in (old_state, new_state) if matches(filters, state)]
+        if not states:
+            continue
+        record = cache.get(_record_key(generation, search_key))
+        if record is None:
+            # Its next lookup starts a new version, which hides what it cached
+            continue
+        entries = _entries(cache, generation, search_key, record['version'])
+        items = entries.items()
+        if items is None:
+            cache.delete(_record_key(generation, search_key))
+            continue
+        dropped = [
+            index for index, (key, page_range) in items.items()
+            if page_range is None or any(_in_range(page_range, state) for state in states)
+        ]
+        stale.extend(items[index][0] for index in dropped)
+        entries.remove(dropped)
+    if stale:
+        cache.delete_many(stale)
+        _bump('invalidations', cache)
+
+
+def invalidate_values(name):
+    """Drop the cached name values of every search, keeping their pages
+
+    For a bulk change that doesn't move any listing between searches but
+    changes what a value is computed from, e.g. 'validators' after a bulk
+    update of updated.
+    """
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        return
+    searches = _searches(cache, generation).items()
+    if searches is None:
+        invalidate_all()
+        return
+    prefix = f'search:{generation}:{name}:'
+    stale = []
+    for search_key in dict(searches.values()):
+        record = cache.get(_record_key(generation, search_key))
+        if record is None:
+            continue
+        entries = _entries(cache, generation, search_key, record['version'])
+        items = entries.items()
+        if items is None:
+            cache.delete(_record_key(generation, search_key))
+            continue
+        dropped = [index for index, (key, page_range) in items.items() if key.startswith(prefix)]
+        stale.extend(items[index][0] for index in dropped)
+        entries.remove(dropped)
+    if stale:
+        cache.delete_many(stale)
+        _bump('invalidations', cache)
+
+
+def invalidate_all():
+    """Drop every cached search, e.g. after a bulk update"""
+    _new_generation(get_cache())
+    _bump('invalidations', get_cache())
+
+
+def stats():
+    cache = get_cache()
+    counters = {name: cache.get(f'search:stats:{name}', 0) for name in STATS}
+    lookups = counters['hits'] + counters['misses']
+    generation = cache.get(GENERATION_KEY)
+    searches = dict((generation and _searches(cache, generation).items() or {}).values())
+    pages = 0
+    for search_key in searches:
+        record = cache.get(_record_key(generation, search_key))
+        entries = record and _entries(cache, generation, search_key, record['version']).items()
+        pages += sum(1 for key, page_range in (entries or {}).values() if ':page:' in key)
+    counters['enabled'] = enabled()
+    counters['hit_rate'] = round(counters['hits'] / lookups, 4) if lookups else None
+    counters['searches'] = len(searches)
+    counters['pages'] = pages
+    return counters
@@ -0,0 +1,146 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import facets, geo, images, jobs, search_cache, similar, storage
+from .models import (
+    Property, PropertyImage, PropertyTypeStats, SimilarProperty, User, properties_bulk_changed, sync_amenities,
+)
+
+STATS_FIELDS = {'is_available', 'property_type'}
+# The file field of each model whose uploads go to the content-addressed store
+MEDIA_FIELD = {apps.get_model(label): field for label, field in storage.MEDIA_FIELDS}
+
+
+@receiver(pre_save, sender=Property)
+def remember_previous_state(sender, instance, **kwargs):
+    """Keep the saved state of a property so post_save can tell what changed"""
+    instance._previous_state = search_cache.stored_state(instance.pk) if instance.pk else None
+
+
+@receiver(pre_save, sender=Property)
+def geocode_property(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Fill in missing coordinates, and follow location changes, from the geocoder"""
+    if raw or (update_fields is not None and not {'latitude', 'longitude'} <= set(update_fields)):
+        return
+    previous = getattr(instance, '_previous_state', None)
+    coordinates = (instance.latitude, instance.longitude)
+    if None not in coordinates:
+        # Coordinates left as they were when the location moved are stale
+        if previous is None or previous['location'] == instance.location:
+            return
+        if (previous['latitude'], previous['longitude']) != coordinates:
+            return
+    elif previous is not None and previous['location'] == instance.location and (
+        None in (previous['latitude'], previous['longitude'])
+    ):
+        # Already looked up, when the location was last set, and not found
+        return
+    point = geo.geocode(instance.location)
+    instance.latitude, instance.longitude = point if point else (None, None)
+
+
+def update_type_stats(old_state, new_state):
+    old = old_state['property_type'] if old_state and old_state['is_available'] else None
+    new = new_state['property_type'] if new_state and new_state['is_available'] else None
+    if old == new:
+        return
+    if old:
+        PropertyTypeStats.adjust(old, -1)
+    if new:
+        PropertyTypeStats.adjust(new, 1)
+
+
+@receiver(post_save, sender=Property)
+def property_saved(sender, instance, **kwargs):
+    old_state = getattr(instance, '_previous_state', None)
+    new_state = search_cache.property_state(instance)
+    if old_state is None or old_state['amenities'] != new_state['amenities']:
+        sync_amenities([instance])
+    update_type_stats(old_state, new_state)
+    facets.adjust(old_state, new_state)
+    if old_state is None or any(old_state[field] != new_state[field] for field in similar.SIMILARITY_FIELDS):
+        # A candidates query and a rescoring per affected list; a job keeps them off the request
+        jobs.enqueue(similar.property_changed, instance.pk)
+    # Once committed: a search run in between would cache the rows as they were
+    transaction.on_commit(lambda: search_cache.invalidate(old_state, new_state))
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=PropertyImage)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    """Queue the build of a new upload's variants"""
+    if raw:
+        return
+    deferred = instance.get_deferred_fields()
+    for label, field, variants_field in images.IMAGE_FIELDS:
+        if label != sender._meta.label or {field, variants_field} & deferred:
+            continue
+        name = getattr(instance, field).name
+        if name and getattr(instance, variants_field).get('source') != name:
+            images.schedule(label, instance.pk, field, variants_field, name)
+
+
+@receiver(pre_save, sender=Property)
+@receiver(pre_save, sender=PropertyImage)
+@receiver(pre_save, sender=User)
+def remember_stored_media(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the stored file name of a row, or None when this save can't change it"""
+    field = MEDIA_FIELD[sender]
+    instance._stored_media = None
+    if raw or (update_fields is not None and field not in update_fields) or field in instance.get_deferred_fields():
+        return
+    stored = None if instance._state.adding else (
+        sender._default_manager.filter(pk=instance.pk).values_list(field, flat=True).first()
+    )
+    instance._stored_media = stored or ''
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_save, sender=User)
+def count_media_refs(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_media', None)
+    name = getattr(instance, MEDIA_FIELD[sender]).name or ''
+    if stored is not None and stored != name:
+        storage.adjust_refs(name, 1)
+        storage.adjust_refs(stored, -1)
+
+
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=PropertyImage)
+@receiver(post_delete, sender=User)
+def release_media(sender, instance, **kwargs):
+    storage.adjust_refs(getattr(instance, MEDIA_FIELD[sender]).name, -1)
+
+
+@receiver(pre_delete, sender=Property)
+def remember_similar_lists(sender, instance, **kwargs):
+    """The lists a property is in, which its deletion cascades out of"""
+    instance._listed_by = list(SimilarProperty.objects.filter(similar=instance).values_list('property_id', flat=True))
+
+
+@receiver(post_delete, sender=Property)
+def property_deleted(sender, instance, **kwargs):
+    old_state = search_cache.property_state(instance)
+    update_type_stats(old_state, None)
+    facets.adjust(old_state, None)
+    listed_by = getattr(instance, '_listed_by', [])
+    if listed_by:
+        # Each is a candidates query and a rescoring; a job keeps them off the request
+        jobs.enqueue(similar.refresh, listed_by)
+    transaction.on_commit(lambda: search_cache.invalidate(old_state, None))
+
+
+@receiver(properties_bulk_changed, sender=Property)
+def properties_bulk_changed_handler(sender, fields, **kwargs):
+    if fields is None or fields & STATS_FIELDS:
+        PropertyTypeStats.rebuild()
+    if fields is None or fields & facets.FACET_FIELDS:
+        facets.rebuild()
+    if fields is None or fields & set(search_cache.STATE_FIELDS):
+        transaction.on_commit(search_cache.invalidate_all)
+    elif 'updated' in fields:
+        # The same listings match, but the list ETags hash max(updated)
+        transaction.on_commit(lambda: search_cache.invalidate_values('validators'))
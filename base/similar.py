@@ -0,0 +1,220 @@
+"""Precomputed "similar properties" of each available listing
+
+Every available property keeps its SIMILAR_COUNT best-scoring neighbours in
+the SimilarProperty table, so property_detail reads them with one indexed
+lookup. Candidates are the CANDIDATE_WINDOW listings in the same location
+closest in rent on either side, plus the NEARBY_COUNT nearest listings
+within NEARBY_KM; score() ranks them. The Property signals keep the table
+up to date one property at a time and rebuild() recomputes all of it.
+"""
+import heapq
+import math
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from . import geo, jobs
+from .models import Property, SimilarProperty
+
+SIMILAR_COUNT = 4
+CANDIDATE_WINDOW = 20
+NEARBY_COUNT = 20
+NEARBY_KM = 3.0
+# Fields of a property that its similarity to others depends on
+SIMILARITY_FIELDS = ['location', 'property_type', 'rent_amount', 'bedrooms', 'latitude', 'longitude', 'is_available']
+WEIGHTS = {'location': 4.0, 'property_type': 2.0, 'rent': 2.0, 'bedrooms': 1.0}
+
+Listing = namedtuple('Listing', ['id', 'location_key', 'property_type', 'rent', 'bedrooms', 'lat', 'lng'])
+
+
+def _listings(queryset):
+    rows = (
+        queryset.annotate(location_key=Lower('location'))
+        .values_list('id', 'location_key', 'property_type', 'rent_amount', 'bedrooms', 'latitude', 'longitude')
+    )
+    return [Listing(pk, key, kind, float(rent), beds, lat, lng) for pk, key, kind, rent, beds, lat, lng in rows]
+
+
+def _available():
+    return Property.objects.filter(is_available=True).order_by()
+
+
+def score(a, b):
+    """Similarity of two listings, higher is more similar"""
+    if a.location_key == b.location_key:
+        location = 1.0
+    elif None not in (a.lat, a.lng, b.lat, b.lng):
+        location = max(0.0, 1 - geo.distance_km(a.lat, a.lng, b.lat, b.lng) / NEARBY_KM)
+    else:
+        location = 0.0
+    property_type = 1.0 if a.property_type == b.property_type else 0.0
+    # Same rent scores 1, double or half the rent scores 0
+    if a.rent > 0 and b.rent > 0:
+        rent = max(0.0, 1 - abs(math.log(a.rent / b.rent)) / math.log(2))
+    else:
+        rent = 1.0 if a.rent == b.rent else 0.0
+    bedrooms = max(0.0, 1 - abs(a.bedrooms - b.bedrooms) / 3)
+    return round(
+        WEIGHTS['location'] * location + WEIGHTS['property_type'] * property_type
+        + WEIGHTS['rent'] * rent + WEIGHTS['bedrooms'] * bedrooms,
+        6,
+    )
+
+
+def _top(listing, candidates):
+    """[(score, id)] of the best SIMILAR_COUNT candidates, best first"""
+    scored = ((score(listing, c), c.id) for c in candidates)
+    return heapq.nsmallest(SIMILAR_COUNT, scored, key=lambda item: (-item[0], item[1]))
+
+
+def candidates(listing):
+    """Candidate neighbours of a listing, three indexed queries"""
+    others = _available().exclude(id=listing.id)
+    same_location = others.alias(location_key=Lower('location')).filter(location_key=listing.location_key)
+    querysets = [
+        same_location.filter(rent_amount__gte=listing.rent).order_by('rent_amount', 'id')[:CANDIDATE_WINDOW],
+        same_location.filter(rent_amount__lt=listing.rent).order_by('-rent_amount', 'id')[:CANDIDATE_WINDOW],
+    ]
+    if listing.lat is not None and listing.lng is not None:
+        nearby = geo.filter_radius(others, listing.lat, listing.lng, NEARBY_KM)
+        querysets.append(nearby.order_by('distance', 'id')[:NEARBY_COUNT])
+    found = {}
+    for queryset in querysets:
+        for c in _listings(queryset):
+            found[c.id] = c
+    return list(found.values())
+
+
+def _store(lists):
+    """Replace the similar lists of properties: {pk: [(score, similar_id)]}"""
+    with transaction.atomic():
+        SimilarProperty.objects.filter(property_id__in=list(lists)).delete()
+        SimilarProperty.objects.bulk_create([
+            SimilarProperty(property_id=pk, similar_id=similar_id, score=value, rank=rank)
+            for pk, top in lists.items() for rank, (value, similar_id) in enumerate(top, 1)
+        ])
+
+
+@jobs.task()
+def refresh(pks):
+    """Recompute the similar lists of the given properties from scratch"""
+    pks = set(pks)
+    if not pks:
+        return
+    listings = _listings(_available().filter(id__in=pks))
+    lists = {pk: [] for pk in pks}
+    for listing in listings:
+        lists[listing.id] = _top(listing, candidates(listing))
+    _store(lists)
+
+
+@jobs.task()
+def property_changed(pk):
+    """Bring the table up to date after one property was saved or deleted
+
+    Lists that had the property are recomputed, and the property is offered
+    to the lists of its own candidates, which it joins if it beats their
+    weakest entry.
+    """
+    listed_by = set(SimilarProperty.objects.filter(similar_id=pk).values_list('property_id', flat=True))
+    refresh(listed_by | {pk})
+
+    listing = next(iter(_listings(_available().filter(id=pk))), None)
+    if listing is None:
+        return
+    offers = {c.id: score(c, listing) for c in candidates(listing) if c.id not in listed_by}
+    current = defaultdict(list)
+    for owner, similar_id, value in SimilarProperty.objects.filter(property_id__in=list(offers)).values_list(
+        'property_id', 'similar_id', 'score'
+    ):
+        current[owner].append((value, similar_id))
+    lists = {}
+    for owner, value in offers.items():
+        top = current[owner]
+        if len(top) < SIMILAR_COUNT or (-value, pk) < max((-s, i) for s, i in top):
+            lists[owner] = heapq.nsmallest(SIMILAR_COUNT, top + [(value, pk)], key=lambda item: (-item[0], item[1]))
+    if lists:
+        _store(lists)
+
+
+def _rent_window(listing, bucket, rents):
+    """What the two same-location queries of candidates() return, from a sorted bucket"""
+    i = bisect_left(rents, listing.rent)
+    above = [c for c in bucket[i:i + CANDIDATE_WINDOW + 1] if c.id != listing.id][:CANDIDATE_WINDOW]
+    # Below is ordered by rent descending then id, so take whole runs of equal rent
+    low = max(0, i - CANDIDATE_WINDOW)
+    while low > 0 and bucket[low - 1].rent == bucket[low].rent:
+        low -= 1
+    below = sorted(bucket[low:i], key=lambda c: (-c.rent, c.id))[:CANDIDATE_WINDOW]
+    return above + below
+
+
+def _cell_distance(lat, lng, cell, cell_size):
+    """Lower bound of the distance in km from a point to anything in a grid cell"""
+    min_lat, min_lng = cell[0] * cell_size, cell[1] * cell_size
+    dlat = max(min_lat - lat, 0.0, lat - min_lat - cell_size)
+    dlng = max(min_lng - lng, 0.0, lng - min_lng - cell_size)
+    # cos is smallest at one of the cell's edges, which bounds the haversine below
+    cos_cell = min(math.cos(math.radians(min_lat)), math.cos(math.radians(min_lat + cell_size)))
+    half = math.sqrt(max(math.cos(math.radians(lat)) * cos_cell, 0.0)) * math.sin(math.radians(dlng) / 2)
+    return max(dlat * geo.KM_PER_DEGREE, 2 * geo.EARTH_RADIUS_KM * math.asin(min(half, 1.0)))
+
+
+def _nearest(listing, cells, cell_size):
+    """What the nearby query of candidates() returns, from a grid of listings
+
+    Cells are visited nearest first and the search stops once no cell left
+    can hold anything closer than what was found.
+    """
+    min_lat, min_lng, max_lat, max_lng = geo.radius_bbox(listing.lat, listing.lng, NEARBY_KM)
+    bounds = sorted(
+        (_cell_distance(listing.lat, listing.lng, (row, col), cell_size), row, col)
+        for row in range(math.floor(min_lat / cell_size), math.floor(max_lat / cell_size) + 1)
+        for col in range(math.floor(min_lng / cell_size), math.floor(max_lng / cell_size) + 1)
+    )
+    found = []
+    for bound, row, col in bounds:
+        if bound > NEARBY_KM or (len(found) == NEARBY_COUNT and bound > found[-1][0]):
+            break
+        for c in cells.get((row, col), ()):
+            distance = geo.distance_km(listing.lat, listing.lng, c.lat, c.lng)
+            if c.id != listing.id and distance <= NEARBY_KM:
+                found.append((distance, c.id, c))
+        found = heapq.nsmallest(NEARBY_COUNT, found, key=lambda item: item[:2])
+    return [c for distance, pk, c in found]
+
+
+def rebuild(batch_size=5000):
+    """Recompute the whole table in memory; returns the number of listings"""
+    listings = _listings(_available())
+    by_location = defaultdict(list)
+    cells = defaultdict(list)
+    # Cells much smaller than NEARBY_KM keep the nearest-neighbour search
+    # from touching every listing in range in dense areas
+    cell_size = NEARBY_KM / 3 / geo.KM_PER_DEGREE
+    for listing in listings:
+        by_location[listing.location_key].append(listing)
+        if listing.lat is not None and listing.lng is not None:
+            cells[(math.floor(listing.lat / cell_size), math.floor(listing.lng / cell_size))].append(listing)
+    for bucket in by_location.values():
+        bucket.sort(key=lambda c: (c.rent, c.id))
+    rents = {key: [c.rent for c in bucket] for key, bucket in by_location.items()}
+
+    rows = []
+    with transaction.atomic():
+        SimilarProperty.objects.all().delete()
+        for listing in listings:
+            key = listing.location_key
+            found = {c.id: c for c in _rent_window(listing, by_location[key], rents[key])}
+            if listing.lat is not None and listing.lng is not None:
+                for c in _nearest(listing, cells, cell_size):
+                    found[c.id] = c
+            for rank, (value, similar_id) in enumerate(_top(listing, found.values()), 1):
+                rows.append(SimilarProperty(property_id=listing.id, similar_id=similar_id, score=value, rank=rank))
+            if len(rows) >= batch_size:
+                SimilarProperty.objects.bulk_create(rows)
+                rows = []
+        SimilarProperty.objects.bulk_create(rows)
+    return len(listings)
@@ -0,0 +1,186 @@
+"""Content-addressed storage for uploaded images
+
+Property.main_image, PropertyImage.image and User.avatar are stored under
+the SHA-256 of their bytes as blobs/ab/<digest>.<ext>, keeping only the
+upload's extension. The same photo uploaded for many listings is one file, and a
+stored file never changes, so its URL can be cached forever.
+
+MediaBlob rows count the references to each blob from those three fields.
+The signals in base/signals.py keep the counts as rows are saved and
+deleted; the gc_media command recounts them (queryset updates bypass the
+signals) and deletes blobs nothing has referenced for a grace period,
+with their image variants.
+"""
+import hashlib
+import os
+import posixpath
+import time
+import uuid
+from collections import Counter
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_ROOT = 'blobs'
+# (model label, field) of every file field stored here
+MEDIA_FIELDS = [
+    ('base.Property', 'main_image'),
+    ('base.PropertyImage', 'image'),
+    ('base.User', 'avatar'),
+]
+
+
+def blob_name(digest, name):
+    """Storage name of content with a hex digest, keeping the extension of name"""
+    ext = posixpath.splitext(name)[1].lower()
+    if not (1 < len(ext) <= 6 and ext[1:].isalnum()):
+        ext = ''
+    return f'{BLOB_ROOT}/{digest[:2]}/{digest}{ext}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_ROOT + '/')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that saves each distinct content once, named by its hash"""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        name = blob_name(digest.hexdigest(), name)
+        try:
+            # A fresh mtime keeps a reused blob out of gc_media's grace window
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            # New, or deleted by gc_media since: written afresh
+            pass
+        # Written aside and renamed into place, so a blob is never seen half
+        # written; two uploads of the same bytes at once just both rename
+        temporary = self._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+media_storage = ContentAddressedStorage()
+
+
+class _Reused(Exception):
+    pass
+
+
+def _uploaded_recently(name, grace):
+    try:
+        return time.time() - os.path.getmtime(media_storage.path(name)) < grace.total_seconds()
+    except FileNotFoundError:
+        return False
+
+
+def adjust_refs(name, delta):
+    """Count delta more (or fewer) references to the blob stored as name"""
+    from .models import MediaBlob
+
+    if not is_blob(name) or not delta:
+        return
+    if delta > 0:
+        blob, created = MediaBlob.objects.get_or_create(name=name, defaults={'refs': delta})
+        if not created:
+            MediaBlob.objects.filter(pk=blob.pk).update(refs=F('refs') + delta, updated=timezone.now())
+    else:
+        MediaBlob.objects.filter(name=name, refs__gte=-delta).update(refs=F('refs') + delta, updated=timezone.now())
+
+
+def recount(batch_size=1000):
+    """Set every MediaBlob's refs to the references in the database; returns how many changed"""
+    from .models import MediaBlob
+
+    counts = Counter()
+    for label, field in MEDIA_FIELDS:
+        names = apps.get_model(label)._default_manager.filter(**{f'{field}__startswith': BLOB_ROOT + '/'})
+        counts.update(names.values_list(field, flat=True).iterator())
+    now = timezone.now()
+    changed = []
+    for blob in MediaBlob.objects.iterator():
+        refs = counts.pop(blob.name, 0)
+        if blob.refs != refs:
+            blob.refs, blob.updated = refs, now
+            changed.append(blob)
+    MediaBlob.objects.bulk_update(changed, ['refs', 'updated'], batch_size=batch_size)
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, refs=refs) for name, refs in counts.items()], batch_size=batch_size,
+    )
+    return len(changed) + len(counts)
+
+
+def stored_blobs():
+    """Names of every file under BLOB_ROOT, including unfinished .tmp uploads"""
+    if not media_storage.exists(BLOB_ROOT):
+        return
+    for directory in media_storage.listdir(BLOB_ROOT)[0]:
+        for name in media_storage.listdir(f'{BLOB_ROOT}/{directory}')[1]:
+            yield f'{BLOB_ROOT}/{directory}/{name}'
+
+
+def collect(grace, dry_run=False):
+    """Delete blobs unreferenced for longer than grace (a timedelta), with their variants
+
+    Files under BLOB_ROOT with no MediaBlob row, such as uploads whose row
+    was never saved, are deleted once they're older than grace too. Returns
+    the names deleted, or that would be with dry_run.
+    """
+    from .images import delete_variants
+    from .models import MediaBlob
+
+    def unreferenced(name):
+        return not MediaBlob.objects.filter(name=name).exists() and not _uploaded_recently(name, grace)
+
+    def unlink(name):
+        # Checked again right before the unlink: the same bytes uploaded
+        # since touch the file, then count a reference on a new row
+        if not unreferenced(name):
+            return False
+        media_storage.delete(name)
+        delete_variants(name)
+        return True
+
+    deleted = []
+    orphans = MediaBlob.objects.filter(refs=0, updated__lt=timezone.now() - grace)
+    for pk, name in list(orphans.values_list('pk', 'name')):
+        if _uploaded_recently(name, grace):
+            continue
+        if dry_run:
+            deleted.append(name)
+            continue
+        # The row and its file go together, unless it was referenced again
+        # in the meantime; the transaction holds back new references to it
+        try:
+            with transaction.atomic():
+                if not MediaBlob.objects.filter(pk=pk, refs=0).delete()[0]:
+                    continue
+                if unlink(name):
+                    deleted.append(name)
+                elif not MediaBlob.objects.filter(name=name).exists():
+                    # Touched by an upload that hasn't counted its reference
+                    # yet: the row stays for it to count on
+                    raise _Reused
+        except _Reused:
+            pass
+    known = set(MediaBlob.objects.values_list('name', flat=True).iterator())
+    deleted.extend(
+        name for name in list(stored_blobs())
+        if name not in known and name not in deleted and (unreferenced(name) if dry_run else unlink(name))
+    )
+    return deleted
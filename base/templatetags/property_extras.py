@@ -1,5 +1,8 @@
 from django import template
 
+from base import images
+from base.storage import media_storage
+
 register = template.Library()
 
 @register.filter
@@ -14,4 +17,35 @@ def strip(value):
     """Strip whitespace from a string"""
     if value:
         return value.strip()
-    return value
\ No newline at end of file
+    return value
+
+
+@register.inclusion_tag('base/responsive_image.html')
+def responsive_image(image, variants, alt='', size='card', sizes='100vw', lazy=True):
+    """<picture> of an image's WebP and JPEG variants, <img> of the upload until they're built
+
+    image is a file field's value or a stored name, as annotated by cards().
+    """
+    name = getattr(image, 'name', image)
+    srcset = images.srcset(name, variants)
+    if srcset is None:
+        src = image.url if hasattr(image, 'url') else media_storage.url(name)
+    else:
+        # The JPEG of size, or of the largest variant a small upload has
+        widths = variants['widths']
+        src = images.variant_url(name, size if size in widths else list(widths)[-1], 'jpeg')
+    return {
+        'src': src,
+        'srcset': srcset,
+        'alt': alt,
+        'sizes': sizes,
+        'lazy': lazy,
+    }
+
+
+@register.inclusion_tag('base/responsive_image.html')
+def cover_image(property, size='card', sizes='100vw', lazy=True):
+    """responsive_image of a listing card: its main image, else the first of its gallery"""
+    if property.main_image:
+        return responsive_image(property.main_image, property.main_image_variants, property.title, size, sizes, lazy)
+    return responsive_image(property.first_image, property.first_image_variants, property.title, size, sizes, lazy)
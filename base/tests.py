@@ -1,12 +1,58 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.http import StreamingHttpResponse
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from decimal import Decimal
 from datetime import date, timedelta
-from .models import Property, Topic
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from keja.asgi import ASGIHandler
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import SerializerMethodField
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from . import search_cache
+from . import export
+from . import gallery
+from . import images
+from . import jobs
+from . import storage
+from . import views
+from .api.fast import FastSerializer
+from .api.serializers import MessageSerializer, RoomSerializer, message_list, room_list
+from .api.streaming import json_chunks
+from .ingest import import_properties, read_rows, validate_rows
+from .models import (
+    Amenity, FacetCount, Job, MediaBlob, Message, Place, Property, PropertyImage, PropertyTypeStats, Room,
+    SimilarProperty, Topic, held_bulk_changes, properties_bulk_changed,
+)
+from .pagination import KeysetPaginator
+from .facets import facet_counts, search_facets
+from .forms import PropertyImportForm
+from .search import search_properties
 
 User = get_user_model()
 
+# settings leave the search cache off until a shared backend is configured
+SEARCH_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'keja-search', 'TIMEOUT': 300},
+}
+
 
 class PropertyModelTest(TestCase):
     def setUp(self):
@@ -57,8 +103,10 @@ class PropertyModelTest(TestCase):
         self.assertEqual(str(property_obj), expected_str)
 
 
+@override_settings(CACHES=SEARCH_CACHES)
 class HomeViewTest(TestCase):
     def setUp(self):
+        caches['search'].clear()
         self.client = Client()
         self.user = User.objects.create_user(
             username='testuser',
@@ -198,4 +246,1844 @@ class PropertyFormTest(TestCase):
         """Test that authenticated users can access add property page"""
         response = self.client.get(reverse('add_property'))
         self.assertEqual(response.status_code, 200)
-        self.assertContains(response, 'Add New Property')
\ No newline at end of file
+        self.assertContains(response, 'Add New Property')
+
+
+class BenchmarkSearchCommandTest(TestCase):
+    def test_benchmark_leaves_no_rows_behind(self):
+        """Test that the search benchmark rolls back its synthetic listings"""
+        out = StringIO()
+        call_command('benchmark_search', sizes='20', repeat=1, stdout=out)
+
+        self.assertIn('=== 20 rows ===', out.getvalue())
+        self.assertIn('location, min_price, max_price, property_type, bedrooms', out.getvalue())
+        self.assertEqual(Property.objects.count(), 0)
+        self.assertFalse(User.objects.filter(email='benchmark@keja.invalid').exists())
+
+    def test_fill_rebuilds_derived_tables_once(self):
+        """Test that the synthetic batches send one bulk change per table size"""
+        received = []
+
+        def handler(sender, fields, **kwargs):
+            received.append(fields)
+        properties_bulk_changed.connect(handler, sender=Property)
+        self.addCleanup(properties_bulk_changed.disconnect, handler, sender=Property)
+        call_command('benchmark_search', sizes='20', repeat=1, batch_size=5, no_explain=True, stdout=StringIO())
+        self.assertEqual(received, [None])
+
+
+class PropertyFullTextSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.downtown = self.create_property('Loft', 'Downtown', 'A bright loft')
+        self.suburbs = self.create_property('Cottage', 'Suburbs', 'Ten minutes from downtown')
+
+    def create_property(self, title, location, description):
+        return Property.objects.create(
+            landlord=self.user,
+            title=title,
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location=location,
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description=description,
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def search(self, location):
+        return list(search_properties({'location': location}))
+
+    def test_prefix_search_ranks_location_matches_first(self):
+        """Test that prefixes match and a location hit outranks a description hit"""
+        self.assertEqual(self.search('downt'), [self.downtown, self.suburbs])
+
+    def test_index_follows_updates_and_deletes(self):
+        """Test that the full-text index is kept in sync with the table"""
+        self.suburbs.description = 'Quiet street'
+        self.suburbs.save()
+        self.assertEqual(self.search('downtown'), [self.downtown])
+
+        self.downtown.delete()
+        self.assertEqual(self.search('downtown'), [])
+        self.assertEqual(self.search('quiet'), [self.suburbs])
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        for i in range(30):
+            Property.objects.create(
+                landlord=self.user,
+                title=f'Listing {i}',
+                property_type='house' if i % 2 else 'apartment',
+                rent_amount=Decimal('1000.00') + i,
+                location='Test City',
+                address='123 Test Street',
+                bedrooms=2,
+                bathrooms=1,
+                area_sqft=800,
+                description='A nice test property',
+                date_available=date.today() + timedelta(days=30)
+            )
+
+    def walk(self, paginator):
+        page = paginator.get_page()
+        seen = list(page)
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            seen.extend(page)
+        return seen, page
+
+    def test_cursor_walk_visits_every_row_once(self):
+        """Test that following next cursors covers the results in order"""
+        properties = search_properties()
+        paginator = KeysetPaginator(properties, 7)
+        seen, last = self.walk(paginator)
+
+        self.assertEqual(seen, list(properties.order_by('-created', '-id')))
+        previous = paginator.get_page(last.previous_cursor)
+        self.assertEqual(list(previous), seen[-9:-2])
+        self.assertTrue(previous.has_next())
+
+    def test_ranked_search_paginates(self):
+        """Test that relevance-ordered searches page by cursor too"""
+        properties = search_properties({'location': 'test'})
+        seen, last = self.walk(KeysetPaginator(properties, 7))
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+
+    def test_home_cursor_carries_filters(self):
+        """Test that home() cursors keep the search filters"""
+        response = self.client.get(reverse('home'), {'property_type': 'house'})
+        page = response.context['properties']
+        self.assertEqual(response.context['estimated_total'], 15)
+
+        response = self.client.get(reverse('home'), {'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['properties']), 3)
+        self.assertTrue(all(p.property_type == 'house' for p in response.context['properties']))
+
+        response = self.client.get(reverse('home'), {'cursor': page.last_cursor})
+        last = response.context['properties']
+        self.assertFalse(last.has_next())
+        self.assertEqual(list(last), list(search_properties({'property_type': 'house'}).order_by('-created', '-id'))[-12:])
+
+    def test_invalid_cursor_shows_first_page(self):
+        """Test that a tampered cursor falls back to the first page"""
+        response = self.client.get(reverse('home'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['properties'].has_previous())
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class SearchCacheTest(TestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.house = self.create_property('House in Test City', 'house')
+        self.flat = self.create_property('Flat in Test City', 'apartment')
+
+    def create_property(self, title, property_type):
+        return Property.objects.create(
+            landlord=self.user,
+            title=title,
+            property_type=property_type,
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def search(self, **params):
+        return list(self.client.get(reverse('home'), params).context['properties'])
+
+    def test_repeated_search_is_a_hit(self):
+        """Test that the same normalized search is served from the cache"""
+        self.search(location='Test City', property_type='house')
+        self.search(location='  test   CITY ', property_type='house')
+        stats = search_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_off_without_a_configured_backend(self):
+        """Test that with the default DummyCache every search runs and nothing is listed"""
+        with self.settings(CACHES={'default': SEARCH_CACHES['default'], 'search': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }}):
+            self.assertEqual(self.search(property_type='house'), [self.house])
+            self.assertEqual(self.search(property_type='house'), [self.house])
+            stats = search_cache.stats()
+        self.assertEqual((stats['enabled'], stats['hits'], stats['searches']), (False, 0, 0))
+
+    def test_matching_change_invalidates(self):
+        """Test that a change to a listing in the results drops the page"""
+        self.assertEqual(self.search(property_type='house'), [self.house])
+        self.house.is_available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.house.save()
+            # Not before the commit: a search in between would cache the old rows again
+            self.assertEqual(self.search(property_type='house'), [self.house])
+        self.assertEqual(self.search(property_type='house'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_house = self.create_property('Another house', 'house')
+        self.assertEqual(self.search(property_type='house'), [new_house])
+
+    def test_unrelated_change_keeps_entry(self):
+        """Test that invalidation only drops searches the change can affect"""
+        self.search(property_type='house')
+        self.flat.rent_amount = Decimal('900.00')
+        self.flat.save()
+        self.search(property_type='house')
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+    def test_concurrent_registrations_are_all_kept(self):
+        """Test that a search cached while another one registers is still invalidated"""
+        append = search_cache._Log.append
+        interleaved = []
+
+        def append_after_other_process(log, value, timeout):
+            if not interleaved:
+                interleaved.append(value)
+                self.search(property_type='house')
+            return append(log, value, timeout)
+
+        with mock.patch.object(search_cache._Log, 'append', append_after_other_process):
+            self.search(property_type='apartment')
+        self.house.is_available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.house.save()
+        self.assertEqual(self.search(property_type='house'), [])
+        self.assertEqual(self.search(property_type='apartment'), [self.flat])
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+    def test_stats_endpoint_requires_staff(self):
+        """Test that cache counters are only exposed to staff"""
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/search-cache/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertIn('hit_rate', self.client.get('/api/search-cache/').json())
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class PropertyTypeStatsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def create_property(self, property_type, **kwargs):
+        return Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type=property_type,
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30),
+            **kwargs
+        )
+
+    def test_counts_follow_saves_and_deletes(self):
+        """Test that per-type counts track saves, type changes and deletes"""
+        house = self.create_property('house')
+        self.create_property('house')
+        self.create_property('studio', is_available=False)
+        self.assertEqual(PropertyTypeStats.counts()['house'], 2)
+        self.assertEqual(PropertyTypeStats.counts()['studio'], 0)
+
+        house.property_type = 'condo'
+        house.save()
+        self.assertEqual(PropertyTypeStats.counts()['house'], 1)
+        self.assertEqual(PropertyTypeStats.counts()['condo'], 1)
+
+        house.delete()
+        self.assertEqual(PropertyTypeStats.counts()['condo'], 0)
+
+    def test_counts_follow_bulk_updates(self):
+        """Test that queryset updates bypassing save() refresh the counts"""
+        self.create_property('house')
+        self.create_property('house')
+        Property.objects.update(is_available=False)
+        self.assertEqual(sum(PropertyTypeStats.counts().values()), 0)
+
+    def test_rebuild_command(self):
+        """Test that the rebuild command recounts from the table"""
+        self.create_property('apartment')
+        PropertyTypeStats.objects.all().delete()
+        call_command('rebuild_listing_stats', stdout=StringIO())
+        self.assertEqual(PropertyTypeStats.counts()['apartment'], 1)
+
+    def test_home_reads_stats_table(self):
+        """Test that home() takes its totals from the stats table"""
+        caches['search'].clear()
+        self.create_property('house')
+        response = Client().get(reverse('home'))
+        self.assertContains(response, '1 properties available')
+        self.assertEqual(response.context['facets']['property_type'][1], {'value': 'house', 'label': 'House', 'count': 1})
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class ListingCardTest(TestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.client = Client()
+
+    def create_property(self, n, description='A nice test property'):
+        landlord = User.objects.create_user(
+            username=f'landlord{n}',
+            email=f'landlord{n}@example.com',
+            password='testpass123'
+        )
+        return Property.objects.create(
+            landlord=landlord,
+            title=f'Test Property {n}',
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description=description,
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def test_excerpt_matches_truncatewords(self):
+        """Test that the stored excerpt is kept up to date on save"""
+        words = ' '.join(f'word{i}' for i in range(30))
+        property_obj = self.create_property(1, words)
+        self.assertEqual(property_obj.excerpt, Template('{{ text|truncatewords:15 }}').render(Context({'text': words})))
+
+        property_obj.description = 'Short now'
+        property_obj.save(update_fields=['description'])
+        property_obj.refresh_from_db()
+        self.assertEqual(property_obj.excerpt, 'Short now')
+
+    def test_home_grid_query_count_is_fixed(self):
+        """Test that the grid doesn't query per card for the landlord"""
+        self.create_property(1)
+        with CaptureQueriesContext(connection) as one_card:
+            self.client.get(reverse('home'))
+        for n in range(2, 13):
+            self.create_property(n)
+        caches['search'].clear()
+        with CaptureQueriesContext(connection) as twelve_cards:
+            response = self.client.get(reverse('home'))
+
+        self.assertContains(response, '@landlord12')
+        self.assertEqual(len(twelve_cards), len(one_card))
+
+    def test_cards_defer_text_columns(self):
+        """Test that the card projection leaves the long text in the database"""
+        self.create_property(1)
+        card = Property.objects.cards().get()
+        self.assertEqual(card.get_deferred_fields() & {'description', 'address', 'amenities'},
+                         {'description', 'address', 'amenities'})
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class AmenityTest(TestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.gym_pool = self.create_property('Gym and pool', 'WiFi, Gym , Pool')
+        self.gym = self.create_property('Gym only', 'gym')
+
+    def create_property(self, title, amenities):
+        return Property.objects.create(
+            landlord=self.user,
+            title=title,
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            amenities=amenities,
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def search(self, *amenities):
+        response = self.client.get(reverse('home'), {'amenities': list(amenities)})
+        return set(response.context['properties'])
+
+    def test_amenities_are_parsed_on_save(self):
+        """Test that the amenities text is normalized into Amenity rows"""
+        self.assertEqual(sorted(self.gym_pool.amenity_tags.values_list('slug', flat=True)), ['gym', 'pool', 'wifi'])
+        self.assertEqual(Amenity.objects.count(), 3)
+
+        self.gym_pool.amenities = 'Pool'
+        self.gym_pool.save()
+        self.assertEqual(list(self.gym_pool.amenity_tags.values_list('slug', flat=True)), ['pool'])
+
+    def test_filter_requires_every_amenity(self):
+        """Test filtering the home grid by one or more amenities"""
+        self.assertEqual(self.search('gym'), {self.gym_pool, self.gym})
+        self.assertEqual(self.search('gym', 'pool'), {self.gym_pool})
+
+    def test_amenity_change_invalidates_cached_search(self):
+        """Test that editing amenities drops the cached amenity search"""
+        self.assertEqual(self.search('pool'), {self.gym_pool})
+        self.gym.amenities = 'Gym, Pool'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gym.save()
+        self.assertEqual(self.search('pool'), {self.gym_pool, self.gym})
+
+    def test_detail_page_lists_amenities(self):
+        """Test that the detail page renders the parsed amenities"""
+        response = self.client.get(reverse('property_detail', args=[self.gym_pool.id]))
+        self.assertContains(response, '<span class="amenity-tag">WiFi</span>', html=True)
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class GeoSearchTest(TestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        Place.objects.create(name='Kilimani', latitude=-1.2906, longitude=36.7870)
+        Place.objects.create(name='Westlands', latitude=-1.2676, longitude=36.8108)
+        Place.objects.create(name='Karen', latitude=-1.3197, longitude=36.7073)
+        Place.objects.create(name='Mombasa', latitude=-4.0435, longitude=39.6682)
+        self.kilimani = self.create_property('Kilimani flat', 'Kilimani, Nairobi')
+        self.westlands = self.create_property('Westlands flat', 'Westlands')
+        self.karen = self.create_property('Karen house', 'Karen')
+        self.mombasa = self.create_property('Beach house', 'Mombasa')
+        self.unknown = self.create_property('Somewhere', 'Nowhere Town')
+
+    def create_property(self, title, location):
+        return Property.objects.create(
+            landlord=self.user,
+            title=title,
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location=location,
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def test_location_is_geocoded_from_places(self):
+        """Test that saving a property fills its coordinates from the Place table"""
+        self.assertEqual((self.kilimani.latitude, self.kilimani.longitude), (-1.2906, 36.7870))
+        self.assertIsNone(self.unknown.latitude)
+
+        self.kilimani.location = 'Karen'
+        self.kilimani.save()
+        self.assertEqual((self.kilimani.latitude, self.kilimani.longitude), (-1.3197, 36.7073))
+
+    def test_unrelated_edit_is_not_geocoded_again(self):
+        """Test that a listing without coordinates is only looked up again when its location changes"""
+        with mock.patch('base.geo.geocode', return_value=None) as geocode:
+            self.unknown.bathrooms = 2
+            self.unknown.save()
+            geocode.assert_not_called()
+            self.unknown.location = 'Karen'
+            self.unknown.save()
+            geocode.assert_called_once_with('Karen')
+
+    def test_radius_search_sorted_by_distance(self):
+        """Test that a radius search keeps nearby listings, nearest first"""
+        for _ in range(2):  # computed, then served from the search cache
+            response = self.client.get(reverse('home'), {'near': 'Kilimani', 'radius': '15'})
+            properties = list(response.context['properties'])
+            self.assertEqual(properties, [self.kilimani, self.westlands, self.karen])
+            self.assertAlmostEqual(properties[1].distance, 3.5, delta=0.2)
+            self.assertContains(response, 'km away')
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+    def test_radius_search_follows_coordinate_updates(self):
+        """Test that the spatial index is kept in sync with queryset updates"""
+        Property.objects.filter(id=self.mombasa.id).update(latitude=-1.29, longitude=36.79)
+        response = self.client.get(reverse('home'), {'near': 'Kilimani', 'radius': '2'})
+        self.assertEqual(list(response.context['properties']), [self.kilimani, self.mombasa])
+
+    def test_api_bbox_search(self):
+        """Test the bbox filter of the properties API"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/properties/', {'bbox': '36.75,-1.30,36.85,-1.25'})
+        self.assertEqual(response.status_code, 200)
+        ids = [row['id'] for row in response.json()['results']]
+        self.assertEqual(sorted(ids), sorted([self.kilimani.id, self.westlands.id]))
+        self.assertIn('base_property_rtree', queries.captured_queries[-1]['sql'])
+
+    def test_api_rejects_radius_without_point(self):
+        """Test that a radius needs somewhere to search around"""
+        response = self.client.get('/api/properties/', {'radius': '5'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('radius', response.json())
+
+
+class SimilarPropertyTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.listing = self.create_property('Listing', 'Kilimani', 'apartment', '1000.00', 2)
+        self.twin = self.create_property('Twin', 'Kilimani', 'apartment', '1050.00', 2)
+        self.pricier = self.create_property('Pricier', 'Kilimani', 'apartment', '1900.00', 2)
+        self.house = self.create_property('House', 'kilimani', 'house', '1000.00', 4)
+        self.elsewhere = self.create_property('Elsewhere', 'Karen', 'apartment', '1000.00', 2)
+
+    def create_property(self, title, location, property_type, rent, bedrooms):
+        property_obj = Property.objects.create(
+            landlord=self.user,
+            title=title,
+            property_type=property_type,
+            rent_amount=Decimal(rent),
+            location=location,
+            address='123 Test Street',
+            bedrooms=bedrooms,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30)
+        )
+        jobs.run_pending()
+        return property_obj
+
+    def similar_to(self, property_obj):
+        return list(
+            Property.objects.filter(similar_to__property=property_obj).order_by('similar_to__rank')
+        )
+
+    def table(self):
+        return sorted(SimilarProperty.objects.values_list('property_id', 'rank', 'similar_id'))
+
+    def test_similar_listings_are_ranked(self):
+        """Test that closer type, rent and bedrooms rank higher, in the same location only"""
+        self.assertEqual(self.similar_to(self.listing), [self.twin, self.pricier, self.house])
+        self.assertEqual(self.similar_to(self.elsewhere), [])
+
+    def test_unavailable_listing_leaves_lists(self):
+        """Test that marking a property unavailable updates the table incrementally"""
+        self.twin.is_available = False
+        self.twin.save()
+        # Queued rather than run in the request
+        self.assertIn(self.twin, self.similar_to(self.listing))
+        self.assertEqual(jobs.run_pending(), (1, 0))
+        self.assertEqual(self.similar_to(self.twin), [])
+        self.assertNotIn(self.twin, self.similar_to(self.listing))
+        self.assertEqual(self.similar_to(self.listing), [self.pricier, self.house])
+
+    def test_new_listing_joins_lists(self):
+        """Test that new close matches displace the weakest entries"""
+        closer = self.create_property('Closer', 'Kilimani', 'apartment', '1000.00', 2)
+        self.assertEqual(self.similar_to(self.listing), [closer, self.twin, self.pricier, self.house])
+        self.create_property('Also close', 'Kilimani', 'apartment', '1020.00', 2)
+        self.assertNotIn(self.house, self.similar_to(self.listing))
+        self.assertIn(self.listing, self.similar_to(closer))
+
+    def test_rebuild_matches_incremental_updates(self):
+        """Test that the rebuild command recomputes the same table"""
+        self.pricier.rent_amount = Decimal('1100.00')
+        self.pricier.save()
+        self.house.delete()
+        jobs.run_pending()
+        incremental = self.table()
+
+        out = StringIO()
+        call_command('rebuild_similar_properties', stdout=out)
+        self.assertIn('4 listings', out.getvalue())
+        self.assertTrue(incremental)
+        self.assertEqual(self.table(), incremental)
+
+    def test_detail_page_reads_one_lookup(self):
+        """Test that the detail page lists the precomputed similar properties"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('property_detail', args=[self.listing.id]))
+        self.assertEqual(list(response.context['related_properties']), [self.twin, self.pricier, self.house])
+        self.assertContains(response, 'Twin')
+        related = [query['sql'] for query in queries.captured_queries if 'base_similarproperty' in query['sql']]
+        # One for the ETag, one for the page
+        self.assertEqual(len(related), 2)
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class FacetTest(TestCase):
+    def setUp(self):
+        caches['search'].clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.create_property('apartment', '450.00', 1, 'Downtown')
+        self.create_property('apartment', '1200.00', 2, 'Downtown')
+        self.create_property('house', '1250.00', 6, 'Suburbs')
+        self.create_property('house', '9000.00', 4, 'Downtown', is_available=False)
+
+    def create_property(self, property_type, rent, bedrooms, location, is_available=True):
+        return Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type=property_type,
+            rent_amount=Decimal(rent),
+            location=location,
+            address='123 Test Street',
+            bedrooms=bedrooms,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            is_available=is_available,
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def counts(self, facets, name):
+        return [bucket['count'] for bucket in facets[name]]
+
+    def test_facets_of_filtered_search(self):
+        """Test type, bedroom and rent counts for a filter set, in one query"""
+        with self.assertNumQueries(1):
+            facets = facet_counts({'location': 'Downtown'})
+        self.assertEqual(facets['total'], 2)
+        self.assertEqual(self.counts(facets, 'property_type'), [2, 0, 0, 0, 0])
+        self.assertEqual(self.counts(facets, 'bedrooms'), [0, 1, 1, 0, 0])
+        self.assertEqual(self.counts(facets, 'rent'), [1, 0, 1, 0, 0, 0, 0, 0, 0, 0])
+
+    def test_unfiltered_facets_come_from_maintained_counts(self):
+        """Test that FacetCount tracks saves and matches a full recount"""
+        facets = facet_counts({'property_type': 'house'})
+        self.assertEqual(self.counts(facets, 'bedrooms'), [0, 0, 0, 0, 1])
+        self.assertEqual(facets['bedrooms'][2]['at_least'], 1)
+
+        maintained = sorted(FacetCount.objects.filter(count__gt=0).values_list(
+            'property_type', 'bedrooms', 'rent_bucket', 'count'))
+        call_command('rebuild_listing_stats', stdout=StringIO())
+        self.assertEqual(sorted(FacetCount.objects.values_list('property_type', 'bedrooms', 'rent_bucket', 'count')),
+                         maintained)
+        self.assertEqual(facet_counts()['rent'][-1]['count'], 0)
+
+    def test_price_filtered_facets_match_a_recount(self):
+        """Test that price ranges read from FacetCount plus their partial buckets match a grouped recount"""
+        for rent in ('500.00', '999.99', '1000.00', '4500.00', '7000.00'):
+            self.create_property('studio', rent, 1, 'Uptown')
+        ranges = [
+            (1000, None), (None, 1000), (500, 1250), (1001, 1249), (450, 4500), (1234, 9000), (5000, None), (2000, 1000),
+        ]
+        for min_price, max_price in ranges:
+            filters = {'property_type': 'apartment' if min_price == 450 else '', 'bedrooms': 1,
+                       'min_price': min_price and Decimal(min_price), 'max_price': max_price and Decimal(max_price)}
+            with CaptureQueriesContext(connection) as queries:
+                facets = facet_counts(filters)
+            self.assertLessEqual(len(queries), 2)
+            with mock.patch('base.facets._from_table', return_value=False):
+                self.assertEqual(facets, facet_counts(filters), (min_price, max_price))
+
+    def test_facets_are_cached_until_a_match_changes(self):
+        """Test that cached facets are dropped when a matching property changes"""
+        filters = {'location': 'Downtown'}
+        self.assertEqual(search_facets(filters)['total'], 2)
+        with self.assertNumQueries(0):
+            search_facets(filters)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_property('studio', '700.00', 0, 'Downtown')
+        self.assertEqual(search_facets(filters)['total'], 3)
+
+    def test_api_and_home_show_facets(self):
+        """Test the facets endpoint and the home page facet chips"""
+        response = self.client.get('/api/properties/facets/', {'property_type': 'apartment'})
+        self.assertEqual(response.json()['total'], 2)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'rent-histogram__bar')
+        self.assertEqual(response.context['facets']['total'], 3)
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class PropertyApiTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        caches['search'].clear()
+        for n in range(3):
+            landlord = User.objects.create_user(
+                username=f'landlord{n}',
+                email=f'landlord{n}@example.com',
+                password='testpass123'
+            )
+            Property.objects.create(
+                landlord=landlord,
+                title=f'Test Property {n}',
+                property_type='apartment' if n else 'house',
+                rent_amount=Decimal('1200.00') + n,
+                location='Test City',
+                address='123 Test Street',
+                bedrooms=2,
+                bathrooms=1,
+                area_sqft=800,
+                description='A nice test property',
+                amenities='WiFi, Parking',
+                date_available=date.today() + timedelta(days=30)
+            )
+
+    def test_list_joins_landlord_in_one_query(self):
+        """Test that a page of properties and their landlords is one query"""
+        # Warm the cached ETag aggregate
+        self.client.get('/api/properties/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/properties/')
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['landlord']['username'], 'landlord2')
+        self.assertNotIn('description', results[0])
+
+    def test_sparse_fieldsets(self):
+        """Test that fields= limits the payload and the loaded columns"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/properties/', {'fields': 'id,title,rent_amount'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title', 'rent_amount'})
+        self.assertNotIn('description', queries.captured_queries[-1]['sql'])
+        self.assertNotIn('base_user', queries.captured_queries[-1]['sql'])
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/properties/', {'fields': 'id,amenities'})
+        self.assertEqual(response.json()['results'][0]['amenities'], ['Parking', 'WiFi'])
+
+        response = self.client.get('/api/properties/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination_keeps_filters(self):
+        """Test walking a filtered search with limit= and the next cursor"""
+        response = self.client.get('/api/properties/', {'property_type': 'apartment', 'limit': 1, 'fields': 'title'})
+        data = response.json()
+        self.assertEqual(data['results'], [{'title': 'Test Property 2'}])
+        response = self.client.get('/api/properties/', {'cursor': data['next'], 'limit': 1, 'fields': 'title'})
+        data = response.json()
+        self.assertEqual(data['results'], [{'title': 'Test Property 1'}])
+        self.assertIsNone(data['next'])
+
+    def test_detail(self):
+        """Test the property detail endpoint"""
+        property_obj = Property.objects.get(title='Test Property 0')
+        response = self.client.get(f'/api/properties/{property_obj.id}/', {'fields': 'title,description'})
+        self.assertEqual(response.json(), {'title': 'Test Property 0', 'description': 'A nice test property'})
+        Property.objects.filter(id=property_obj.id).update(is_available=False)
+        self.assertEqual(self.client.get(f'/api/properties/{property_obj.id}/').status_code, 404)
+
+    def test_batch(self):
+        """Test fetching properties by an id list in one query, in the order asked"""
+        ids = list(Property.objects.order_by('id').values_list('id', flat=True))
+        Property.objects.filter(id=ids[1]).update(is_available=False)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/properties/batch/', {
+                'ids': f'{ids[2]},999,{ids[0]},{ids[1]},{ids[2]}', 'fields': 'id,title,landlord',
+            })
+        data = response.json()
+        self.assertEqual([result['id'] for result in data['results']], [ids[2], ids[0]])
+        self.assertEqual(data['results'][0]['landlord']['username'], 'landlord2')
+        self.assertEqual(data['missing'], [999, ids[1]])
+
+        for params in [{}, {'ids': '1,x'}, {'ids': ','.join(map(str, range(101)))}, {'ids': '1', 'fields': 'secret'}]:
+            self.assertEqual(self.client.get('/api/properties/batch/', params).status_code, 400, params)
+
+
+class StreamingRoomsApiTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        topic = Topic.objects.create(name='Rentals')
+        for n in range(5):
+            room = Room.objects.create(host=self.user, topic=topic, name=f'Room {n}', amount=100 * n)
+            room.participants.add(self.user)
+
+    def test_streamed_array_matches_regular_response(self):
+        """Test that ?stream=json sends the same bytes as the regular endpoint"""
+        regular = self.client.get('/api/rooms/').content
+        response = self.client.get('/api/rooms/', {'stream': 'json'})
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(2):
+            streamed = b''.join(response.streaming_content)
+        self.assertEqual(streamed, regular)
+
+    def test_ndjson_stream(self):
+        """Test one JSON document per line with participants prefetched"""
+        response = self.client.get('/api/rooms/', {'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['participants'], [self.user.id])
+
+    def test_chunks_are_batched(self):
+        """Test that the array is written in batches and stays valid JSON"""
+        chunks = list(json_chunks(range(5), lambda n: {'n': n}, batch_size=2))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks)), [{'n': n} for n in range(5)])
+        self.assertEqual(list(json_chunks([], dict)), [b'[', b']'])
+
+    def test_batch(self):
+        """Test fetching rooms by an id list: one query plus participants, in the order asked"""
+        ids = list(Room.objects.order_by('id').values_list('id', flat=True))
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/rooms/batch/', {'ids': f'{ids[3]}, {ids[0]},999'})
+        data = response.json()
+        self.assertEqual(data['results'], [self.client.get(f'/api/rooms/{pk}/').json() for pk in (ids[3], ids[0])])
+        self.assertEqual(data['missing'], [999])
+        self.assertEqual(self.client.get('/api/rooms/batch/', {'ids': 'a'}).json(),
+                         {'ids': ['Enter a comma-separated list of ids.']})
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        caches['search'].clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.property = Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            amenities='WiFi, Parking',
+            date_available=date.today() + timedelta(days=30)
+        )
+        self.room = Room.objects.create(host=self.user, topic=Topic.objects.create(name='Rentals'), name='Room')
+
+    def test_detail_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 without rendering the page"""
+        url = reverse('property_detail', args=[self.property.pk])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        with self.assertNumQueries(4):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_detail_etag_changes_on_save(self):
+        """Test that saving the property changes its ETag"""
+        url = reverse('property_detail', args=[self.property.pk])
+        etag = self.client.get(url)['ETag']
+        self.property.rent_amount = Decimal('1300.00')
+        self.property.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_etag_changes_with_landlord_gallery_and_amenities(self):
+        """Test that edits the listing's updated doesn't see still change the detail ETags"""
+        url = reverse('property_detail', args=[self.property.pk])
+        api_url = f'/api/properties/{self.property.pk}/'
+        edits = [
+            lambda: User.objects.filter(pk=self.user.pk).update(name='Renamed Landlord'),
+            lambda: PropertyImage.objects.create(property=self.property, image='properties/a.jpg'),
+            lambda: PropertyImage.objects.filter(property=self.property).update(caption='Kitchen'),
+            lambda: Amenity.objects.filter(properties=self.property).update(name='Fibre WiFi'),
+        ]
+        for edit in edits:
+            etag = self.client.get(url)['ETag']
+            edit()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        api_etag = self.client.get(api_url)['ETag']
+        self.assertEqual(self.client.get(api_url, HTTP_IF_NONE_MATCH=api_etag).status_code, 304)
+        self.assertNotEqual(self.client.get(api_url, {'fields': 'id,title'})['ETag'], api_etag)
+        User.objects.filter(pk=self.user.pk).update(username='renamed')
+        self.assertEqual(self.client.get(api_url, HTTP_IF_NONE_MATCH=api_etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/properties/999/').status_code, 404)
+
+    def test_room_etag_changes_with_participants(self):
+        """Test that joining a room changes the room and room list ETags"""
+        room_url = f'/api/rooms/{self.room.pk}/'
+        room_etag = self.client.get(room_url)['ETag']
+        list_etag = self.client.get('/api/rooms/')['ETag']
+        self.assertEqual(self.client.get('/api/rooms/', HTTP_IF_NONE_MATCH=list_etag).status_code, 304)
+        self.room.participants.add(self.user)
+        self.assertNotEqual(self.client.get(room_url)['ETag'], room_etag)
+        self.assertNotEqual(self.client.get('/api/rooms/')['ETag'], list_etag)
+        self.assertEqual(self.client.get('/api/rooms/999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/rooms/abc/').status_code, 404)
+
+    def test_property_list_etag(self):
+        """Test that the property list ETag is cached per search and follows changes"""
+        etag = self.client.get('/api/properties/', {'property_type': 'apartment'})['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/properties/', {'property_type': 'apartment'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.property.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.property.save()
+        self.assertNotEqual(self.client.get('/api/properties/', {'property_type': 'apartment'})['ETag'], etag)
+
+    def test_property_list_etag_follows_bulk_updates(self):
+        """Test that a bulk update of updated alone, as after a variant build, changes the list ETag"""
+        params = {'property_type': 'apartment'}
+        etag = self.client.get('/api/properties/', params)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Property.objects.filter(pk=self.property.pk).update(updated=timezone.now() + timedelta(seconds=1))
+        response = self.client.get('/api/properties/', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class ImportPropertiesTest(TestCase):
+    HEADER = 'ref,title,property_type,rent_amount,location,address,bedrooms,bathrooms,area_sqft,description,amenities,date_available\n'
+
+    def setUp(self):
+        caches['search'].clear()
+        self.user = User.objects.create_user(
+            username='landlord',
+            email='landlord@example.com',
+            password='testpass123'
+        )
+        Place.objects.create(name='Kilimani', latitude=-1.29, longitude=36.78)
+
+    def feed(self, *rows):
+        return self.HEADER + ''.join(
+            f'{ref},Listing {ref},apartment,{rent},Kilimani,1 Main St,{beds},1,800,A nice place,"WiFi, Parking",2030-01-01\n'
+            for ref, rent, beds in rows
+        )
+
+    def run_import(self, text, *args):
+        out, err = StringIO(), StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'feed.csv')
+            with open(path, 'w', encoding='utf-8') as feed:
+                feed.write(text)
+            call_command('import_properties', path, '--landlord', 'landlord', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def similar_ids(self, listing):
+        return list(listing.similar_links.values_list('similar_id', flat=True))
+
+    def test_import_creates_listings(self):
+        """Test that a feed creates geocoded listings with amenities and counts"""
+        out, err = self.run_import(self.feed(('a1', 1000, 2), ('a2', 1500, 3)), '--workers', '0')
+        self.assertIn('2 created, 0 updated, 0 unchanged, 0 errors', out)
+        listing = Property.objects.get(landlord=self.user, external_ref='a1')
+        self.assertEqual((listing.latitude, listing.longitude), (-1.29, 36.78))
+        self.assertEqual(sorted(listing.amenity_tags.values_list('slug', flat=True)), ['parking', 'wifi'])
+        self.assertEqual(PropertyTypeStats.objects.get(property_type='apartment').available_count, 2)
+        self.assertEqual(facet_counts()['total'], 2)
+        self.assertEqual(self.similar_ids(listing), [Property.objects.get(external_ref='a2').pk])
+
+    def test_reimport_updates_changed_rows_only(self):
+        """Test that refs are upserted and unchanged rows keep their updated time"""
+        self.run_import(self.feed(('a1', 1000, 2), ('a2', 1500, 3)), '--workers', '0')
+        first = dict(Property.objects.values_list('external_ref', 'updated'))
+        out, err = self.run_import(self.feed(('a1', 1000, 2), ('a2', 1600, 3), ('a3', 900, 1)), '--workers', '0')
+        self.assertIn('1 created, 1 updated, 1 unchanged, 0 errors', out)
+        self.assertEqual(Property.objects.count(), 3)
+        second = dict(Property.objects.values_list('external_ref', 'updated'))
+        self.assertEqual(second['a1'], first['a1'])
+        self.assertGreater(second['a2'], first['a2'])
+        self.assertEqual(Property.objects.get(external_ref='a2').rent_amount, Decimal('1600'))
+
+    def test_row_errors_are_reported(self):
+        """Test that invalid rows are reported by line and the rest imported"""
+        text = self.feed(('a1', 1000, 2), ('a2', 'lots', 2), ('', 900, 1))
+        out, err = self.run_import(text, '--workers', '1', '--batch-size', '2')
+        self.assertIn('1 created, 0 updated, 0 unchanged, 2 errors', out)
+        self.assertIn('line 3 (ref a2): rent_amount: Enter a number.', err)
+        self.assertIn('line 4 (ref -): ref: This field is required.', err)
+
+    def test_only_unsure_rows_use_the_form(self):
+        """Test that clean rows skip the form and the rest get its values and errors"""
+        text = self.feed(('a1', 1000, 2), ('a2', 1100, '3.0'), ('a3', 'lots', 2))
+        rows = list(read_rows(StringIO(text), 'csv'))
+        full_clean = PropertyImportForm.full_clean
+        with mock.patch.object(PropertyImportForm, 'full_clean', autospec=True, side_effect=full_clean) as checked:
+            results = validate_rows(rows)
+        self.assertEqual(checked.call_count, 2)
+        (_, _, clean, _), (_, _, unsure, _), (_, ref, invalid, errors) = results
+        self.assertEqual((clean['rent_amount'], clean['bedrooms'], clean['date_available']),
+                         (Decimal('1000'), 2, date(2030, 1, 1)))
+        self.assertEqual(unsure['bedrooms'], 3)
+        self.assertEqual((ref, invalid, errors), ('a3', None, {'rent_amount': ['Enter a number.']}))
+
+    def test_ndjson_rows(self):
+        """Test NDJSON input, including lines that aren't JSON objects"""
+        row = {'ref': 'n1', 'title': 'Listing', 'property_type': 'house', 'rent_amount': 1200,
+               'location': 'Kilimani', 'address': '1 Main St', 'bedrooms': 2, 'bathrooms': 1,
+               'area_sqft': 800, 'description': 'A nice place', 'date_available': '2030-01-01'}
+        text = json.dumps(row) + '\n\nnot json\n[1]\n'
+        rows = list(read_rows(StringIO(text), 'ndjson'))
+        self.assertEqual([line for line, row in rows], [1, 3, 4])
+        result = import_properties(rows, self.user)
+        self.assertEqual(len(result.created), 1)
+        self.assertEqual([(line, errors) for line, ref, errors in result.errors],
+                         [(3, {'__all__': ['Not a JSON object.']}), (4, {'__all__': ['Not a JSON object.']})])
+
+    def test_bulk_changes_are_sent_once(self):
+        """Test that held_bulk_changes sends one signal with every field written"""
+        received = []
+
+        def handler(sender, fields, **kwargs):
+            received.append(fields)
+
+        properties_bulk_changed.connect(handler, sender=Property)
+        self.addCleanup(properties_bulk_changed.disconnect, handler, sender=Property)
+        self.run_import(self.feed(('a1', 1000, 2)), '--workers', '0')
+        with held_bulk_changes():
+            Property.objects.update(rent_amount=1100)
+            Property.objects.update(bedrooms=4)
+            self.assertEqual(received, [None])
+        self.assertEqual(received, [None, {'rent_amount', 'bedrooms'}])
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.admin = User.objects.create_user(
+            username='admin',
+            email='admin@example.com',
+            password='testpass123',
+            is_staff=True
+        )
+        for n in range(5):
+            Property.objects.create(
+                landlord=self.admin,
+                title=f'Test Property {n}',
+                property_type='apartment',
+                rent_amount=Decimal('1200.50'),
+                location='Test City',
+                address='123 Test Street',
+                bedrooms=2,
+                bathrooms=1,
+                area_sqft=800,
+                description='A nice test property',
+                date_available=date(2030, 1, 1)
+            )
+        room = Room.objects.create(host=self.admin, name='Room')
+        Message.objects.create(user=self.admin, room=room, body='Hello')
+        # Written long enough ago to be exported
+        Property.objects.update(updated=timezone.now() - timedelta(hours=1))
+        Message.objects.update(updated=timezone.now() - timedelta(hours=1))
+
+    def read(self, chunks):
+        return [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+
+    def later(self):
+        """Once rows written now have settled"""
+        return mock.patch('base.export.timezone.now', return_value=timezone.now() + export.SETTLE)
+
+    def test_batches_walk_ties_in_order(self):
+        """Test that keyset batches return every row once when updated ties"""
+        Property.objects.update(updated=timezone.now())
+        ids = [row[0] for batch in export.batches(Property, batch_size=2) for row in batch]
+        self.assertEqual(ids, sorted(Property.objects.values_list('id', flat=True)))
+
+    def test_incremental_export(self):
+        """Test that the watermark of one export picks up only later changes"""
+        until, chunks = export.export('properties')
+        rows = self.read(chunks)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['rent_amount'], '1200.50')
+        self.assertEqual(rows[0]['date_available'], '2030-01-01')
+
+        changed = Property.objects.get(title='Test Property 3')
+        changed.bedrooms = 3
+        changed.save()
+        self.assertEqual(self.read(export.export('properties', since=until)[1]), [])
+        with self.later():
+            next_until, chunks = export.export('properties', since=until)
+            self.assertEqual([row['id'] for row in self.read(chunks)], [changed.id])
+            self.assertEqual(self.read(export.export('properties', since=next_until)[1]), [])
+
+    def test_late_commit_not_skipped(self):
+        """Test that a row stamped before an export's watermark but committed after it is exported next"""
+        fast, slow = Property.objects.order_by('id')[:2]
+        Property.objects.filter(id=fast.id).update(updated=timezone.now() - timedelta(minutes=2))
+        until, chunks = export.export('properties')
+        self.assertNotIn(fast.id, [row['id'] for row in self.read(chunks)])
+
+        # Stamped before fast, by a transaction that commits after the export
+        Property.objects.filter(id=slow.id).update(updated=timezone.now() - timedelta(minutes=3))
+        with self.later():
+            until, chunks = export.export('properties', since=until)
+        self.assertEqual([row['id'] for row in self.read(chunks)], [slow.id, fast.id])
+
+    def test_csv_and_gzip(self):
+        """Test gzip-compressed CSV with a header row"""
+        until, chunks = export.export('messages', format='csv', compress=True, batch_size=1)
+        lines = gzip.decompress(b''.join(chunks)).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(export.columns(Message)))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Hello', lines[1])
+
+    def test_endpoint_is_admin_only(self):
+        """Test that the export endpoint streams for staff and no one else"""
+        self.assertEqual(self.client.get('/api/export/properties/').status_code, 403)
+        self.client.login(email='admin@example.com', password='testpass123')
+        response = self.client.get('/api/export/properties/', {'output': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 6)
+        watermark = response['X-Export-Watermark']
+        response = self.client.get('/api/export/properties/', {'since': watermark})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        self.assertEqual(self.client.get('/api/export/properties/', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/export/users/').status_code, 404)
+
+    def test_command_writes_gzip_file(self):
+        """Test that the command gzips a .gz output and reports the next watermark"""
+        err = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'properties.ndjson.gz')
+            call_command('export_rows', 'properties', path, stdout=StringIO(), stderr=err)
+            with gzip.open(path) as file:
+                self.assertEqual(len(file.read().splitlines()), 5)
+        self.assertIn('Next export: --since', err.getvalue())
+
+
+class AsyncApiTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.property = Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            amenities='WiFi, Parking',
+            date_available=date.today() + timedelta(days=30)
+        )
+        self.room = Room.objects.create(host=self.user, name='Room')
+        self.room.participants.add(self.user)
+        Message.objects.create(user=self.user, room=self.room, body='Hello')
+
+    def test_async_views_match_sync_views(self):
+        """Test that every async endpoint sends the bytes of its sync counterpart"""
+        for path in ['rooms/', f'rooms/{self.room.id}/', 'properties/?fields=id,title,amenities',
+                     f'properties/{self.property.id}/', 'activity/']:
+            sync = self.client.get('/api/' + path)
+            response = self.client.get('/api/async/' + path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual(response.content, sync.content, path)
+            self.assertEqual(response.get('ETag'), sync.get('ETag'), path)
+
+    def test_async_errors(self):
+        """Test missing objects, bad parameters and methods on the async endpoints"""
+        self.assertEqual(self.client.get('/api/async/rooms/999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/async/rooms/abc/').status_code, 404)
+        self.assertEqual(self.client.get('/api/async/properties/999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/async/properties/', {'fields': 'secret'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/async/rooms/').status_code, 405)
+        etag = self.client.get('/api/async/rooms/')['ETag']
+        self.assertEqual(self.client.get('/api/async/rooms/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    async def test_asgi_handler_streams_querysets(self):
+        """Test that streamed responses are read off the event loop under ASGI"""
+        def names():
+            for room in Room.objects.all():
+                yield room.name
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await ASGIHandler().send_response(StreamingHttpResponse(names()), send)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages[1:]), b'Room')
+        self.assertFalse(messages[-1].get('more_body'))
+
+
+class FastSerializerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        topic = Topic.objects.create(name='Flats')
+        self.room = Room.objects.create(host=self.user, topic=topic, name='Room', amount=100, description='Nice')
+        # Added out of id order, with a room of no host, topic or image
+        self.room.participants.add(self.other, self.user)
+        Room.objects.create(name='Empty', image=None)
+        Message.objects.create(user=self.user, room=self.room, body='Hello')
+        Message.objects.create(user=self.other, room=self.room, body='Hi')
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_matches_model_serializers(self):
+        """Test that fast lists render to the same bytes as the model serializers"""
+        rooms = Room.objects.prefetch_related('participants')
+        self.assertEqual(
+            self.render(room_list.serialize(Room.objects.all())),
+            self.render(RoomSerializer(rooms, many=True).data),
+        )
+        self.assertEqual(self.render(list(room_list.iterate(Room.objects.all(), batch_size=1))),
+                         self.render(RoomSerializer(rooms, many=True).data))
+        messages = Message.objects.select_related('user', 'room')
+        self.assertEqual(
+            self.render(message_list.serialize(Message.objects.all())),
+            self.render(MessageSerializer(messages, many=True).data),
+        )
+
+    def test_current_time_zone(self):
+        """Test that datetimes follow the active time zone, as DRF renders them"""
+        with timezone.override('Africa/Nairobi'):
+            self.assertEqual(
+                self.render(room_list.serialize(Room.objects.all())),
+                self.render(RoomSerializer(Room.objects.prefetch_related('participants'), many=True).data),
+            )
+            self.assertIn('+03:00', room_list.serialize(Room.objects.all())[0]['created'])
+
+    def test_query_count(self):
+        """Test that a list is one query, plus one per batch for many-to-many fields"""
+        with self.assertNumQueries(2):
+            room_list.serialize(Room.objects.all())
+        with self.assertNumQueries(1):
+            message_list.serialize(Message.objects.all())
+
+    def test_unsupported_fields(self):
+        """Test that serializers the fast path can't reproduce are refused"""
+        class NamedRoomSerializer(RoomSerializer):
+            label = SerializerMethodField()
+
+            def get_label(self, room):
+                return room.name
+
+        with self.assertRaises(TypeError):
+            FastSerializer(NamedRoomSerializer).serialize(Room.objects.all())
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class ImageVariantTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        caches['search'].clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def upload(self, name, size=(2000, 1000), mode='RGBA'):
+        data = BytesIO()
+        Image.new(mode, size, 'red').save(data, 'PNG')
+        return SimpleUploadedFile(name, data.getvalue(), content_type='image/png')
+
+    def create_property(self, image):
+        property_obj = Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30),
+            main_image=image,
+        )
+        jobs.run_pending()
+        return property_obj
+
+    def test_variants_built_after_upload(self):
+        """Test that an upload gets thumb, card and full variants in WebP and JPEG"""
+        property_obj = self.create_property(self.upload('photo.png'))
+        property_obj.refresh_from_db()
+        variants = property_obj.main_image_variants
+        self.assertEqual(variants, {'source': property_obj.main_image.name,
+                                    'widths': {'thumb': 320, 'card': 640, 'full': 1600}})
+        with Image.open(os.path.join(self.media.name, images.variant_name(variants['source'], 'card', 'webp'))) as card:
+            self.assertEqual((card.format, card.size), ('WEBP', (640, 320)))
+
+        srcset = self.client.get(f'/api/properties/{property_obj.id}/').json()['image_srcset']
+        self.assertEqual(srcset['webp'].split(', ')[0], images.variant_url(variants['source'], 'thumb', 'webp') + ' 320w')
+        content = self.client.get(reverse('home')).content.decode()
+        self.assertIn('<source type="image/webp"', content)
+        self.assertIn(images.variant_url(variants['source'], 'card', 'jpeg'), content)
+
+    def test_small_and_replaced_uploads(self):
+        """Test that small images aren't scaled up and a new upload replaces the old variants"""
+        property_obj = self.create_property(self.upload('small.png', (500, 400), 'RGB'))
+        property_obj.refresh_from_db()
+        old = property_obj.main_image_variants
+        self.assertEqual(old['widths'], {'thumb': 320, 'card': 500})
+
+        property_obj.main_image = self.upload('new.png')
+        property_obj.save()
+        jobs.run_pending()
+        property_obj.refresh_from_db()
+        self.assertEqual(property_obj.main_image_variants['source'], property_obj.main_image.name)
+        # The old file and its variants go once gc_media finds them unused
+        old_thumb = os.path.join(self.media.name, images.variant_name(old['source'], 'thumb', 'jpeg'))
+        self.assertTrue(os.path.exists(old_thumb))
+        call_command('gc_media', grace=0, stdout=StringIO())
+        self.assertFalse(os.path.exists(old_thumb))
+
+    def test_unreadable_upload_falls_back(self):
+        """Test that a file Pillow can't read keeps serving the original"""
+        upload = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        property_obj = self.create_property(upload)
+        property_obj.refresh_from_db()
+        self.assertEqual(property_obj.main_image_variants, {})
+        self.assertIsNone(self.client.get(f'/api/properties/{property_obj.id}/').json()['image_srcset'])
+
+    def test_build_command(self):
+        """Test that build_image_variants backfills images without variants"""
+        property_obj = self.create_property(self.upload('photo.png'))
+        Property.objects.filter(id=property_obj.id).update(main_image_variants={})
+        out = StringIO()
+        call_command('build_image_variants', workers=0, stdout=out)
+        self.assertIn('Built variants of 1 images', out.getvalue())
+        property_obj.refresh_from_db()
+        self.assertEqual(property_obj.main_image_variants['source'], property_obj.main_image.name)
+
+
+calls = []
+
+
+@jobs.task(max_attempts=2)
+def record_call(value):
+    calls.append(value)
+
+
+@jobs.task(max_attempts=2)
+def flaky_call(value):
+    raise ValueError(value)
+
+
+@jobs.task(concurrency=1)
+def limited_call(value):
+    calls.append(value)
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        """Test that queued jobs run in order once due"""
+        jobs.enqueue(record_call, 1)
+        jobs.enqueue(record_call, 2)
+        later = jobs.enqueue(record_call, 3, delay=timedelta(hours=1))
+        self.assertEqual(calls, [])
+        self.assertEqual(jobs.run_pending(), (2, 0))
+        self.assertEqual(calls, [1, 2])
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+    def test_idempotency_key(self):
+        """Test that a key returns the job while it's pending, and queues a new one once it has run"""
+        first = jobs.enqueue(record_call, 1, key='once')
+        self.assertEqual(jobs.enqueue(record_call, 2, key='once').id, first.id)
+        jobs.run_pending()
+        again = jobs.enqueue(record_call, 3, key='once')
+        self.assertNotEqual(again.id, first.id)
+        self.assertEqual(jobs.enqueue(record_call, 4, key='once').id, again.id)
+        jobs.run_pending()
+        self.assertEqual(calls, [1, 3])
+
+    def test_retries_with_backoff(self):
+        """Test that a failing job is retried later, then left as failed"""
+        job = jobs.enqueue(flaky_call, 'boom')
+        self.assertEqual(jobs.run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + jobs.backoff(1) - timedelta(seconds=5))
+        self.assertIn('ValueError: boom', job.last_error)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        self.assertEqual(jobs.run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(jobs.backoff(2), 2 * jobs.backoff(1))
+
+    def test_concurrency_limit_and_abandoned_jobs(self):
+        """Test that a task at its concurrency limit waits, and dead workers' jobs are requeued"""
+        running = jobs.enqueue(limited_call, 1)
+        jobs.enqueue(limited_call, 2)
+        self.assertEqual(jobs.claim('dead-worker').id, running.id)
+        self.assertIsNone(jobs.claim('other-worker'))
+
+        # Claimed by another worker after _full_tasks() looked
+        with mock.patch.object(jobs, '_full_tasks', return_value=[]):
+            self.assertIsNone(jobs.claim('other-worker'))
+
+        Job.objects.filter(id=running.id).update(locked_at=timezone.now() - jobs.LOCK_TIMEOUT - timedelta(minutes=1))
+        self.assertEqual(jobs.requeue_abandoned(), 1)
+        self.assertEqual(jobs.run_pending(), (2, 0))
+        self.assertEqual(sorted(calls), [1, 2])
+
+    def test_deleting_a_property_queues_similar_refresh(self):
+        """Test that the similar lists a deleted listing was in are refreshed by a job"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        properties = [
+            Property.objects.create(
+                landlord=user, title=f'Flat {n}', property_type='apartment', rent_amount=Decimal('1000.00') + n,
+                location='Kilimani', address='1 Road', bedrooms=2, bathrooms=1, area_sqft=700,
+                description='A flat', date_available=date.today(),
+            )
+            for n in range(3)
+        ]
+        jobs.run_pending()
+        properties[1].delete()
+        job = Job.objects.get(task='base.similar.refresh')
+        self.assertEqual(set(job.args[0]), {properties[0].id, properties[2].id})
+        jobs.run_pending()
+        self.assertEqual(SimilarProperty.objects.filter(property=properties[0]).count(), 1)
+
+
+class JobWorkerCommandTest(TransactionTestCase):
+    # The worker threads read the queue through connections of their own
+    def setUp(self):
+        calls.clear()
+
+    def test_worker_command(self):
+        """Test that run_jobs --once drains the queue and purges old jobs"""
+        jobs.enqueue(record_call, 1)
+        old = jobs.enqueue(record_call, 2)
+        Job.objects.filter(id=old.id).update(status=Job.DONE, updated=timezone.now() - timedelta(days=8))
+        out = StringIO()
+        call_command('run_jobs', once=True, stdout=out)
+        self.assertIn('Ran 1 jobs (0 failed)', out.getvalue())
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.filter(id=old.id).exists())
+
+
+class MediaStorageTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+
+    def create_property(self, image):
+        return Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30),
+            main_image=image,
+        )
+
+    def blob(self, name):
+        return MediaBlob.objects.get(name=name).refs
+
+    def test_identical_uploads_share_one_file(self):
+        """Test that the same bytes under different names are stored once, named by their hash"""
+        first = self.create_property(SimpleUploadedFile('a.JPG', b'photo bytes'))
+        second = self.create_property(SimpleUploadedFile('b.jpg', b'photo bytes'))
+        PropertyImage.objects.create(property=second, image=SimpleUploadedFile('c.jpg', b'photo bytes'))
+        name = first.main_image.name
+        self.assertEqual(name, storage.blob_name(hashlib.sha256(b'photo bytes').hexdigest(), 'a.jpg'))
+        self.assertEqual(second.main_image.name, name)
+        self.assertEqual(os.listdir(os.path.dirname(os.path.join(self.media.name, name))), [os.path.basename(name)])
+        self.assertEqual(self.blob(name), 3)
+
+        self.user.avatar = SimpleUploadedFile('me.jpg', b'photo bytes')
+        self.user.save()
+        self.assertEqual(self.blob(name), 4)
+        second.delete()
+        self.assertEqual(self.blob(name), 2)
+
+    def test_gc_deletes_unreferenced_files_after_grace(self):
+        """Test that gc_media recounts references and keeps files inside the grace period"""
+        property_obj = self.create_property(SimpleUploadedFile('a.jpg', b'old photo'))
+        old = property_obj.main_image.name
+        property_obj.main_image = SimpleUploadedFile('b.jpg', b'new photo')
+        property_obj.save()
+        self.assertEqual(self.blob(old), 0)
+        stray = storage.media_storage.save('stray.jpg', ContentFile(b'never saved on a row'))
+
+        out = StringIO()
+        call_command('gc_media', stdout=out)
+        self.assertIn('0 files deleted', out.getvalue())
+        call_command('gc_media', grace=0, dry_run=True, stdout=out)
+        self.assertTrue(storage.media_storage.exists(old))
+
+        # Queryset updates bypass the signals; the recount catches them
+        Property.objects.filter(id=property_obj.id).update(main_image='')
+        out = StringIO()
+        call_command('gc_media', grace=0, stdout=out)
+        self.assertIn('1 reference counts corrected, 3 files deleted', out.getvalue())
+        for name in (old, property_obj.main_image.name, stray):
+            self.assertFalse(storage.media_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_gc_keeps_file_uploaded_again_while_collecting(self):
+        """Test that a blob re-uploaded between its row delete and the unlink survives"""
+        property_obj = self.create_property(SimpleUploadedFile('a.jpg', b'old photo'))
+        old = property_obj.main_image.name
+        property_obj.main_image = SimpleUploadedFile('b.jpg', b'new photo')
+        property_obj.save()
+        uploads = []
+
+        def upload_again(sender, instance, **kwargs):
+            if instance.name == old and not uploads:
+                uploads.append(self.create_property(SimpleUploadedFile('c.jpg', b'old photo')))
+
+        post_delete.connect(upload_again, sender=MediaBlob)
+        self.addCleanup(post_delete.disconnect, upload_again, sender=MediaBlob)
+        deleted = storage.collect(timedelta(0))
+
+        self.assertEqual(uploads[0].main_image.name, old)
+        self.assertNotIn(old, deleted)
+        self.assertTrue(storage.media_storage.exists(old))
+        self.assertEqual(self.blob(old), 1)
+
+    def test_gc_keeps_row_of_file_touched_while_collecting(self):
+        """Test that a blob touched by an upload between its row delete and the unlink keeps its row"""
+        property_obj = self.create_property(SimpleUploadedFile('a.jpg', b'old photo'))
+        old = property_obj.main_image.name
+        property_obj.main_image = SimpleUploadedFile('b.jpg', b'new photo')
+        property_obj.save()
+        hours_ago = time.time() - 2 * 3600
+        os.utime(storage.media_storage.path(old), (hours_ago, hours_ago))
+        MediaBlob.objects.filter(name=old).update(updated=timezone.now() - timedelta(hours=2))
+
+        def touch(sender, instance, **kwargs):
+            if instance.name == old:
+                storage.media_storage.save('c.jpg', ContentFile(b'old photo'))
+
+        post_delete.connect(touch, sender=MediaBlob)
+        self.addCleanup(post_delete.disconnect, touch, sender=MediaBlob)
+        deleted = storage.collect(timedelta(hours=1))
+
+        self.assertNotIn(old, deleted)
+        self.assertTrue(storage.media_storage.exists(old))
+        self.assertEqual(self.blob(old), 0)
+
+
+@override_settings(CACHES=SEARCH_CACHES)
+class GalleryTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        caches['search'].clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.property = Property.objects.create(
+            landlord=self.user,
+            title='Test Property',
+            property_type='apartment',
+            rent_amount=Decimal('1200.00'),
+            location='Test City',
+            address='123 Test Street',
+            bedrooms=2,
+            bathrooms=1,
+            area_sqft=800,
+            description='A nice test property',
+            date_available=date.today() + timedelta(days=30)
+        )
+
+    def upload(self, name, color='red'):
+        data = BytesIO()
+        Image.new('RGB', (400, 300), color).save(data, 'JPEG')
+        return SimpleUploadedFile(name, data.getvalue(), content_type='image/jpeg')
+
+    def edit(self, files):
+        self.client.login(username='testuser', password='testpass123')
+        return self.client.post(reverse('edit_property', args=[self.property.id]), {
+            'title': 'Test Property',
+            'property_type': 'apartment',
+            'rent_amount': '1200.00',
+            'location': 'Test City',
+            'address': '123 Test Street',
+            'bedrooms': 2,
+            'bathrooms': 1,
+            'area_sqft': 800,
+            'description': 'A nice test property',
+            'date_available': (date.today() + timedelta(days=30)).isoformat(),
+            'gallery': files,
+        })
+
+    def test_upload_appends_photos_in_one_insert(self):
+        """Test that several uploaded photos are inserted at once, after the existing ones"""
+        gallery.add_images(self.property, [self.upload('first.jpg', 'blue')])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.edit([self.upload('a.jpg', 'red'), self.upload('b.jpg', 'green')])
+        self.assertEqual(response.status_code, 302)
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "base_propertyimage"')]
+        self.assertEqual(len(inserts), 1)
+        photos = list(self.property.images.all())
+        self.assertEqual([photo.position for photo in photos], [0, 1, 2])
+        self.assertTrue(all(storage.is_blob(photo.image.name) for photo in photos))
+        self.assertEqual(MediaBlob.objects.get(name=photos[1].image.name).refs, 1)
+        self.assertEqual(Job.objects.filter(task='base.images.build').count(), 3)
+
+    def test_too_many_photos_rejected(self):
+        """Test that an upload of more than MAX_UPLOAD photos adds none"""
+        files = [self.upload(f'{i}.jpg') for i in range(gallery.MAX_UPLOAD + 1)]
+        response = self.edit(files)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'Upload at most {gallery.MAX_UPLOAD} photos at a time.')
+        self.assertFalse(PropertyImage.objects.exists())
+
+    def test_detail_gallery_queries_do_not_grow(self):
+        """Test that the detail page fetches its gallery with one prefetch query"""
+        gallery.add_images(self.property, [self.upload('a.jpg', 'red')])
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(reverse('property_detail', args=[self.property.id]))
+        gallery.add_images(self.property, [self.upload(f'{i}.jpg', (i, i, i)) for i in range(5)])
+        with CaptureQueriesContext(connection) as six:
+            response = self.client.get(reverse('property_detail', args=[self.property.id]))
+        self.assertContains(response, 'property__gallery')
+        self.assertEqual(len(six), len(one))
+
+    def test_card_falls_back_to_first_gallery_photo(self):
+        """Test that listings without a main image show their first gallery photo"""
+        added = gallery.add_images(self.property, [self.upload('a.jpg', 'red'), self.upload('b.jpg', 'blue')])
+        card = Property.objects.cards().get(pk=self.property.pk)
+        self.assertEqual(card.first_image, added[0].image.name)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, added[0].image.url)
+
+
+class MediaServeTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.blob = storage.media_storage.save('notes.txt', ContentFile(b'0123456789'))
+        self.url = reverse('media', args=[self.blob])
+
+    def test_whole_file_cached_forever(self):
+        """Test that a blob is served whole with an immutable Cache-Control"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'text/plain')
+
+    def test_conditional_request_not_modified(self):
+        """Test that a matching If-None-Match gets a 304 with the cache headers"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('max-age', response['Cache-Control'])
+
+    def test_byte_ranges(self):
+        """Test that single byte ranges are honoured and impossible ones refused"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_mutable_file_revalidated(self):
+        """Test that files not stored by content get a short max-age"""
+        with open(os.path.join(self.media.name, 'avatar.svg'), 'wb') as file:
+            file.write(b'<svg/>')
+        response = self.client.get(reverse('media', args=['avatar.svg']))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_missing_and_unsafe_paths_not_found(self):
+        """Test that traversal, directories and unfinished uploads are 404s"""
+        with open(storage.media_storage.path(self.blob) + '.abc.tmp', 'wb') as file:
+            file.write(b'partial')
+        for path in ['../settings.py', 'blobs', self.blob + '.abc.tmp', 'nope.jpg']:
+            self.assertEqual(self.client.get(reverse('media', args=[path])).status_code, 404, path)
+
+    def test_sendfile_offload(self):
+        """Test that MEDIA_SENDFILE hands the file to the web server"""
+        with self.settings(MEDIA_SENDFILE='X-Accel-Redirect', MEDIA_SENDFILE_URL='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.blob)
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
+        with self.settings(MEDIA_SENDFILE='X-Sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], storage.media_storage.path(self.blob))
+
+
+class StaticAssetsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.source = tempfile.TemporaryDirectory()
+        self.addCleanup(self.source.cleanup)
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.css = b'body { color: #2d2d39; }\n' * 200
+        os.mkdir(os.path.join(self.source.name, 'styles'))
+        with open(os.path.join(self.source.name, 'styles', 'site.css'), 'wb') as file:
+            file.write(self.css)
+        collected = override_settings(
+            STATIC_ROOT=self.root.name,
+            STATICFILES_DIRS=[self.source.name],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATICFILES_STORAGE='base.assets.CompressedManifestStaticFilesStorage',
+        )
+        collected.enable()
+        self.addCleanup(collected.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed = Template("{% load static %}{% static 'styles/site.css' %}").render(Context())
+
+    def test_collectstatic_writes_hashed_compressed_files(self):
+        """Test that collectstatic hashes names into the manifest and writes gzip siblings"""
+        self.assertRegex(self.hashed, r'^/static/styles/site\.[0-9a-f]{12}\.css$')
+        path = os.path.join(self.root.name, self.hashed.removeprefix('/static/'))
+        with open(path + '.gz', 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), self.css)
+
+    def test_precompressed_file_served(self):
+        """Test that a browser accepting gzip gets the sibling, cached for a year"""
+        response = self.client.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('immutable', response['Cache-Control'])
+        body = b''.join(response.streaming_content)
+        self.assertLess(len(body), len(self.css) // 10)
+        self.assertEqual(gzip.decompress(body), self.css)
+
+    def test_identity_and_unhashed_files(self):
+        """Test that other browsers get the file as is and unhashed names are revalidated"""
+        response = self.client.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.css)
+
+        response = self.client.get('/static/styles/site.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.hashed + '.gz').status_code, 404)
+
+
+class ActivityFeedTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123'
+        )
+        self.room = Room.objects.create(host=self.user, name='Room')
+
+    def post(self, count):
+        Message.objects.bulk_create([Message(user=self.user, room=self.room, body=f'Message {n}') for n in range(count)])
+        return list(Message.objects.order_by('-created', '-id').values_list('body', flat=True))
+
+    def shown(self, response):
+        return [message.body for message in response.context['room_messages']]
+
+    def test_page_cost_does_not_grow_with_history(self):
+        """Test that the activity page shows one window of messages in a fixed number of queries"""
+        self.client.login(username='testuser', password='testpass123')
+        self.post(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('activity'))
+        newest = self.post(views.ACTIVITY_PAGE_SIZE * 2)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('activity'))
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(self.shown(response), newest[:views.ACTIVITY_PAGE_SIZE])
+        self.assertContains(response, 'Older activity')
+
+    def test_fragment_continues_from_cursor(self):
+        """Test that the feed fragment returns the next window, without the page around it"""
+        newest = self.post(views.ACTIVITY_PAGE_SIZE + 5)
+        first = self.client.get(reverse('activity')).context['room_messages']
+        response = self.client.get(reverse('activity-feed'), {'cursor': first.next_cursor})
+        self.assertEqual(self.shown(response), newest[views.ACTIVITY_PAGE_SIZE:])
+        self.assertNotContains(response, '<main')
+        self.assertNotContains(response, 'Older activity')
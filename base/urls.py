@@ -27,4 +27,5 @@ urlpatterns = [
 
     path('topics/', views.topicsPage, name="topics"),
     path('activity/', views.activityPage, name="activity"),
+    path('activity/feed/', views.activityFeed, name="activity-feed"),
 ]
\ No newline at end of file
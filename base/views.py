@@ -1,12 +1,22 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch
 from django.http import HttpResponse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.contrib.auth import authenticate, login, logout
-from django.core.paginator import Paginator
-from .models import Room, Topic, Message, User, Property
+from django.views.decorators.http import condition
+from django.utils.http import urlencode
+from . import gallery
+from .models import Room, Topic, Message, User, Property, PropertyImage, PropertyTypeStats
 from .forms import RoomForm, UserForm, MyUserCreationForm, PropertyForm, PropertySearchForm
+from .pagination import KeysetPaginator, cursor_filters
+from .conditional import property_detail_etag
+from .facets import search_facets
+from .search_cache import search_page
+
+# Messages per activity feed page
+ACTIVITY_PAGE_SIZE = 20
 
 
 def loginPage(request):
@@ -67,44 +77,31 @@ def registerPage(request):
 
 
 def home(request):
-    # Property search functionality
-    form = PropertySearchForm(request.GET)
-    properties = Property.objects.filter(is_available=True).order_by('-created')
-    
-    if form.is_valid():
-        location = form.cleaned_data.get('location')
-        min_price = form.cleaned_data.get('min_price')
-        max_price = form.cleaned_data.get('max_price')
-        property_type = form.cleaned_data.get('property_type')
-        bedrooms = form.cleaned_data.get('bedrooms')
-        
-        if location:
-            properties = properties.filter(
-                Q(location__icontains=location) | Q(address__icontains=location)
-            )
-        if min_price:
-            properties = properties.filter(rent_amount__gte=min_price)
-        if max_price:
-            properties = properties.filter(rent_amount__lte=max_price)
-        if property_type:
-            properties = properties.filter(property_type=property_type)
-        if bedrooms:
-            properties = properties.filter(bedrooms__gte=bedrooms)
-    
-    # Pagination
-    paginator = Paginator(properties, 12)
-    page_number = request.GET.get('page')
-    properties = paginator.get_page(page_number)
-    
-    # Get some stats
-    total_properties = Property.objects.filter(is_available=True).count()
-    property_types = Property.objects.values_list('property_type', flat=True).distinct()
-    
+    # Property search functionality. A cursor carries the filters of the
+    # search it was issued for.
+    cursor = request.GET.get('cursor')
+    filters = cursor_filters(cursor)
+    if filters is None:
+        filters = PropertySearchForm.filters_from(request.GET)
+    form = PropertySearchForm(filters)
+    cleaned_data = form.cleaned_data if form.is_valid() else None
+    results = search_page(cleaned_data, cursor, filters)
+    facets = search_facets(cleaned_data)
+
+    # Listing stats are kept up to date by the Property signals
+    counts = PropertyTypeStats.counts()
+    rent_peak = max([bucket['count'] for bucket in facets['rent']] + [1])
+
     context = {
-        'properties': properties,
+        'properties': results.page,
         'form': form,
-        'total_properties': total_properties,
-        'property_types': property_types,
+        'search_query': urlencode(filters, doseq=True),
+        'estimated_total': results.estimated_total,
+        'total_is_estimate': results.total_is_estimate,
+        'total_properties': sum(counts.values()),
+        'property_types': [value for value, count in counts.items() if count],
+        'facets': facets,
+        'rent_histogram': [dict(bucket, percent=round(100 * bucket['count'] / rent_peak)) for bucket in facets['rent']],
     }
     return render(request, 'base/home.html', context)
 
@@ -225,18 +222,38 @@ def topicsPage(request):
     return render(request, 'base/topics.html', {'topics': topics})
 
 
+def activity_page(cursor):
+    # Newest first through the (created, id) index, so a page costs the same
+    # however long the history. Users and rooms are fetched by id afterwards:
+    # joined in with select_related, SQLite (without ANALYZE statistics)
+    # drives the query from base_room and sorts every message instead.
+    feed = Message.objects.prefetch_related('user', 'room').order_by('-created', '-id')
+    return KeysetPaginator(feed, ACTIVITY_PAGE_SIZE).get_page(cursor)
+
+
 def activityPage(request):
-    room_messages = Message.objects.all()
+    room_messages = activity_page(request.GET.get('cursor'))
     return render(request, 'base/activity.html', {'room_messages': room_messages})
 
 
+def activityFeed(request):
+    # The next page's messages alone, appended by the infinite scroll in property.js
+    room_messages = activity_page(request.GET.get('cursor'))
+    return render(request, 'base/activity_feed.html', {'room_messages': room_messages})
+
+
 # Property Views
+@condition(etag_func=property_detail_etag)
 def property_detail(request, pk):
-    property = get_object_or_404(Property, pk=pk, is_available=True)
-    related_properties = Property.objects.filter(
-        location__icontains=property.location,
+    property = get_object_or_404(
+        Property.objects.prefetch_related('amenity_tags', Prefetch('images', PropertyImage.objects.order_by('position', 'id'))),
+        pk=pk, is_available=True,
+    )
+    # Precomputed by base/similar.py, read through the (property, rank) index
+    related_properties = Property.objects.cards().filter(
+        similar_to__property=property,
         is_available=True
-    ).exclude(pk=pk)[:4]
+    ).order_by('similar_to__rank')
     
     context = {
         'property': property,
@@ -252,7 +269,9 @@ def add_property(request):
         if form.is_valid():
             property = form.save(commit=False)
             property.landlord = request.user
-            property.save()
+            with transaction.atomic():
+                property.save()
+                gallery.add_images(property, form.cleaned_data['gallery'])
             messages.success(request, 'Property added successfully!')
             return redirect('property_detail', pk=property.pk)
     else:
@@ -268,7 +287,9 @@ def edit_property(request, pk):
     if request.method == 'POST':
         form = PropertyForm(request.POST, request.FILES, instance=property)
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
+                gallery.add_images(property, form.cleaned_data['gallery'])
             messages.success(request, 'Property updated successfully!')
             return redirect('property_detail', pk=property.pk)
     else:
@@ -279,7 +300,9 @@ def edit_property(request, pk):
 
 @login_required(login_url='login')
 def my_properties(request):
-    properties = Property.objects.filter(landlord=request.user).order_by('-created')
+    properties = Property.objects.cards().filter(landlord=request.user).order_by('-created')
+    paginator = KeysetPaginator(properties, 12)
+    properties = paginator.get_page(request.GET.get('cursor'))
     return render(request, 'base/my_properties.html', {'properties': properties})
 
 
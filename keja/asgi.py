@@ -3,14 +3,53 @@ ASGI config for keja project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server, e.g. ``uvicorn keja.asgi:application``, to run
+the /api/async/ endpoints as async views. Django 4.1 still runs every query
+in one shared thread under ASGI, so measure with ``manage.py benchmark_api``
+before moving a deployment off keja.wsgi.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'keja.settings')
 
+
+class ASGIHandler(DjangoASGIHandler):
+    """Django's handler, reading streaming responses in the ORM's thread
+
+    Django 4.1 iterates a StreamingHttpResponse on the event loop, where the
+    querysets behind streamed rooms and exports raise SynchronousOnlyOperation.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        # Django sends the headers and the closing message of an empty stream;
+        # the parts go out just before that closing message
+        response.streaming_content = []
+
+        async def send_parts(message):
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                while (part := await next_part(parts, None)) is not None:
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send(message)
+
+        await super().send_response(response, send_parts)
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
+
+
 application = get_asgi_application()
@@ -86,6 +86,35 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # home() search result pages (base/search_cache.py). A change only
+    # invalidates the backend it runs against, so this has to be one shared
+    # by every worker process; until one is set here the cache is off:
+    #
+    #     'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    #     'LOCATION': 'redis://127.0.0.1:6379/1',
+    #     'TIMEOUT': 300,
+    #
+    # A single process, such as runserver, may use LocMemCache.
+    'search': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+
+# Geocoder for Property.location and the "near" search, a dotted path to a
+# callable taking free text and returning (latitude, longitude) or None.
+# The default looks names up in the local Place table.
+
+GEOCODER = 'base.geo.place_geocoder'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -121,8 +150,16 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
 STATIC_URL = '/static/'
+# collectstatic writes hashed, precompressed copies here (base/assets.py)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_STORAGE = 'base.assets.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Let the web server send media files (base/media.py): 'X-Accel-Redirect'
+# for nginx, with MEDIA_SENDFILE_URL an internal location aliasing
+# MEDIA_ROOT, or 'X-Sendfile' for Apache and lighttpd
+MEDIA_SENDFILE = None
+MEDIA_SENDFILE_URL = '/protected-media/'
 
 STATICFILES_DIRS = [
     BASE_DIR / 'static'
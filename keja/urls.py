@@ -1,7 +1,8 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from base import assets, media
+import re
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,5 +10,10 @@ urlpatterns = [
     path('api/', include('base.api.urls'))    
 ]
 
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Uploads, served by base/media.py (or handed to the web server, see
+# MEDIA_SENDFILE) in production as well as with DEBUG
+urlpatterns += [
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media.serve, name='media'),
+    # Collected static files, precompressed; runserver serves them itself with DEBUG
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), assets.serve, name='static'),
+]
@@ -116,4 +116,41 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
     });
+
+    // Activity feed infinite scroll: swap the "Older activity" link for the
+    // next page's fragment as it comes into view
+    function loadMoreActivity(more) {
+        if (more.dataset.loading) return;
+        more.dataset.loading = 'true';
+        fetch(more.dataset.fragment, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => {
+                if (!response.ok) throw new Error(response.statusText);
+                return response.text();
+            })
+            .then(html => {
+                more.insertAdjacentHTML('beforebegin', html);
+                const next = more.parentNode.querySelector('.activities__more:not([data-loading])');
+                more.remove();
+                if (next) watchActivity(next);
+            })
+            .catch(() => {
+                // Leave the plain link to the next page
+                delete more.dataset.fragment;
+            });
+    }
+
+    const activityObserver = 'IntersectionObserver' in window && new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting && entry.target.dataset.fragment) {
+                activityObserver.unobserve(entry.target);
+                loadMoreActivity(entry.target);
+            }
+        });
+    }, { rootMargin: '400px' });
+
+    function watchActivity(more) {
+        if (activityObserver) activityObserver.observe(more);
+    }
+
+    document.querySelectorAll('.activities__more[data-fragment]').forEach(watchActivity);
 });
\ No newline at end of file